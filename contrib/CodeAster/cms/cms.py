@@ -46,6 +46,13 @@
 
 #===============================================================================
 # LOG:
+# 2026-10-19: indentation fixed, so that the macro loads under Python 3 too
+# 2026-10-19: mass matrix decoding shared with dynforces (mbdyn_smos)
+# 2026-10-19: mesh handlers cached between calls, mass matrix fetched once
+# 2026-10-19: modal data file written an array at a time
+# 2026-10-19: mode shapes extracted in blocks of modes, vectorized
+# 2026-10-19: rigid-body inertia computed from a sparse mass matrix
+# 2026-10-19: open() instead of file(), also for Python 3
 # 2016-03-12: Support for Code_Aster 12.5.0 added by Reinhard Resch <mbdyn-user@a1.net>
 # 2008-08-30: fix TOUT = 'OUI' using 'ENV_SPHERE' (needs work)
 # 2008-08-25: release with MBDyn 1.3.4-Beta
@@ -77,6 +84,34 @@ from Utilitai.partition import *
 from Cata.cata import *
 from numpy import *
 from math import *
+import numpy
+
+# decoding of assembled matrices, shared with the other macros
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))));
+from mbdyn_smos import smos_matrix
+
+# number of modes extracted at once
+CMS_MODE_BLOCK = 100;
+
+# number of values formatted at once when writing arrays
+CMS_WRITE_CHUNK = 1 << 16;
+
+# MAIL_PY handlers of the meshes, by name, shared by the macro calls
+# (e.g. one per substructure of the same mesh)
+# NOTE: a mesh is read again when a group of nodes is not found,
+#	e.g. after DEFI_GROUP; meshes otherwise modified between calls
+#	(e.g. by MODI_MAILLAGE) need force = 1
+cms_mail_cache = {};
+
+def cms_mail_py(maillage, group = None, force = 0):
+	mm = cms_mail_cache.get(maillage.nom);
+	if (force or (mm == None) or ((group != None) and (group not in mm.gno))):
+		mm = MAIL_PY();
+		mm.FromAster(maillage);
+		cms_mail_cache[maillage.nom] = mm;
+	return mm;
 
 #===============================================================================
 # NOTE: this function is basically extracted from example sdll123a,
@@ -85,293 +120,147 @@ from math import *
 
 # extract the diagonal of the mass matrix for each node listed in exposed_id
 def cms_diag_mass(matrrr, exposed_id):
-	# construction des vecteurs jeveux
-	nommatr = matrrr.nom;
-	lenm = len(nommatr);
-	nommatr = nommatr + ' '*(8 - lenm + 1);
-	vectrav = nommatr + '          .REFA        ';
-	nom = aster.getvectjev(vectrav);
-	nomnume = nom[1];
-	typm = nom[8];
-	assert(typm[0:2] == 'MS');
-	lenm = len(nomnume);
-	nomnume = nomnume[0:9];
-
-	nvar = nommatr + '          .VALM';
-	nadia = nomnume + '     .SMOS.SMDI        ';
-	nrtt = nomnume + '     .NUME.DELG        ';
-	nrtt2 = nomnume + '     .NUME.DEEQ        ';
-
-	var = aster.getcolljev(nvar);
-	adia = aster.getvectjev(nadia);
-	rtt = aster.getvectjev(nrtt);
-	rtt2 = aster.getvectjev(nrtt2);
-
-	"""
-	print "####################################################";
-	print "####################################################";
-	print "####################################################";
-	print "####################################################";
-	print "typm = %s" % typm;
-	print "var:";
-	print var;
-	print "####################################################";
-	print "adia:";
-	print adia;
-	print "####################################################";
-	print "rtt:";
-	print rtt;
-	print "####################################################";
-	print "rtt2:";
-	print rtt2;
-	print "####################################################";
-	print "####################################################";
-	print "####################################################";
-	print "####################################################";
-	"""
-
-	valr = var[1];
-
-	vc = len(rtt);
-
-	nexposed = len(exposed_id);
-	nnodes = 0;
-	for ii in range(vc):
-		if (rtt2[2*ii] > 0) and (rtt2[2*ii+1] == 1):
-			nnodes = nnodes + 1;
-
-	nodes_id = zeros([nnodes, 6], int);
-	for ii in range(vc):
-		if (rtt2[2*ii] > 0) and (rtt2[2*ii+1] > 0):
-			nodes_id[rtt2[2*ii] - 1][rtt2[2*ii+1] - 1] = adia[ii];
-
-	diagm = zeros([nexposed, 6], double);
-	for rr in range(nexposed):
-		assert(exposed_id[rr] <= nnodes);
-		for cc in range(6):
-			ii = nodes_id[exposed_id[rr]][cc];
-			if (ii > 0):
-				diagm[rr][cc] = valr[ii - 1];
-
-	return diagm;
+	return smos_matrix(matrrr).nodal_diag(exposed_id);
 # end of cms_diag_mass
 
-# compute the rigid-body inertia matrix
-def cms_rigb_mass(matrrr, coord):
-	# construction des vecteurs jeveux
-	nommatr = matrrr.nom;
-	lenm = len(nommatr);
-	nommatr = nommatr + ' '*(8 - lenm + 1);
-	vectrav = nommatr + '          .REFA        ';
-	nom = aster.getvectjev(vectrav);
-	nomnume = nom[1];
-	typm = nom[8];
-	assert(typm[0:2] == 'MS');
-	lenm = len(nomnume);
-	nomnume = nomnume[0:9];
-
-	nvar = nommatr + '          .VALM';
-	nadia = nomnume + '     .SMOS.SMDI        ';
-	nnuml = nomnume + '     .SMOS.SMHC        ';
-	nrtt = nomnume + '     .NUME.DELG        ';
-	nrtt2 = nomnume + '     .NUME.DEEQ        ';
-
-	var = aster.getcolljev(nvar);
-	adia = aster.getvectjev(nadia);
-	numl = aster.getvectjev(nnuml);
-	rtt = aster.getvectjev(nrtt);
-	rtt2 = aster.getvectjev(nrtt2);
-
-	"""
-	print "####################################################";
-	print "####################################################";
-	print "####################################################";
-	print "####################################################";
-	print "typm = %s" % typm;
-	print "var:";
-	print var;
-	print "####################################################";
-	print "adia:";
-	print adia;
-	print "####################################################";
-	print "numl:";
-	print numl;
-	print "####################################################";
-	print "rtt:";
-	print rtt;
-	print "####################################################";
-	print "rtt2:";
-	print rtt2;
-	print "####################################################";
-	print "####################################################";
-	print "####################################################";
-	print "####################################################";
-	"""
-
-	# array containing mass matrix values
-	valr = var[1];
-
-	# number of ddl
-	vc = len(rtt);
-
-	# make room for rigid body mass matrix
-	rigbm = zeros([6, 6], double);
-
-	# make room for nodal rigid body motion matrices
-	Zi = zeros([6, 6], double);
-	Zj = zeros([6, 6], double);
-
-	# initialize the diagonal
-	for kk in range(6):
-		Zi[kk][kk] = 1.;
-		Zj[kk][kk] = 1.;
-
-	ni_cur = -1;
-	nj_cur = -1;
-
-	for ii in range(vc):
-		# skip Lagrange multipliers
-
-		# node number (1 to nnodes)
-		ni = rtt2[2*ii];
-		if (ni <= 0):
-			continue;
-
-		# component number (1 to 6)
-		ci = rtt2[2*ii + 1];
-		if (ci <= 0):
-			continue;
-
-		# deal with self contribution to matrix
-		if (ni_cur != ni):
-			ni_cur = ni;
-			xi = coord[ni - 1][0];
-			yi = coord[ni - 1][1];
-			zi = coord[ni - 1][2];
-
-			Zi[0][4] = -zi;
-			Zi[0][5] = yi;
-			Zi[1][3] = zi;
-			Zi[1][5] = -xi;
-			Zi[2][3] = -yi;
-			Zi[2][4] = xi;
-
-		# index of diagonal entry of this ddl (base 1)
-		ai = adia[ii];
-
-		# contribution of this ddl
-		dm = valr[ai - 1];
-
-		# rigbm = rigbm + ZiT*M*Zi;
-		for rr in range(6):
-			for cc in range(6):
-				rigbm[rr][cc] = rigbm[rr][cc] + dm*Zi[ci - 1][rr]*Zi[ci - 1][cc];
-
-		# first ddl only
-		if (ii == 0):
-			continue;
-
-		# index of diagonal entry of previous ddl (base 1)
-		aim1 = adia[ii - 1];
-
-		# array of indexes connected to ai
-		# NOTE: use aim1 as array lower bound (included) because arrays are 0-based, while aim1 is 1-based)
-		# NOTE: skip numl[ai] because we already considered it (it's the diagonal term) (upper bound is excluded)
-		air = numl[aim1:ai - 1];
-		lair = len(air);
-
-		# check whether any of the previous ddls is connected to ai
-		for jj in range(ii):
-			# skip Lagrange multipliers
-
-			# node number (1 to nnodes)
-			nj = rtt2[2*jj];
-			if (nj <= 0):
-				continue;
-
-			# component number (1 to 6)
-			cj = rtt2[2*jj + 1];
-			if (cj <= 0):
-				continue;
-
-			# index of diagonal entry of this ddl (base 1)
-			aj = adia[jj];
-
-			# ignore if this ddl (jj + 1) is not connected to ai
-			if ((jj + 1) not in air):
-				continue;
-
-			# find the index of the connecting coefficient
-			gotit = 0;
-			for kk in range(lair):
-				if (air[kk] == (jj + 1)):
-					gotit = 1;
-					break;
+# nodal rigid body motion matrix rows of each ddl:
+# the rigid body displacement of ddl ii is Z[ii]*{u0, phi0}
+def cms_rigb_modes(rtt2, coord):
+	deeq = asarray(rtt2, int).reshape(len(rtt2)//2, 2);
+	ni = deeq[:, 0];
+	ci = deeq[:, 1];
+
+	Z = zeros([len(deeq), 6], double);
 
-			assert(gotit == 1);
+	# skip Lagrange multipliers and non-standard components
+	idx = nonzero((ni > 0) & (ci > 0) & (ci <= 6))[0];
+	ni = ni[idx];
+	ci = ci[idx];
+	Z[idx, ci - 1] = 1.;
 
-			# contribution of this ddl coupled with ii
-			dm = valr[aim1 + kk];
+	xyz = asarray(coord, double)[ni - 1];
+	for c, r, v in ((1, 4, -xyz[:, 2]), (1, 5, xyz[:, 1]),
+			(2, 3, xyz[:, 2]), (2, 5, -xyz[:, 0]),
+			(3, 3, -xyz[:, 1]), (3, 4, xyz[:, 0])):
+		sel = (ci == c);
+		Z[idx[sel], r] = v[sel];
 
-			# deal with cross-contribution to matrix
-			if (nj_cur != nj):
-				nj_cur = nj;
-				xj = coord[nj - 1][0];
-				yj = coord[nj - 1][1];
-				zj = coord[nj - 1][2];
+	return Z;
+# end of cms_rigb_modes
 
-				Zj[0][4] = -zj;
-				Zj[0][5] = yj;
-				Zj[1][3] = zj;
-				Zj[1][5] = -xj;
-				Zj[2][3] = -yj;
-				Zj[2][4] = xj;
+# compute the rigid-body inertia matrix
+def cms_rigb_mass(matrrr, coord):
+	# mass matrix, decoded once
+	sm = smos_matrix(matrrr);
 
-			# rigbm = rigbm + ZiT*M*Zj + ZjT*MT*Zi;
-			for rr in range(6):
-				for cc in range(6):
-					rigbm[rr][cc] = rigbm[rr][cc] + \
-						dm*(Zj[cj - 1][rr]*Zi[ci - 1][cc] + Zi[ci - 1][rr]*Zj[cj - 1][cc]);
+	# rigid body motion of each ddl
+	Z = cms_rigb_modes(sm.rtt2, coord);
+
+	# rigbm = ZT*M*Z
+	rigbm = dot(Z.T, sm.mm.dot(Z));
 
 	return rigbm;
 # end of cms_rigb_mass
 
 def cms_extract_mode_shape(_sd_tab, eps):
 	# extract normal modes or static mode shapes
-	# NOTE: each array is actually a matrix, containing the number of the mode
-	#	in the first column, and the value in the second column; for example,
-	#	for a three nodes model:
-	#	sd_dx = [ 0, dx_mode0_node0 ]
-	#		[ 0, dx_mode0_node1 ]
-	#		[ 0, dx_mode0_node2 ]
-	#		[ 1, dx_mode1_node0 ]
-	#		[ 1, dx_mode1_node1 ]
-	#		[ 1, dx_mode1_node2 ]
-	#		[ ... ]
-	#	couldn't do anything more synthetic...
-
-        dof_names = ('DX','DY','DZ','DRX','DRY','DRZ');
-        
-        for j in range(len(dof_names)):
-                sd=_sd_tab.EXTR_TABLE().Array('NUME_ORDRE', dof_names[j]);
-                
-                if j == 0:
-                        modes=zeros([sd.shape[0], len(dof_names)], double);
-                        
-                for i in range(modes.shape[0]):
-                        val = sd[i, 1];
-
-                        # This might be helpful in case of modal shape values close to zero at the modal node
-                        if (abs(val) < eps):
-                                val = 0.;
-
-                        # If the node does not have rotational degrees of freedom we get nan
-                        if (isnan(val)):
-                                val = 0.;
-                                
-                        modes[i, j] = val;
-        
-        return modes;
+	# NOTE: the table contains one row per mode and node, with the number
+	#	of the mode in column NUME_ORDRE and the components in columns
+	#	DX, ..., DRZ; the nodes are listed in the same order for each mode.
+	#	Returns an array [modes, nodes, 6].
+
+	dof_names = ('DX','DY','DZ','DRX','DRY','DRZ');
+
+	cols = _sd_tab.EXTR_TABLE().values();
+	nume = asarray(cols['NUME_ORDRE'], int);
+	nrows = len(nume);
+	if (nrows == 0):
+		return zeros([0, 0, len(dof_names)], double);
+
+	nmodes = len(unique(nume));
+	assert(nrows % nmodes == 0);
+	nnodes = nrows//nmodes;
+
+	modes = zeros([nrows, len(dof_names)], double);
+	for j in range(len(dof_names)):
+		if dof_names[j] in cols:
+			# missing values become nan
+			modes[:, j] = asarray(cols[dof_names[j]], double);
+
+	# group the rows by mode, preserving the order of the nodes
+	modes = modes[argsort(nume, kind = 'mergesort')].reshape(nmodes, nnodes, len(dof_names));
+
+	# This might be helpful in case of modal shape values close to zero at the modal node
+	modes[abs(modes) < eps] = 0.;
+
+	# If the node does not have rotational degrees of freedom we get nan
+	modes[numpy.isnan(modes)] = 0.;
+
+	return modes;
+
+# extract the shapes nume_ordre (base 1) of sol at the nodes of group
+# cms_exposed, with a single table for all of them
+def cms_mode_shapes(sol, cms_exposed, nume_ordre, title, eps):
+	from Accas import _F
+
+	_sd_tab = POST_RELEVE_T( ACTION = _F(INTITULE = title,
+					GROUP_NO = cms_exposed,
+					RESULTAT = sol,
+					NOM_CHAM = 'DEPL',
+					NUME_ORDRE = tuple(nume_ordre),
+					TOUT_CMP = 'OUI',
+					OPERATION = 'EXTRACTION' ) );
+
+	modes = cms_extract_mode_shape(_sd_tab, eps);
+	del _sd_tab;
+
+	return modes;
+
+# write the 2D array a, one row per line, each value formatted with fmt
+# NOTE: rows are formatted CMS_WRITE_CHUNK values at a time, with a single
+#	format operation, so large arrays are streamed to outf
+def cms_write_array(outf, a, fmt):
+	a = asarray(a, double);
+	if (a.ndim == 1):
+		a = a.reshape(a.shape[0], 1);
+	nrows = a.shape[0];
+	ncols = a.shape[1];
+	if ((nrows == 0) | (ncols == 0)):
+		return;
+
+	line = fmt*ncols + "\n";
+	step = CMS_WRITE_CHUNK//ncols + 1;
+	for r in range(0, nrows, step):
+		block = a[r:r + step];
+		outf.write((line*block.shape[0]) % tuple(block.ravel().tolist()));
+
+# write the values of v, per_line values per line
+# NOTE: no values still make an empty line
+def cms_write_values(outf, v, fmt, per_line):
+	v = asarray(v, double).ravel();
+	if (len(v) == 0):
+		outf.write("\n");
+		return;
+	n = (len(v)//per_line)*per_line;
+	cms_write_array(outf, v[0:n].reshape(n//per_line, per_line), fmt);
+	if (n < len(v)):
+		cms_write_array(outf, v[n:].reshape(1, len(v) - n), fmt);
+
+# write the square matrix a, one row per line
+# NOTE: MBDyn reads full matrices; when a is diagonal (e.g. the generalized
+#	matrices of normal modes) only the diagonal is formatted, the rows
+#	are assembled from the formatted zero (unless some zero is -0.)
+def cms_write_matrix(outf, a, fmt):
+	a = asarray(a, double);
+	d = a.diagonal();
+	if ((count_nonzero(a) != count_nonzero(d)) or signbit(a[a == 0.]).any()):
+		cms_write_array(outf, a, fmt);
+		return;
+
+	n = len(d);
+	zero = fmt % 0.0;
+	for r in range(n):
+		outf.write(zero*r + fmt % d[r] + zero*(n - r - 1) + "\n");
 
 # write CMS data in MBDyn format
 def cms_write_mbdyn(data, maillage, cms_interface, cms_exposed_fact, \
@@ -386,7 +275,7 @@ def cms_write_mbdyn(data, maillage, cms_interface, cms_exposed_fact, \
 	diag_mass = (data[2] == 'OUI');
 	rigb_mass = (data[3] == 'OUI');
 
-        eps = data[4];
+	eps = data[4];
         
 	# "cook" format specifiers based on precision
 	IFMT = "%" + str(precision) + "d";
@@ -401,7 +290,7 @@ def cms_write_mbdyn(data, maillage, cms_interface, cms_exposed_fact, \
 	# 	print "*** WARNING: MBDyn modal element data file needs absolute path"
 	# 	print "***          file=\"" + data[0] + "\"";
 	# 	print "***";
-	outf = file(data[0], 'w');
+	outf = open(data[0], 'w');
 
 	if (cms_exposed_fact['GROUP_NO'] != None):
 		cms_exposed = cms_exposed_fact['GROUP_NO'];
@@ -415,44 +304,44 @@ def cms_write_mbdyn(data, maillage, cms_interface, cms_exposed_fact, \
 
 		# NOTE: hack to find out whether a mesh is 2D or 3D
 		# create handler for mesh
-		mm = MAIL_PY();
-		mm.FromAster(maillage);
+		mm = cms_mail_py(maillage);
+
+		# NOTE: the group is created by the first call on this mesh
+		if (cms_exposed not in mm.gno):
+			# Coordonnees des noeuds
+			coord = mm.cn;
+
+			is_3D = 0;
+			z0 = coord[0][2];
+			for nn in range(1, mm.dime_maillage[0] - 1):
+				if (coord[nn][2] != z0):
+					is_3D = 1;
+					break;
 
-		# Coordonnees des noeuds
-		coord = mm.cn;
-
-		is_3D = 0;
-		z0 = coord[0][2];
-		for nn in range(1, mm.dime_maillage[0] - 1):
-			if (coord[nn][2] != z0):
-				is_3D = 1;
-				break;
-
-		if is_3D:
-			# FIXME: only works if model is truly 3D :-(
-			# TODO: test whether the mesh is 2D or z_cst
-			_ma = DEFI_GROUP(reuse = _ma,
-					 MAILLAGE = _ma,
-						CREA_GROUP_NO = ( _F(
-							NOM = cms_exposed,
-							OPTION = 'ENV_SPHERE',
-							POINT = ( 0.0, 0.0, 0.0 ),
-							RAYON = 1.e+38,
-							PRECISION = ( 1.e+38 ) ) ) );
-		else:
-			_ma = DEFI_GROUP(reuse = _ma,
-					 MAILLAGE = _ma,
-						CREA_GROUP_NO = ( _F(
-							NOM = cms_exposed,
-							OPTION = 'ENV_SPHERE',
-							POINT = ( 0.0, 0.0 ),
-							RAYON = 1.e+38,
-							PRECISION = ( 1.e+38 ) ) ) );
-		maillage = _ma;
-
-	# create handler for mesh
-	mm = MAIL_PY();
-	mm.FromAster(maillage);
+			if is_3D:
+				# FIXME: only works if model is truly 3D :-(
+				# TODO: test whether the mesh is 2D or z_cst
+				_ma = DEFI_GROUP(reuse = _ma,
+						 MAILLAGE = _ma,
+							CREA_GROUP_NO = ( _F(
+								NOM = cms_exposed,
+								OPTION = 'ENV_SPHERE',
+								POINT = ( 0.0, 0.0, 0.0 ),
+								RAYON = 1.e+38,
+								PRECISION = ( 1.e+38 ) ) ) );
+			else:
+				_ma = DEFI_GROUP(reuse = _ma,
+						 MAILLAGE = _ma,
+							CREA_GROUP_NO = ( _F(
+								NOM = cms_exposed,
+								OPTION = 'ENV_SPHERE',
+								POINT = ( 0.0, 0.0 ),
+								RAYON = 1.e+38,
+								PRECISION = ( 1.e+38 ) ) ) );
+			maillage = _ma;
+
+	# create handler for mesh (read again if the group was just created)
+	mm = cms_mail_py(maillage, cms_exposed);
 
 	# Coordonnees des noeuds
 	coord = mm.cn;
@@ -476,145 +365,85 @@ def cms_write_mbdyn(data, maillage, cms_interface, cms_exposed_fact, \
 
 	# record 2
 	outf.write("** RECORD GROUP 2, FINITE ELEMENT NODE LIST\n")
-	l = 0
-	while l < nexposed:
-		if ((l > 0) & ((l % 6) == 0)):
-			outf.write("\n");
-		outf.write(" " + linomno[exposed_id[l]]);
-		l = l + 1;
-	outf.write("\n");
+	names = [" " + linomno[exposed_id[l]] for l in range(nexposed)];
+	for l in range(0, nexposed, 6):
+		outf.write("".join(names[l:l + 6]) + "\n");
 	outf.write("**\n");
 
 	# record 3 (optional, default to zero, so could be omitted)
 	outf.write("** RECORD GROUP 3, INITIAL MODAL DISPLACEMENTS\n");
-	for m in range(nshapes):
-		if ((m > 0) & ((m % 6) == 0)):
-			outf.write("\n");
-		outf.write(RFMT % 0.0);
-	outf.write("\n");
+	cms_write_values(outf, zeros(nshapes, double), RFMT, 6);
 	outf.write("**\n");
 
 	# record 4 (optional, default to zero, so could be omitted)
 	outf.write("** RECORD GROUP 4, INITIAL MODAL VELOCITIES\n");
-	for m in range(nshapes):
-		if ((m > 0) & ((m % 6) == 0)):
-			outf.write("\n");
-		outf.write(RFMT % 0.0);
-	outf.write("\n");
+	cms_write_values(outf, zeros(nshapes, double), RFMT, 6);
 	outf.write("**\n");
 
+	xyz = asarray(coord, double)[asarray(exposed_id, int)];
+
 	# record 5
 	outf.write("** RECORD GROUP 5, NODAL X COORDINATES\n");
-	n = 0;
-	while n < nexposed:
-		outf.write((RFMT + "\n") % coord[exposed_id[n]][0]);
-		n = n + 1;
+	cms_write_array(outf, xyz[:, 0], RFMT);
 	outf.write("**\n");
 
 	# record 6
 	outf.write("** RECORD GROUP 6, NODAL Y COORDINATES\n");
-	n = 0;
-	while n < nexposed:
-		outf.write((RFMT + "\n") % coord[exposed_id[n]][1]);
-		n = n + 1;
+	cms_write_array(outf, xyz[:, 1], RFMT);
 	outf.write("**\n");
 
 	# record 7
 	outf.write("** RECORD GROUP 7, NODAL Z COORDINATES\n");
-	n = 0;
-	while n < nexposed:
-		outf.write((RFMT + "\n") % coord[exposed_id[n]][2]);
-		n = n + 1;
+	cms_write_array(outf, xyz[:, 2], RFMT);
 	outf.write("**\n");
 
 	# record 8
 	outf.write("** RECORD GROUP 8, MODE SHAPES\n");
 
-	for m in range(ndynamic):
-                idx = 0;
-                _sd_tab = POST_RELEVE_T( ACTION = _F(INTITULE = 'Normal modes',
-						GROUP_NO = cms_exposed,
-						RESULTAT = sol_dynamic,
-						NOM_CHAM = 'DEPL',
-					             NUME_ORDRE = (m + 1,),
-						TOUT_CMP = 'OUI',
-						OPERATION = 'EXTRACTION' ) );
-
-                # extract normal modes
-                modes_sd = cms_extract_mode_shape(_sd_tab, eps);
-                
-		outf.write("**    NORMAL MODE SHAPE #  %d\n" % (m + 1));
-		n = 0;
-		while n < nexposed:
-                        for j in range(modes_sd.shape[1]):
-                                outf.write(RFMT % modes_sd[idx, j]);
-                                
-                        outf.write("\n");
-                        
-			n = n + 1;
-			idx = idx + 1;
-
-                del _sd_tab;
-                del modes_sd;
-
-
-	if nstatic > 0:
-		for m in range(nstatic):
-                        _ss_tab = POST_RELEVE_T(ACTION = _F(INTITULE = 'Static Shapes',
-							GROUP_NO = cms_exposed,
-							RESULTAT = sol_static,
-                                                            NUME_ORDRE = (m + 1,),
-							NOM_CHAM = 'DEPL',
-							TOUT_CMP = 'OUI',
-							OPERATION = 'EXTRACTION' ) );
-
-                        # extract static shapes
-                        modes_ss = cms_extract_mode_shape(_ss_tab, eps);
-
-		idx = 0;
-			outf.write("**    NORMAL MODE SHAPE #  %d (STATIC SHAPE #  %d)\n" % (ndynamic + m + 1, m + 1));
-			n = 0;
-			while n < nexposed:
-                                for j in range(modes_ss.shape[1]):
-                                        outf.write(RFMT % modes_ss[idx, j]);
-                                
-                                outf.write("\n");
-                        
-				n = n + 1;
-				idx = idx + 1;
-
-                        del _ss_tab;
-                        del modes_ss;
+	# NOTE: shapes are extracted CMS_MODE_BLOCK at a time
+	for m0 in range(0, ndynamic, CMS_MODE_BLOCK):
+		nume = range(m0 + 1, ndynamic + 1)[0:CMS_MODE_BLOCK];
+		modes_sd = cms_mode_shapes(sol_dynamic, cms_exposed, nume, 'Normal modes', eps);
+		assert(modes_sd.shape[1] == nexposed);
+
+		for m in range(len(nume)):
+			outf.write("**    NORMAL MODE SHAPE #  %d\n" % nume[m]);
+			cms_write_array(outf, modes_sd[m], RFMT);
+
+		del modes_sd;
+
+	for m0 in range(0, nstatic, CMS_MODE_BLOCK):
+		nume = range(m0 + 1, nstatic + 1)[0:CMS_MODE_BLOCK];
+		modes_ss = cms_mode_shapes(sol_static, cms_exposed, nume, 'Static Shapes', eps);
+		assert(modes_ss.shape[1] == nexposed);
+
+		for m in range(len(nume)):
+			outf.write("**    NORMAL MODE SHAPE #  %d (STATIC SHAPE #  %d)\n" % (ndynamic + nume[m], nume[m]));
+			cms_write_array(outf, modes_ss[m], RFMT);
+
+		del modes_ss;
 
 	outf.write("**\n");
 
 	# record 9
 	outf.write("** RECORD GROUP 9, MODAL MASS MATRIX\n");
-	for r in range(nshapes):
-		for c in range(nshapes):
-			outf.write(RFMT % macm[r, c]);
-		outf.write("\n");
+	cms_write_matrix(outf, macm, RFMT);
 	outf.write("**\n");
 
 	# record 10
 	outf.write("** RECORD GROUP 10, MODAL STIFFNESS MATRIX\n");
-	for r in range(nshapes):
-		for c in range(nshapes):
-			outf.write(RFMT % mack[r, c]);
-		outf.write("\n");
+	cms_write_matrix(outf, mack, RFMT);
 	outf.write("**\n");
 
 	# NOTE: records 11 and 12 used to be mutually exclusive;
 	#	anyway, this macro allows to set both
+	# NOTE: the mass matrix is decoded once for both (see mbdyn_smos)
 	if diag_mass:
 		# record 11
 		outf.write("** RECORD GROUP 11, DIAGONAL OF LUMPED MASS MATRIX\n");
 		diagm = cms_diag_mass(mmass, exposed_id);
 
-		for n in range(nexposed):
-			for c in range(6):
-				outf.write(RFMT % diagm[n][c]);
-			outf.write("\n");
+		cms_write_array(outf, diagm, RFMT);
 		outf.write("**\n");
 
 	if rigb_mass:
@@ -657,7 +486,7 @@ def cms_write(gen_model, mmass, maillage, cms_interface, cms_exposed_fact, sol_d
 		ndynamic = options['NMAX_FREQ'];
 		gen_k = gen_model.EXTR_MATR_GENE( 'RIGI_GENE' );
 		gen_m = gen_model.EXTR_MATR_GENE( 'MASS_GENE' );
-                nshapes = gen_k.shape[0];
+		nshapes = gen_k.shape[0];
 		nstatic = nshapes - ndynamic;
 
 		rc = cms_write_mbdyn(data, maillage, cms_interface, cms_exposed_fact, \
@@ -698,7 +527,7 @@ def cms_ops(self, MAILLAGE, INTERFACE, EXPOSED, MODELE, CARA_ELEM, CHAM_MATER, C
 		precision = out['PRECISION'];
 		diag_mass = out['DIAG_MASS'];
 		rigb_mass = out['RIGB_MASS'];
-                epsilon = out['MODE_SHAPE_EPSILON'];
+		epsilon = out['MODE_SHAPE_EPSILON'];
 		data = (fichier, precision, diag_mass, rigb_mass, epsilon);
 	else:
 		ier = 1;
@@ -768,10 +597,10 @@ def cms_ops(self, MAILLAGE, INTERFACE, EXPOSED, MODELE, CARA_ELEM, CHAM_MATER, C
 	_matassm = ASSE_MATRICE(MATR_ELEM = _matlocm,
 	                        NUME_DDL = _num);
 
-        _matassmdiag = ASSE_MATRICE(MATR_ELEM = _matmdiag,
+	_matassmdiag = ASSE_MATRICE(MATR_ELEM = _matmdiag,
 	                            NUME_DDL = _num);
 
-        _sol_dyn=CALC_MODES(TYPE_RESU='DYNAMIQUE',
+	_sol_dyn=CALC_MODES(TYPE_RESU='DYNAMIQUE',
                             OPTION='PLUS_PETITE',
                             SOLVEUR_MODAL=_F(METHODE='TRI_DIAG',
                                              DIM_SOUS_ESPACE=5*cms_nmax_freq,),
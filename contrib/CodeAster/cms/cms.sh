@@ -27,6 +27,7 @@ MBDYNSRCDIR="/home/masarati/Lavoro/mbdyn/mbdyn-src"
 
 ASTERCMD="$ASTERBINPATH/as_run"
 WORKDIR="$MBDYNSRCDIR/contrib/CodeAster/cms"
+RESUDIR="$WORKDIR"
 EXPORTINFNAME="cms.export.in"
 EXPORTFNAME="${FNAME}.export"
 COMMFNAME="${FNAME}.comm"
@@ -34,6 +35,7 @@ COMMFNAME="${FNAME}.comm"
 cat "$EXPORTINFNAME" | sed \
 	-e "s;@ASTERVERSION@;$ASTERVERSION;g" \
 	-e "s;@WORKDIR@;$WORKDIR;g" \
+	-e "s;@RESUDIR@;$RESUDIR;g" \
 	-e "s;@COMMFNAME@;$COMMFNAME;g" \
 	-e "s;@MAILFNAME@;$MAILFNAME;g" \
 	> "$EXPORTFNAME"
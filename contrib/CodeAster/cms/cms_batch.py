@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# $Header$
+#
+# MBDyn (C) is a multibody analysis code.
+# http://www.mbdyn.org
+#
+# Copyright (C) 1996-2023
+#
+# Pierangelo Masarati	<pierangelo.masarati@polimi.it>
+# Paolo Mantegazza	<paolo.mantegazza@polimi.it>
+#
+# Dipartimento di Ingegneria Aerospaziale - Politecnico di Milano
+# via La Masa, 34 - 20156 Milano, Italy
+# http://www.aero.polimi.it
+#
+# Changing this copyright notice is forbidden.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation (version 2 of the License).
+#
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Run the CMS reduction of several substructures concurrently.
+
+Each substructure is a command file (and a mesh) processed by its own
+Code Aster run, as cms.sh does for one; up to --jobs runs are executed
+at the same time, each with its own export file and result directory
+(<resudir>/<name>/x.mess, ...), so their outputs do not clash:
+
+	python cms_batch.py --jobs 4 cms00000.comm cms00003.comm wing.comm:wing.mail
+	python cms_batch.py 0 3 4	# ./cms00000/cms00000.fem, ./cms00003/cms00003.fem, ...
+
+Each run is given its own modal data file, <resudir>/<name>/<name>.fem,
+in the environment variable MBDYN_CMS_OUT, which the cmsNNNNN.comm
+examples use as their output file name (cms.sh leaves it unset: they
+write /tmp/mbdyn.fem).  Command files that do not use
+it must write their modal data to a file of their own: runs whose
+command files name the same output file are refused.
+
+A substructure is given as a command file, optionally followed by
+":" and its mesh file, or as the number of a cmsNNNNN.comm example; the
+mesh defaults, as in cms.sh, to <name>.mail if it exists, else cms.mail.
+Several substructures of the same mesh can also be reduced by calls
+of the CMS macro in a single command file: the mesh handlers and the
+group of all nodes are then shared between the calls.
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+# export file template, next to this script
+EXPORT_IN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cms.export.in');
+
+def cms_batch_job(spec):
+	# (name, command file, mesh file) of a substructure
+	if (spec.isdigit()):
+		spec = "cms%05d.comm" % int(spec);
+	if (':' in spec):
+		comm, mail = spec.split(':', 1);
+	else:
+		comm = spec;
+		mail = None;
+	comm = os.path.abspath(comm);
+	name = os.path.splitext(os.path.basename(comm))[0];
+	if (mail == None):
+		mail = os.path.splitext(comm)[0] + '.mail';
+		if (not os.path.exists(mail)):
+			mail = os.path.join(os.path.dirname(comm), 'cms.mail');
+	return (name, comm, os.path.abspath(mail));
+
+# output file named in a command file that does not use MBDYN_CMS_OUT
+CMS_OUTPUT = re.compile(r'(?:cms_outfname|FICHIER)\s*=\s*["\']([^"\']+)["\']');
+
+def cms_batch_output(comm):
+	# output file written by the command file comm, if not its own
+	f = open(comm);
+	text = f.read();
+	f.close();
+	if ('MBDYN_CMS_OUT' in text):
+		return None;
+	m = CMS_OUTPUT.search(text);
+	if (m == None):
+		return None;
+	return os.path.abspath(m.group(1));
+
+def cms_batch_export(template, version, comm, mail, resudir):
+	# export file of a run, from the template of cms.sh
+	out = template;
+	for key, val in (('@ASTERVERSION@', version),
+			('@WORKDIR@/@COMMFNAME@', comm),
+			('@WORKDIR@/@MAILFNAME@', mail),
+			('@RESUDIR@', resudir)):
+		out = out.replace(key, val);
+	return out;
+
+def cms_batch_run(job):
+	name, comm, mail, as_run, version, resudir, template = job;
+	resudir = os.path.join(resudir, name);
+	if (not os.path.isdir(resudir)):
+		os.makedirs(resudir);
+	export = os.path.join(resudir, name + '.export');
+	f = open(export, 'w');
+	f.write(cms_batch_export(template, version, comm, mail, resudir));
+	f.close();
+
+	# modal data file of this run (see cms00000.comm)
+	env = dict(os.environ);
+	env['MBDYN_CMS_OUT'] = os.path.join(resudir, name + '.fem');
+
+	t0 = time.time();
+	log = open(os.path.join(resudir, name + '.log'), 'w');
+	try:
+		rc = subprocess.call([as_run, export], stdout = log, stderr = subprocess.STDOUT,
+			cwd = resudir, env = env);
+	except OSError as e:
+		log.write(str(e) + '\n');
+		rc = -1;
+	log.close();
+	return (name, rc, time.time() - t0, resudir);
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(
+		formatter_class = argparse.RawDescriptionHelpFormatter,
+		description = 'Run the CMS macro on several substructures concurrently.',
+		epilog = __doc__);
+	parser.add_argument('substructures', nargs = '+', metavar = 'COMM[:MAIL]',
+		help = 'command files (or cmsNNNNN.comm numbers) of the substructures');
+	parser.add_argument('--jobs', '-j', type = int, default = 2,
+		help = 'concurrent Code Aster runs (default: %(default)s)');
+	parser.add_argument('--as-run', default = 'as_run',
+		help = 'as_run command (default: %(default)s)');
+	parser.add_argument('--version', default = '9.3',
+		help = 'Code Aster version (default: %(default)s)');
+	parser.add_argument('--resudir', default = '.',
+		help = 'where the result directories are created (default: %(default)s)');
+	parser.add_argument('--export', default = EXPORT_IN,
+		help = 'export file template (default: cms.export.in)');
+	args = parser.parse_args(argv);
+
+	f = open(args.export);
+	template = f.read();
+	f.close();
+
+	tasks = [];
+	names = {};
+	outputs = {};
+	for spec in args.substructures:
+		name, comm, mail = cms_batch_job(spec);
+		# runs must not write the same files
+		if (name in names):
+			sys.stderr.write("%s: same result directory as %s\n" % (spec, names[name]));
+			return 2;
+		names[name] = spec;
+		out = cms_batch_output(comm);
+		if (out != None):
+			if (out in outputs):
+				sys.stderr.write("%s: writes %s, as %s does; use MBDYN_CMS_OUT\n"
+					% (spec, out, outputs[out]));
+				return 2;
+			outputs[out] = spec;
+		tasks.append((name, comm, mail, args.as_run, args.version,
+			os.path.abspath(args.resudir), template));
+
+	# the runs are processes of their own: threads only wait for them
+	pool = ThreadPool(max(1, args.jobs));
+	failed = 0;
+	try:
+		for name, rc, elapsed, resudir in pool.imap_unordered(cms_batch_run, tasks):
+			if (rc != 0):
+				failed = failed + 1;
+			print("%s: %s in %.1f s (%s)" % (name, rc == 0 and "done" or "FAILED (%d)" % rc,
+				elapsed, resudir));
+			sys.stdout.flush();
+	finally:
+		pool.close();
+		pool.join();
+	return failed and 1 or 0;
+
+if __name__ == '__main__':
+	sys.exit(main());
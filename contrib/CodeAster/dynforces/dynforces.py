@@ -37,6 +37,13 @@
 # LOG:
 # 2007-08-05: first implementation
 # 2007-08-06: works
+# 2026-10-19: sparse, batched mass matrix product; numpy instead of Numeric
+# 2026-10-19: vectorized acceleration file reader, with multiple fields
+# 2026-10-19: mass matrix decoding shared with cms (mbdyn_smos)
+# 2026-10-19: print() calls, so that the macro loads under Python 3 too
+# 2026-10-19: NUME_CAS checked against the fields of the file
+# 2026-10-19: fields end at '%%' lines or at repeated nodes
+# 2026-10-19: files read once, loads of all their fields computed at once
 #
 #===============================================================================
 # TODO:
@@ -56,77 +63,112 @@
 from Utilitai.partition import *
 from Cata.cata import *
 
-from Numeric import *
-from LinearAlgebra import *
+from numpy import *
+
+# decoding of assembled matrices, shared with the other macros
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))));
+from mbdyn_smos import smos_matrix
 
 from Accas import _F
 
-# read nodal accelerations field from file
+# read nodal accelerations fields from file
+# NOTE: each line contains a node label and the six components of its
+#	acceleration; lines starting with '%' are comments.  The file may
+#	contain several fields (load cases, time steps) one after the other:
+#	a field ends at a line starting with '%%', or before a line whose
+#	node already appeared in it, even on a malformed line.
+#	Nodes missing from a field have zero acceleration.  Returns an
+#	array [nfields, nnodes, 6], also for one field.
 def dynforces_read_acc_from_file(fichier, mm):
-	# input file
-	fin = file(fichier, "r");
-
 	# prepare reverse indexing of node labels
 	nodelabels = list(mm.correspondance_noeuds);
 	nnodes = len(nodelabels);
 
 	nodeidx = {};
-	gotten = {};
 	for nn in range(0, nnodes):
 		nodeidx[nodelabels[nn].rsplit()[0]] = nn;
 
-	acc = Numeric.zeros([nnodes, 6], Numeric.Float);
-
-	cnt = 0;
-	lcnt = 0;
-	for line in fin.readlines():
-		# increment line counter
-		lcnt = lcnt + 1;
-
-		# parse line
-		flds = line.rsplit();
-		if (len(flds) == 0 or flds[0][0] == '%'):
-			continue;
-
-		# check the right number of fields is present
-		if (len(flds) != 7):
-			# error?
-			print "AFFE_DYNFORCES: line %d: WARNING: ignored" % lcnt;
-			continue;
-
-		# idx from maillage, based on label = flds[0]
-		label = flds[0];
+	# input file
+	fin = open(fichier, "r");
+	lines = fin.read().splitlines();
+	fin.close();
 
-		# check if nodes are repeated
-		if (gotten.get(label, None) is not None):
-			# error?
-			print "AFFE_DYNFORCES: line %d: WARNING: node %s repeated" % (lcnt, label);
+	# line numbers, fields and field number of data lines
+	lnum = [];
+	flds = [];
+	field = [];
+	nfields = 0;
+	seen = {};
+	for ll in range(len(lines)):
+		ff = lines[ll].split();
+		if (len(ff) == 0):
 			continue;
-		gotten[label] = 1;
-
-		# node index
-		idx = nodeidx.get(label, None);
-		if (idx is None):
-			# error?
-			print "AFFE_DYNFORCES: line %d: WARNING: node %s undefined (ignoring)" % (lcnt, label);
+		if (ff[0][0] == '%'):
+			if (ff[0][0:2] == '%%'):
+				seen = {};
 			continue;
-
-		# read accelerations
-		for cc in range(0, 6):
-			# FIXME: check if number?
-			acc[idx][cc] = eval(flds[cc + 1]);
-
-		# increment node counter
-		cnt = cnt + 1;
+		if ((len(seen) == 0) or (ff[0] in seen)):
+			nfields = nfields + 1;
+			seen = {};
+		seen[ff[0]] = 1;
+		lnum.append(ll + 1);
+		flds.append(ff);
+		field.append(nfields - 1);
+	if (nfields == 0):
+		nfields = 1;
+
+	# lines with the wrong number of fields
+	bad = [lnum[ll] for ll in range(len(flds)) if len(flds[ll]) != 7];
+	good = [ll for ll in range(len(flds)) if len(flds[ll]) == 7];
+	lnum = array([lnum[ll] for ll in good], int);
+	flds = [flds[ll] for ll in good];
+	field = array([field[ll] for ll in good], int);
+
+	# convert all values at once; never evaluate text
+	try:
+		vals = fromstring(' '.join([' '.join(ff[1:]) for ff in flds]), dtype = double, sep = ' ');
+	except ValueError:
+		vals = [];
+	if (len(vals) != 6*len(flds)):
+		# some value is not a number: convert line by line
+		vals = zeros([len(flds), 6], double);
+		for ll in range(len(flds)):
+			try:
+				vals[ll] = array(flds[ll][1:], double);
+			except ValueError:
+				vals[ll] = nan;
+	vals = vals.reshape(len(flds), 6);
+	ok = isfinite(vals).all(axis = 1);
+	bad.extend(lnum[~ok]);
+
+	# node index, from the label
+	idx = array([nodeidx.get(ff[0], -1) for ff in flds], int).reshape(len(flds));
+	undefined = ok & (idx < 0);
+	ok = ok & (idx >= 0);
+
+	if len(bad) > 0:
+		bad.sort();
+		print("AFFE_DYNFORCES: WARNING: %d malformed line(s) ignored in file \"%s\" (lines %s%s)" \
+			% (len(bad), fichier, ', '.join([str(ll) for ll in bad[0:10]]), (len(bad) > 10) and ', ...' or ''));
+	if undefined.any():
+		print("AFFE_DYNFORCES: WARNING: %d line(s) with undefined nodes ignored in file \"%s\" (e.g. node %s)" \
+			% (undefined.sum(), fichier, flds[nonzero(undefined)[0][0]][0]));
+
+	idx = idx[ok];
+	vals = vals[ok];
+	field = field[ok];
+
+	acc = zeros([nfields, nnodes, 6], double);
+	acc[field, idx] = vals;
 
 	# sanity check
-	if (cnt != nnodes):
-		print "AFFE_DYNFORCES: WARNING: expected %d nodes, got %d from file \"%s\"" % (nnodes, cnt, fichier);
+	cnt = bincount(field, minlength = nfields);
+	for ff in nonzero(cnt != nnodes)[0]:
+		print("AFFE_DYNFORCES: WARNING: field %d: expected %d nodes, got %d from file \"%s\"" % (ff + 1, nnodes, cnt[ff], fichier));
 
-	for rr in range(0, nnodes):
-		print "node[%d]=%s %16.8e%16.8e%16.8e%16.8e%16.8e%16.8e" % (rr + 1, nodelabels[rr], acc[rr][0], acc[rr][1], acc[rr][2], acc[rr][3], acc[rr][4], acc[rr][5]);
-
-	fin.close();
+	print("AFFE_DYNFORCES: read %d field(s) for %d nodes from file \"%s\"" % (nfields, nnodes, fichier));
 
 	return acc;
 # end of dynforces_read_acc_from_file
@@ -134,137 +176,52 @@ def dynforces_read_acc_from_file(fichier, mm):
 # compute the dynamic loads by multiplying the mass matrix
 # times the nodal accelerations field
 def dynforces_acc2frc(matrm, acc):
-	# acc is a matrix containing three components of acceleration 
-	# for each node; nodes are sorted as in the internal structure
-
-	# construction des vecteurs jeveux
-	nommatr = matrm.nom;
-	lenm = len(nommatr);
-	nommatr = nommatr + ' '*(8 - lenm + 1);
-	vectrav = nommatr + '          .REFA        ';
-	nom = aster.getvectjev(vectrav);
-	nomnume = nom[1];
-	typm = nom[8];
-	assert(typm[0:2] == 'MS');
-	lenm = len(nomnume);
-	nomnume = nomnume[0:9];
-
-	nvar = nommatr + '          .VALM';
-	nadia = nomnume + '     .SMOS.SMDI        ';
-	nnuml = nomnume + '     .SMOS.SMHC        ';
-	nrtt = nomnume + '     .NUME.DELG        ';
-	nrtt2 = nomnume + '     .NUME.DEEQ        ';
-
-	var = aster.getcolljev(nvar);
-	adia = aster.getvectjev(nadia);
-	numl = aster.getvectjev(nnuml);
-	rtt = aster.getvectjev(nrtt);
-	rtt2 = aster.getvectjev(nrtt2);
-
-	# array containing mass matrix values
-	valr = var[1];
-
-	# number of ddl
-	vc = len(rtt);
-
-	nnodalddl = 0;
-	nnodes = 0;
-	nkk_cur = -1;
-	for kk in range(0, vc):
-		nkk = rtt2[2*kk];
-		if (nkk <= 0):
-			continue;
-
-		ckk = rtt2[2*kk + 1];
-		if (ckk <= 0):
-			continue;
-
-		if (nkk_cur != nkk):
-			nkk_cur = nkk;
-			nnodes = nnodes + 1;
-
-		nnodalddl = nnodalddl + 1;
-
-	# make room for load vector
-	dynforces = Numeric.zeros([nnodes, 6], Numeric.Float);
+	# acc is a matrix containing six components of acceleration
+	# for each node; nodes are sorted as in the internal structure.
+	# Several fields can be passed at once as an array
+	# [ncases, nnodes, 6], and are multiplied in one sparse product
 
-	# for each ddl
-	for ii in range(vc):
-		# skip Lagrange multipliers
-
-		# node number (1 to nnodes)
-		ni = rtt2[2*ii];
-		if (ni <= 0):
-			continue;
-
-		# component number (1 to 6)
-		ci = rtt2[2*ii + 1];
-		if (ci <= 0):
-			continue;
-
-		# index of diagonal entry of this ddl (base 1)
-		ai = adia[ii];
-
-		# contribution of this ddl
-		dm = valr[ai - 1];
-
-		# deal with self-contribution to load vector
-		dynforces[ni - 1][ci - 1] = dynforces[ni - 1][ci - 1] - dm*acc[ni - 1][ci - 1];
-
-		# first ddl only
-		if (ii == 0):
-			continue;
-
-		# index of diagonal entry of previous ddl (base 1)
-		aim1 = adia[ii - 1];
-
-		# array of indexes connected to ai
-		# NOTE: use aim1 as array lower bound (included) because arrays are 0-based, while aim1 is 1-based)
-		# NOTE: skip numl[ai] because we already considered it (it's the diagonal term) (upper bound is excluded)
-		air = numl[aim1:ai - 1];
-		lair = len(air);
-
-		# check whether any of the previous ddls is connected to ai
-		for jj in range(ii):
-			# skip Lagrange multipliers
-
-			# node number (1 to nnodes)
-			nj = rtt2[2*jj];
-			if (nj <= 0):
-				continue;
-
-			# component number (1 to 6)
-			cj = rtt2[2*jj + 1];
-			if (cj <= 0):
-				continue;
-
-			# index of diagonal entry of this ddl (base 1)
-			aj = adia[jj];
-
-			# ignore if this ddl (jj + 1) is not connected to ai
-			if ((jj + 1) not in air):
-				continue;
-
-			# find the index of the connecting coefficient
-			gotit = 0;
-			for kk in range(lair):
-				if (air[kk] == (jj + 1)):
-					gotit = 1;
-					break;
-
-			assert(gotit == 1);
-
-			# contribution of this ddl coupled with ii
-			dm = valr[aim1 + kk];
-
-			# deal with cross-contribution to load vector
-			dynforces[ni - 1][ci - 1] = dynforces[ni - 1][ci - 1] - dm*acc[nj - 1][cj - 1];
-			dynforces[nj - 1][cj - 1] = dynforces[nj - 1][cj - 1] - dm*acc[ni - 1][ci - 1];
-
-	return dynforces;
+	# the mass matrix is decoded once (see mbdyn_smos)
+	return -smos_matrix(matrm).nodal_dot(acc);
 # end of dynforces_acc2frc
 
-def dynforces_ops(self, MODELE, MATR_MASS, MAILLAGE, FICHIER):
+# acceleration fields read from files and their loads, by file name:
+# [stamp, nodelabels, acc, sm, frc], see dynforces_read_loads
+dynforces_cache = {};
+
+# compute the dynamic loads of all the fields of file fichier
+# NOTE: the file is read once as long as its modification time and size
+#	do not change, and all its fields are multiplied by the mass matrix
+#	matrm at once; the loads are reused by the following calls (e.g.
+#	one for each NUME_CAS) until the file or the decoded mass matrix
+#	(see mbdyn_smos) change.  Returns an array [nfields, nnodes, 6]
+def dynforces_read_loads(matrm, fichier, mm):
+	st = os.stat(fichier);
+	stamp = (st.st_mtime, st.st_size);
+	nodelabels = tuple(mm.correspondance_noeuds);
+	sm = smos_matrix(matrm);
+
+	key = os.path.abspath(fichier);
+	ce = dynforces_cache.get(key);
+	if ((ce == None) or (ce[0] != stamp) or (ce[1] != nodelabels)):
+		ce = [stamp, nodelabels, dynforces_read_acc_from_file(fichier, mm), None, None];
+		dynforces_cache[key] = ce;
+	if (ce[3] is not sm):
+		ce[3] = sm;
+		ce[4] = -sm.nodal_dot(ce[2]);
+
+	return ce[4];
+# end of dynforces_read_loads
+
+# forget the fields read from file fichier, or from all files
+def dynforces_forget(fichier = None):
+	if (fichier == None):
+		dynforces_cache.clear();
+	elif (os.path.abspath(fichier) in dynforces_cache):
+		del dynforces_cache[os.path.abspath(fichier)];
+# end of dynforces_forget
+
+def dynforces_ops(self, MODELE, MATR_MASS, MAILLAGE, FICHIER, NUME_CAS = 1):
 	# Define output and initialize error counter
 	self.set_icmd(1)
 	self.DeclareOut('CHDF', self.sd)
@@ -282,11 +239,15 @@ def dynforces_ops(self, MODELE, MATR_MASS, MAILLAGE, FICHIER):
 	nodelabels = list(mm.correspondance_noeuds);
 	nnodes = len(nodelabels);
 
-	# right now, only read from file
-	acc = dynforces_read_acc_from_file(fichier, mm);
-
-	# multiply mass matrix times accelerations
-	dynforces = dynforces_acc2frc(matrm, acc);
+	# right now, only read from file; mass matrix times accelerations
+	# of all the fields, reused by the calls for the other fields
+	frc = dynforces_read_loads(matrm, fichier, mm);
+	nfields = frc.shape[0];
+	if ((NUME_CAS < 1) or (NUME_CAS > nfields)):
+		print("AFFE_DYNFORCES: ERROR: NUME_CAS=%d, but file \"%s\" contains %d field(s)" % (NUME_CAS, fichier, nfields));
+		ier = 1;
+		return ier;
+	dynforces = frc[NUME_CAS - 1];
 
 	# create dynamic loads right-hand side
 	CHDF = AFFE_CHAR_MECA(	MODELE = model,
@@ -315,7 +276,9 @@ AFFE_DYNFORCES = MACRO(	nom		= "AFFE_DYNFORCES",
 			MAILLAGE	= SIMP( statut = 'o', typ = maillage_sdaster,
 						fr = "The maillage (mesh)" ),
 			FICHIER		= SIMP( statut = 'o', typ = 'TXM',
-						fr = "Input file name" )
+						fr = "Input file name" ),
+			NUME_CAS	= SIMP( statut = 'f', typ = 'I', defaut = 1, val_min = 1,
+						fr = "Field of the input file (1-based)" )
 	)
 # ===============================================================================
 # END OF MACRO CATALOGUE DEFINITION
@@ -0,0 +1,217 @@
+# $Header$
+#
+# MBDyn (C) is a multibody analysis code.
+# http://www.mbdyn.org
+#
+# Copyright (C) 1996-2023
+#
+# Pierangelo Masarati	<pierangelo.masarati@polimi.it>
+# Paolo Mantegazza	<paolo.mantegazza@polimi.it>
+#
+# Dipartimento di Ingegneria Aerospaziale - Politecnico di Milano
+# via La Masa, 34 - 20156 Milano, Italy
+# http://www.aero.polimi.it
+#
+# Changing this copyright notice is forbidden.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation (version 2 of the License).
+#
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+#===============================================================================
+# Title:	Decoding of assembled matrices, shared by the macros
+#
+# The assembled symmetric matrices used by the cms and dynforces macros
+# (the mass matrix) are read from JEVEUX and decoded once, into an
+# SmosMatrix holding the matrix in CSR format and the node and component
+# of each ddl; SmosMatrix objects are memoized by matrix name, and
+# reused as long as the numbering of the matrix matches.
+#===============================================================================
+# LOG:
+# 2026-10-19: first implementation, from the cms and dynforces macros
+# 2026-10-19: decoded matrices checked against the values in JEVEUX
+# 2026-10-19: values checked only on request; smos_forget after reassembly
+#
+#===============================================================================
+
+import aster
+import zlib
+from numpy import *
+import scipy.sparse
+
+# fetch the SMOS storage of the assembled symmetric matrix matrrr:
+# returns (refa, valr, adia, numl, rtt2), i.e. .REFA, .VALM,
+# .SMOS.SMDI, .SMOS.SMHC and .NUME.DEEQ
+def smos_fetch(matrrr):
+	# construction des vecteurs jeveux
+	nommatr = matrrr.nom;
+	lenm = len(nommatr);
+	nommatr = nommatr + ' '*(8 - lenm + 1);
+	vectrav = nommatr + '          .REFA        ';
+	refa = aster.getvectjev(vectrav);
+	nomnume = refa[1];
+	typm = refa[8];
+	assert(typm[0:2] == 'MS');
+	nomnume = nomnume[0:9];
+
+	nvar = nommatr + '          .VALM';
+	nadia = nomnume + '     .SMOS.SMDI        ';
+	nnuml = nomnume + '     .SMOS.SMHC        ';
+	nrtt2 = nomnume + '     .NUME.DEEQ        ';
+
+	var = aster.getcolljev(nvar);
+	adia = aster.getvectjev(nadia);
+	numl = aster.getvectjev(nnuml);
+	rtt2 = aster.getvectjev(nrtt2);
+
+	return (refa, var[1], adia, numl, rtt2);
+# end of smos_fetch
+
+# length and CRC-32 of the values valr of a matrix (its .VALM), to tell
+# whether a matrix has been assembled again under the same name
+def smos_checksum(valr):
+	valr = ascontiguousarray(valr, double);
+	return (len(valr), zlib.crc32(valr.tobytes()));
+# end of smos_checksum
+
+# assemble the matrix stored in SMOS format into a scipy.sparse matrix
+# NOTE: SMOS stores the upper triangle by columns: the terms of column ii
+#	are valr[adia[ii - 1]:adia[ii]] (adia is base 1), numl holds their
+#	row (base 1), the last one being the diagonal.
+# NOTE: only the coupling between physical ddls is retained; rows and
+#	columns of Lagrange multipliers are left empty.
+def smos_to_csr(valr, adia, numl, rtt2):
+	adia = asarray(adia, int);
+	vc = len(adia);
+	nterms = adia[-1];
+
+	rows = asarray(numl[0:nterms], int) - 1;
+	cols = repeat(arange(vc), diff(concatenate(([0], adia))));
+	vals = asarray(valr[0:nterms], double);
+
+	# node number (1 to nnodes) and component number (1 to 6) of each ddl
+	deeq = asarray(rtt2, int).reshape(vc, 2);
+	physical = (deeq[:, 0] > 0) & (deeq[:, 1] > 0);
+	keep = physical[rows] & physical[cols];
+	rows = rows[keep];
+	cols = cols[keep];
+	vals = vals[keep];
+
+	# M = U + U^T - diag(U)
+	offd = rows != cols;
+	return scipy.sparse.csr_matrix(
+		(concatenate((vals, vals[offd])),
+			(concatenate((rows, cols[offd])), concatenate((cols, rows[offd])))),
+		shape = (vc, vc));
+# end of smos_to_csr
+
+# decoded assembled matrix:
+#	refa		the .REFA of the matrix, to detect renumbering
+#	checksum	smos_checksum of the values, to detect reassembly
+#	rtt2		the .NUME.DEEQ vector, (node, component) of each ddl
+#	ndof		number of ddls
+#	idx		indexes of the physical ddls
+#	ni, ci		their node (1 to nnodes) and component (1 to 6)
+#	nnodes		highest node number
+#	diag		diagonal terms of the ddls
+#	mm		the matrix in CSR format (see smos_to_csr)
+class SmosMatrix:
+	def __init__(self, refa, valr, adia, numl, rtt2):
+		self.refa = tuple(refa);
+		self.checksum = smos_checksum(valr);
+		self.rtt2 = rtt2;
+
+		adia = asarray(adia, int);
+		self.ndof = len(adia);
+
+		# the diagonal is the last term of each column
+		self.diag = asarray(valr, double)[adia - 1];
+
+		deeq = asarray(rtt2, int).reshape(self.ndof, 2);
+		self.idx = nonzero((deeq[:, 0] > 0) & (deeq[:, 1] > 0) & (deeq[:, 1] <= 6))[0];
+		self.ni = deeq[self.idx, 0];
+		self.ci = deeq[self.idx, 1];
+		self.nnodes = 0;
+		if (len(self.idx) > 0):
+			self.nnodes = self.ni.max();
+
+		self.mm = smos_to_csr(valr, adia, numl, rtt2);
+
+	# diagonal terms of the nodes nodes_id (base 0) [nodes, 6];
+	# components without a ddl are zero
+	def nodal_diag(self, nodes_id):
+		diag_nodes = zeros([self.nnodes, 6], double);
+		diag_nodes[self.ni - 1, self.ci - 1] = self.diag[self.idx];
+
+		nodes_id = asarray(nodes_id, int);
+		assert(((nodes_id >= 0) & (nodes_id < self.nnodes)).all());
+		return diag_nodes[nodes_id];
+
+	# product of the matrix times the nodal fields x, [nnodes, 6] or
+	# [ncases, nnodes, 6], in one sparse product
+	def nodal_dot(self, x):
+		x = asarray(x, double);
+		single = (x.ndim == 2);
+		if single:
+			x = x[newaxis];
+		ncases = x.shape[0];
+		nnodes = x.shape[1];
+
+		# ddl vectors, one column per field
+		xddl = zeros([self.ndof, ncases], double);
+		xddl[self.idx] = x[:, self.ni - 1, self.ci - 1].T;
+
+		yddl = self.mm.dot(xddl);
+
+		y = zeros([ncases, nnodes, 6], double);
+		y[:, self.ni - 1, self.ci - 1] = yddl[self.idx].T;
+
+		if single:
+			return y[0];
+		return y;
+# end of SmosMatrix
+
+# decoded matrices, by name
+smos_cache = {};
+
+# return the SmosMatrix of the assembled matrix matrrr, decoded once
+# NOTE: only the .REFA is read at each call, so a matrix numbered again
+#	under the same name is decoded again.  A matrix assembled again
+#	with the same numbering (e.g. after DETRUIRE) keeps its .REFA:
+#	call smos_forget on it, or pass force = 1 to always decode it, or
+#	check = 1 to also compare the values (.VALM, the largest object)
+def smos_matrix(matrrr, force = 0, check = 0):
+	sm = smos_cache.get(matrrr.nom);
+	if ((not force) and (sm != None)):
+		nommatr = matrrr.nom + ' '*(8 - len(matrrr.nom) + 1);
+		refa = aster.getvectjev(nommatr + '          .REFA        ');
+		if (tuple(refa) == sm.refa):
+			if (not check):
+				return sm;
+			valr = aster.getcolljev(nommatr + '          .VALM')[1];
+			if (smos_checksum(valr) == sm.checksum):
+				return sm;
+
+	refa, valr, adia, numl, rtt2 = smos_fetch(matrrr);
+	sm = SmosMatrix(refa, valr, adia, numl, rtt2);
+	smos_cache[matrrr.nom] = sm;
+	return sm;
+# end of smos_matrix
+
+# forget the decoded matrix matrrr, or all of them
+def smos_forget(matrrr = None):
+	if (matrrr == None):
+		smos_cache.clear();
+	elif (matrrr.nom in smos_cache):
+		del smos_cache[matrrr.nom];
+# end of smos_forget
@@ -0,0 +1,488 @@
+#!/usr/bin/env python
+# $Header$
+#
+# MBDyn (C) is a multibody analysis code.
+# http://www.mbdyn.org
+#
+# Copyright (C) 1996-2023
+#
+# Pierangelo Masarati	<pierangelo.masarati@polimi.it>
+# Paolo Mantegazza	<paolo.mantegazza@polimi.it>
+#
+# Dipartimento di Ingegneria Aerospaziale - Politecnico di Milano
+# via La Masa, 34 - 20156 Milano, Italy
+# http://www.aero.polimi.it
+#
+# Changing this copyright notice is forbidden.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation (version 2 of the License).
+#
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+#===============================================================================
+
+"""Benchmark and check the mass matrix operations of the macros.
+
+A stand-in for the aster module serves the JEVEUX objects of synthetic
+assembled mass matrices (SMOS storage, with Lagrange multipliers), so
+that cms_diag_mass and cms_rigb_mass (cms/cms.py) and dynforces_acc2frc
+(dynforces/dynforces.py) can be timed and checked without Code Aster,
+on any machine with numpy and scipy:
+
+	python mbdyn_smos_bench.py
+	python mbdyn_smos_bench.py --ndof 1000 1000000 --repeat 5
+
+Each matrix has 6 ddls per node, two Lagrange multipliers every
+--lagrange nodes, and --terms terms above the diagonal in each column,
+half of them next to the diagonal and half of them scattered up to
+--band rows above it.  The first call of each function fetches and
+decodes the matrix (see mbdyn_smos.py); the following ones reuse it, and
+only read its .REFA (one JEVEUX call).  A matrix assembled again with
+other values, under the same name and numbering, must be decoded again
+after smos_forget, and by smos_matrix with check = 1.  The fields of
+dynforces_acc2frc are also written to an acceleration file, read once by
+dynforces_read_loads: its following calls reuse the loads of all the
+fields.  The results are compared with NumPy products of the dense
+matrix up to --dense-max ddls, of its terms (numpy.bincount) above.  The
+reader of acceleration files of dynforces, and the writers of modal data
+files of cms (against the one value at a time writer they replaced), are
+checked on small cases first; the exit status is 1 if any check fails.
+The JEVEUX objects are served as tuples, as by Code Aster: a matrix of
+1M ddls needs about 4 GB of memory.
+"""
+
+import os
+import sys
+import time
+import types
+import argparse
+import tempfile
+import numpy
+
+HERE = os.path.dirname(os.path.abspath(__file__));
+
+# relative tolerance of the checks
+SMOS_BENCH_RTOL = 1.e-10;
+
+# stand-in for the aster module: serves the JEVEUX objects in objects,
+# by name, and counts the calls
+class SmosBenchAster(types.ModuleType):
+	def __init__(self):
+		types.ModuleType.__init__(self, 'aster');
+		self.objects = {};
+		self.calls = 0;
+
+	def getvectjev(self, name):
+		self.calls = self.calls + 1;
+		return self.objects[name];
+
+	def getcolljev(self, name):
+		self.calls = self.calls + 1;
+		return self.objects[name];
+
+	# JEVEUX objects of the assembled symmetric matrix name, numbered
+	# by nume, as read by mbdyn_smos.smos_fetch
+	def register(self, name, nume, valr, adia, numl, rtt2):
+		nommatr = name + ' '*(8 - len(name) + 1);
+		nomnume = nume + ' '*(8 - len(nume) + 1);
+		self.objects.clear();
+		self.objects[nommatr + '          .REFA        '] = (
+			'MODELE', nomnume + '     ', '', '', '', '', '', '', 'MS', '', '');
+		self.objects[nommatr + '          .VALM'] = { 1: tuple(valr.tolist()) };
+		self.objects[nomnume + '     .SMOS.SMDI        '] = tuple(adia.tolist());
+		self.objects[nomnume + '     .SMOS.SMHC        '] = tuple(numl.tolist());
+		self.objects[nomnume + '     .NUME.DEEQ        '] = tuple(rtt2.tolist());
+
+# stand-ins for the other Code Aster modules imported by the macros;
+# the catalogue only needs to be evaluated
+def smos_bench_modules(fake):
+	def catalogue(*args, **kwargs):
+		return kwargs;
+
+	partition = types.ModuleType('Utilitai.partition');
+	partition.MAIL_PY = None;
+	utilitai = types.ModuleType('Utilitai');
+	utilitai.partition = partition;
+
+	cata = types.ModuleType('Cata.cata');
+	for name in ('MACRO', 'SIMP', 'FACT', 'BLOC', 'UN_PARMI'):
+		setattr(cata, name, catalogue);
+	for name in ('macr_elem_dyna', 'maillage_sdaster', 'modele_sdaster',
+			'cara_elem', 'cham_mater', 'char_meca', 'matr_asse_depl_r'):
+		setattr(cata, name, type(name, (object, ), {}));
+	cata_pkg = types.ModuleType('Cata');
+	cata_pkg.cata = cata;
+
+	accas = types.ModuleType('Accas');
+	accas._F = dict;
+
+	sys.modules.update({ 'aster': fake,
+		'Utilitai': utilitai, 'Utilitai.partition': partition,
+		'Cata': cata_pkg, 'Cata.cata': cata,
+		'Accas': accas });
+
+# synthetic assembled mass matrix of nnodes nodes, in SMOS storage:
+# returns (valr, adia, numl, rtt2) as arrays, see mbdyn_smos.smos_to_csr
+def smos_bench_matrix(nnodes, terms, band, lagrange, rng):
+	# (node, component) of each ddl; each pair of Lagrange multipliers
+	# is (node, -1), (0, 0), after the node it constrains
+	deeq = numpy.zeros([nnodes, 6, 2], int);
+	deeq[:, :, 0] = numpy.arange(1, nnodes + 1)[:, numpy.newaxis];
+	deeq[:, :, 1] = numpy.arange(1, 7);
+	deeq = deeq.reshape(6*nnodes, 2);
+	if (lagrange > 0):
+		nodes = numpy.arange(lagrange, nnodes + 1, lagrange);
+		lag = numpy.zeros([len(nodes), 2, 2], int);
+		lag[:, 0, 0] = nodes;
+		lag[:, 0, 1] = -1;
+		deeq = numpy.insert(deeq, numpy.repeat(6*nodes, 2), lag.reshape(-1, 2), axis = 0);
+	ndof = len(deeq);
+
+	# rows of each column, relative to the diagonal, which is the last one
+	band = max(band, terms);
+	near = numpy.arange(1, terms//2 + 1);
+	far = rng.permutation(numpy.arange(len(near) + 1, band + 1))[0:terms - len(near)];
+	offs = numpy.concatenate((numpy.sort(numpy.concatenate((near, far)))[::-1], [0]));
+
+	rows = numpy.arange(ndof)[:, numpy.newaxis] - offs[numpy.newaxis, :];
+	keep = (rows >= 0);
+	numl = rows[keep] + 1;
+	adia = numpy.cumsum(keep.sum(1));
+
+	# diagonally dominant, positive definite
+	valr = rng.uniform(-1., 1., len(numl));
+	valr[adia - 1] = 2.*len(offs) + rng.uniform(0., 1., ndof);
+
+	return (valr, adia, numl, deeq.ravel());
+
+# NumPy reference of the physical part of the matrix, independent of
+# scipy and of mbdyn_smos: dense up to dense_max ddls, else its terms
+class SmosBenchReference:
+	def __init__(self, valr, adia, numl, rtt2, dense_max):
+		self.ndof = len(adia);
+		cols = numpy.repeat(numpy.arange(self.ndof), numpy.diff(numpy.concatenate(([0], adia))));
+		rows = numl - 1;
+
+		deeq = rtt2.reshape(self.ndof, 2);
+		physical = (deeq[:, 0] > 0) & (deeq[:, 1] > 0);
+		keep = physical[rows] & physical[cols];
+		self.rows = rows[keep];
+		self.cols = cols[keep];
+		self.vals = valr[keep];
+		self.offd = (self.rows != self.cols);
+
+		self.idx = numpy.nonzero(physical)[0];
+		self.ni = deeq[self.idx, 0];
+		self.ci = deeq[self.idx, 1];
+
+		self.dense = None;
+		if (self.ndof <= dense_max):
+			self.dense = numpy.zeros([self.ndof, self.ndof]);
+			self.dense[self.rows, self.cols] = self.vals;
+			self.dense[self.cols, self.rows] = self.vals;
+
+	# product times the ddl vectors x [ndof, n]
+	def dot(self, x):
+		if (self.dense is not None):
+			return self.dense.dot(x);
+		y = numpy.zeros(x.shape);
+		r = self.rows[self.offd];
+		c = self.cols[self.offd];
+		v = self.vals[self.offd];
+		for k in range(x.shape[1]):
+			y[:, k] = numpy.bincount(self.rows, self.vals*x[self.cols, k], minlength = self.ndof) \
+				+ numpy.bincount(c, v*x[r, k], minlength = self.ndof);
+		return y;
+
+	# diagonal terms of the nodes nodes_id (base 0)
+	def diag_mass(self, nnodes, nodes_id):
+		d = numpy.zeros([nnodes, 6]);
+		diag = (self.rows == self.cols);
+		ddl = numpy.zeros(self.ndof);
+		ddl[self.rows[diag]] = self.vals[diag];
+		d[self.ni - 1, self.ci - 1] = ddl[self.idx];
+		return d[nodes_id];
+
+	# Z^T M Z, with the rigid-body motion of node r [[I, skew(r)], [0, I]]
+	def rigb_mass(self, coord):
+		x, y, z = coord[:, 0], coord[:, 1], coord[:, 2];
+		zn = numpy.zeros([len(coord), 6, 6]);
+		zn[:, range(6), range(6)] = 1.;
+		zn[:, 0, 4], zn[:, 0, 5] = -z, y;
+		zn[:, 1, 3], zn[:, 1, 5] = z, -x;
+		zn[:, 2, 3], zn[:, 2, 4] = -y, x;
+		Z = numpy.zeros([self.ndof, 6]);
+		Z[self.idx] = zn[self.ni - 1, self.ci - 1];
+		return Z.T.dot(self.dot(Z));
+
+	# minus the product times the nodal fields acc [ncases, nnodes, 6]
+	def acc2frc(self, acc):
+		x = numpy.zeros([self.ndof, acc.shape[0]]);
+		x[self.idx] = acc[:, self.ni - 1, self.ci - 1].T;
+		y = self.dot(x);
+		frc = numpy.zeros(acc.shape);
+		frc[:, self.ni - 1, self.ci - 1] = -y[self.idx].T;
+		return frc;
+
+# time the first call of func (fetch and decoding of the matrix) and
+# the best of repeat following ones, with their JEVEUX calls
+def smos_bench_time(fake, forget, func, args, repeat):
+	forget();
+	fake.calls = 0;
+	t0 = time.time();
+	res = func(*args);
+	first = (time.time() - t0, fake.calls);
+
+	best = (numpy.inf, 0);
+	for rr in range(repeat):
+		fake.calls = 0;
+		t0 = time.time();
+		func(*args);
+		best = min(best, (time.time() - t0, fake.calls));
+	return (res, first, best);
+
+def smos_bench_error(res, ref):
+	scale = numpy.abs(ref).max();
+	if (scale == 0.):
+		scale = 1.;
+	return numpy.abs(numpy.asarray(res) - ref).max()/scale;
+
+# check dynforces_read_acc_from_file on small files of nodes N1, N2, N3;
+# in each case, line 'Nn v' gives node Nn the acceleration v, and the
+# expected fields list the acceleration of each node
+SMOS_BENCH_ACC_FILES = (
+	('malformed line', (
+		'N1 1', 'N2 2 2 2', 'N3 3',
+		'N1 4', 'N2 5', 'N3 6'),
+		((1, 0, 3), (4, 5, 6))),
+	('node missing in the middle', (
+		'N1 1', 'N2 2', 'N3 3',
+		'N1 4', 'N2 5',
+		'N1 7', 'N2 8', 'N3 9'),
+		((1, 2, 3), (4, 5, 0), (7, 8, 9))),
+	('separator lines', (
+		'% a comment', 'N1 1', 'N2 2', 'N3 3', '%%', '%%',
+		'N2 5', 'N3 6', '%% last field',
+		'N1 7', 'N2 8', 'N3 9', '%%'),
+		((1, 2, 3), (0, 5, 6), (7, 8, 9))));
+
+def smos_bench_read_acc(dynforces):
+	class Mesh:
+		correspondance_noeuds = ('N1      ', 'N2      ', 'N3      ');
+	failed = 0;
+	fd, path = tempfile.mkstemp(suffix = '.frc');
+	os.close(fd);
+	try:
+		for name, lines, expected in SMOS_BENCH_ACC_FILES:
+			fout = open(path, 'w');
+			for line in lines:
+				ff = line.split();
+				if ((ff[0][0] != '%') and (len(ff) == 2)):
+					line = line + (' ' + ff[1])*5;
+				fout.write(line + '\n');
+			fout.close();
+
+			acc = dynforces.dynforces_read_acc_from_file(path, Mesh());
+			expected = numpy.repeat(numpy.array(expected, float)[:, :, numpy.newaxis], 6, axis = 2);
+			ok = (acc.shape == expected.shape) and (acc == expected).all();
+			if (not ok):
+				failed = failed + 1;
+			print("  %-20s %-30s %s" % ('dynforces_read_acc', name, ok and "ok" or "FAILED"));
+	finally:
+		os.remove(path);
+	return failed;
+
+# output collected by the writers of cms
+class SmosBenchFile:
+	def __init__(self):
+		self.out = [];
+
+	def write(self, s):
+		self.out.append(s);
+
+	def value(self):
+		return ''.join(self.out);
+
+# check cms_write_values, cms_write_array and cms_write_matrix against
+# the writer they replaced, which formatted one value at a time
+def smos_bench_write(cms, rng):
+	fmt = "%24.16e";
+	failed = 0;
+	checks = [];
+
+	# values 6 per line (e.g. RECORD GROUP 4 and 5 of nshapes zeros)
+	for n in (0, 1, 6, 7, 13):
+		v = rng.uniform(-1., 1., n);
+		old = '';
+		for m in range(n):
+			if ((m > 0) & ((m % 6) == 0)):
+				old = old + "\n";
+			old = old + fmt % v[m];
+		old = old + "\n";
+		checks.append(('cms_write_values', '%d values' % n, cms.cms_write_values, (v, fmt, 6), old));
+
+	# a column of values (coordinates) and rows of 6 (mode shapes, diagonal mass)
+	for shape in ((0, ), (5, ), (0, 6), (1, 6), (2000, 6)):
+		a = rng.uniform(-1., 1., shape);
+		if (a.size > 0):
+			a.flat[0] = -0.;
+		old = '';
+		for r in range(shape[0]):
+			if (len(shape) == 1):
+				old = old + (fmt + "\n") % a[r];
+			else:
+				old = old + (fmt*6 + "\n") % tuple(a[r]);
+		checks.append(('cms_write_array', 'shape %s' % (shape, ), cms.cms_write_array, (a, fmt), old));
+
+	# generalized matrices: full, diagonal, diagonal with -0. and 0. terms
+	full = rng.uniform(-1., 1., (7, 7));
+	diag = numpy.diag(rng.uniform(1., 2., 7));
+	negz = diag.copy();
+	negz[1, 2] = -0.;
+	zero = diag.copy();
+	zero[3, 3] = 0.;
+	zero[4, 4] = -0.;
+	for name, a in (('empty', numpy.zeros((0, 0))), ('1 x 1', diag[0:1, 0:1]),
+			('full', full), ('diagonal', diag), ('diagonal, -0. off it', negz),
+			('diagonal, zeros on it', zero)):
+		old = '';
+		for r in range(a.shape[0]):
+			for c in range(a.shape[1]):
+				old = old + fmt % a[r, c];
+			old = old + "\n";
+		checks.append(('cms_write_matrix', name, cms.cms_write_matrix, (a, fmt), old));
+
+	for func, name, write, wargs, old in checks:
+		outf = SmosBenchFile();
+		write(outf, *wargs);
+		ok = (outf.value() == old);
+		if (not ok):
+			failed = failed + 1;
+		print("  %-20s %-30s %s" % (func, name, ok and "ok" or "FAILED"));
+	return failed;
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(
+		formatter_class = argparse.RawDescriptionHelpFormatter,
+		description = 'Benchmark and check the mass matrix operations of the cms and dynforces macros.',
+		epilog = __doc__);
+	parser.add_argument('--ndof', type = int, nargs = '+', default = [1000, 10000, 100000],
+		help = 'approximate number of physical ddls of each matrix (default: %(default)s)');
+	parser.add_argument('--repeat', type = int, default = 3,
+		help = 'calls timed after the first one (default: %(default)s)');
+	parser.add_argument('--terms', type = int, default = 16,
+		help = 'terms above the diagonal of each column (default: %(default)s)');
+	parser.add_argument('--band', type = int, default = 600,
+		help = 'farthest term from the diagonal (default: %(default)s)');
+	parser.add_argument('--lagrange', type = int, default = 5,
+		help = 'nodes between Lagrange multipliers, 0 for none (default: %(default)s)');
+	parser.add_argument('--cases', type = int, default = 4,
+		help = 'acceleration fields multiplied at once (default: %(default)s)');
+	parser.add_argument('--dense-max', type = int, default = 4000,
+		help = 'largest matrix checked against the dense one (default: %(default)s)');
+	parser.add_argument('--seed', type = int, default = 0,
+		help = 'seed of the random matrices (default: %(default)s)');
+	args = parser.parse_args(argv);
+
+	fake = SmosBenchAster();
+	smos_bench_modules(fake);
+	sys.path.insert(0, HERE);
+	sys.path.insert(0, os.path.join(HERE, 'dynforces'));
+	sys.path.insert(0, os.path.join(HERE, 'cms'));
+	import mbdyn_smos
+	import cms
+	import dynforces
+
+	class Matrix:
+		nom = 'MASSE';
+	matrix = Matrix();
+
+	# decoded matrices and fields read from files
+	def forget():
+		mbdyn_smos.smos_forget();
+		dynforces.dynforces_forget();
+
+	rng = numpy.random.RandomState(args.seed);
+	print("acceleration files");
+	failed = smos_bench_read_acc(dynforces);
+	print("modal data file writers");
+	failed = failed + smos_bench_write(cms, numpy.random.RandomState(args.seed));
+	for ndof in args.ndof:
+		nnodes = max(1, ndof//6);
+		valr, adia, numl, rtt2 = smos_bench_matrix(nnodes, args.terms, args.band,
+			args.lagrange, rng);
+		fake.register(matrix.nom, 'NUME', valr, adia, numl, rtt2);
+		ref = SmosBenchReference(valr, adia, numl, rtt2, args.dense_max);
+
+		nodes_id = numpy.sort(rng.permutation(nnodes)[0:max(1, nnodes//2)]);
+		coord = rng.uniform(-1., 1., [nnodes, 3]);
+		acc = rng.uniform(-1., 1., [args.cases, nnodes, 6]);
+
+		# the same fields in an acceleration file, for nodes N1 to Nnnodes
+		class Mesh:
+			correspondance_noeuds = ['N%-7d' % (nn + 1) for nn in range(nnodes)];
+		fd, accfile = tempfile.mkstemp(suffix = '.frc');
+		fout = os.fdopen(fd, 'w');
+		for cc in range(args.cases):
+			fout.write('%%%% field %d\n' % (cc + 1));
+			for nn in range(nnodes):
+				fout.write('N%d %s\n' % (nn + 1, ' '.join([repr(float(v)) for v in acc[cc, nn]])));
+		fout.close();
+
+		print("ndof %d (%d nodes, %d Lagrange multipliers), %d terms, %s reference" % (
+			len(adia), nnodes, len(adia) - 6*nnodes, len(numl),
+			(ref.dense is not None) and "dense" or "sparse"));
+		for name, func, fargs, expected, eargs in (
+				('cms_diag_mass', cms.cms_diag_mass, (matrix, nodes_id),
+					ref.diag_mass, (nnodes, nodes_id)),
+				('cms_rigb_mass', cms.cms_rigb_mass, (matrix, coord),
+					ref.rigb_mass, (coord, )),
+				('dynforces_acc2frc', dynforces.dynforces_acc2frc, (matrix, acc),
+					ref.acc2frc, (acc, )),
+				('dynforces_read_loads', dynforces.dynforces_read_loads, (matrix, accfile, Mesh()),
+					ref.acc2frc, (acc, ))):
+			res, first, best = smos_bench_time(fake, forget, func, fargs, args.repeat);
+			err = smos_bench_error(res, expected(*eargs));
+			ok = (err <= SMOS_BENCH_RTOL);
+			if (not ok):
+				failed = failed + 1;
+			print("  %-20s first %9.4f s (%d JEVEUX calls)  next %9.4f s (%d)  error %.1e %s" % (
+				name, first[0], first[1], best[0], best[1], err, ok and "ok" or "FAILED"));
+
+		# assembled again under the same name and numbering: decoded again
+		# on request only
+		for name in ('check = 1', 'smos_forget'):
+			fake.register(matrix.nom, 'NUME', valr, adia, numl, rtt2);
+			mbdyn_smos.smos_matrix(matrix);
+			fake.register(matrix.nom, 'NUME', 2.*valr, adia, numl, rtt2);
+			if (name == 'smos_forget'):
+				mbdyn_smos.smos_forget(matrix);
+				sm = mbdyn_smos.smos_matrix(matrix);
+			else:
+				sm = mbdyn_smos.smos_matrix(matrix, check = 1);
+			err = smos_bench_error(-sm.nodal_dot(acc), 2.*ref.acc2frc(acc));
+			ok = (err <= SMOS_BENCH_RTOL);
+			if (not ok):
+				failed = failed + 1;
+			print("  %-20s reassembled matrix, %-11s  error %.1e %s" % ('smos_matrix',
+				name, err, ok and "ok" or "FAILED"));
+		sys.stdout.flush();
+
+		os.remove(accfile);
+		del valr, adia, numl, rtt2, ref, expected;
+		forget();
+
+	return failed and 1 or 0;
+
+if __name__ == '__main__':
+	sys.exit(main());
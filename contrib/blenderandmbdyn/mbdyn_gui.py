@@ -57,6 +57,7 @@ from cStringIO import StringIO
 from subprocess import call, Popen
 from time import sleep, clock
 from tempfile import TemporaryFile
+from os.path import getsize
 from socket import socket, AF_INET, SOCK_STREAM, gethostbyname, getservbyname
 from struct import unpack
 
@@ -259,7 +260,7 @@ def runAsync():
 	filename, ext= Blender.sys.splitext(mbdyn.filename)
 	process = Popen(command, shell=True, stdout=f1)
 	Window.DrawProgressBar(0., 'Running mbdyn...')
-	command = "tail -n 1 "+filename+".out | awk '{print $3}'"
+	outName = filename+'.out'
 	tNow = mbdyn._t0
 	tN = mbdyn._tN
 	if tN == 0.:
@@ -268,19 +269,27 @@ def runAsync():
 	Dt = tN - tNow
 	tHold = -1.0
 	sleep(0.1)
-	call("touch "+filename+".out", shell=True)
+	open(outName, 'a').close()
 	sleep(0.1)
-	f2 = TemporaryFile()
+	# follow the .out file: read only what was appended since the last poll
+	f2 = open(outName)
+	pending = ''
 	while tHold < tN and tHold != tNow:
 		tHold = tNow
-		call(command, shell=True, stdout=f2)
-		try:
-			f2.seek(0)
-			tNow = float(f2.read().splitlines()[-1])
-			fraction = 1.-(tN-tNow)/Dt
-			Window.DrawProgressBar(fraction, 'mbdyn: '+str(int(100.*fraction))+'%')
-		except:
-			pass
+		# clear the EOF indicator before reading what was appended
+		f2.seek(0, 1)
+		pending += f2.read()
+		lines = pending.split('\n')
+		pending = lines.pop()
+		for line in lines:
+			fields = line.split()
+			if len(fields) > 2 and fields[0] == 'Step':
+				try:
+					tNow = float(fields[2])
+				except ValueError:
+					pass
+		fraction = 1.-(tN-tNow)/Dt
+		Window.DrawProgressBar(fraction, 'mbdyn: '+str(int(100.*fraction))+'%')
 		sleep(0.1)
 	f2.close()
 	error = 0
@@ -328,27 +337,28 @@ def display():
 		key.clearIpo()
 		mbdyn.rigid_dict[key].makeParent([key])
 
+	# stream the file: .mov files can be much larger than memory
 	movFile = open(filename)
-	lines = movFile.readlines()
 	try:
-		marker = int(lines[0].split()[0])
+		marker = int(movFile.readline().split()[0])
 	except:
 		Draw.PupMenu('Error: Display file, '+filename+
 		', does not match with itemDict.')
 		return
-	nLines = len(lines)
-	iLines = 0
+	movFile.seek(0)
+	nBytes = max(getsize(filename), 1)
+	iBytes = 0
 	portion = 0.
 	timeMark = clock()
 	scn = Scene.GetCurrent()
 	radConv = 18./3.14159265358979323846
-	for line in lines:
+	for line in movFile:
 		timeCheck = clock()
 		if timeCheck-timeMark >0.1:
-			portion = float(iLines)/float(nLines)
+			portion = float(iBytes)/float(nBytes)
 			Window.DrawProgressBar(portion, 'Loading: '+str(int(100.*portion))+'%')
 			timeMark = timeCheck
-		iLines +=1
+		iBytes += len(line)
 		fields = line.split()
 		fields = [int(fields[0])] + [float(field) for field in fields[1:13]]
 		if fields[0] == marker:
@@ -375,7 +385,9 @@ def display():
 		except:
 			Draw.PupMenu('Error: Display file, '+filename+
 			', does not match with mbdyn database.')
+			movFile.close()
 			return
+	movFile.close()
 	for key in mbdyn.rigid_dict.keys():
 		key.clrParent()
 		key.setIpo(key_Ipo[key])
@@ -29,12 +29,43 @@
  * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
  */
 
+#include "mbconfig.h"           /* This goes first in every *.c,*.cc file */
+
 #include "mbc_py.h"
+#include "sock.h"
 
 #include <iostream>
 #include <cstring>
 #include <vector>
 
+/* connect mbc to path, or else to host:port; returns 0 on success,
+ * -1 if the connection failed (may be retried), -2 if neither path
+ * nor host is given; on failure, the caller closes the socket, if any */
+static int
+mbc_py_connect(mbc_t *mbc, const char *const path,
+	const char *const host, unsigned port)
+{
+	int rc;
+
+	mbc->sock = INVALID_SOCKET;
+
+	if (path && path[0]) {
+		rc = mbc_unix_init(mbc, path);
+
+	} else if (host && host[0]) {
+		rc = mbc_inet_init(mbc, host, port);
+
+	} else {
+		return -2;
+	}
+
+	if (rc) {
+		return -1;
+	}
+
+	return 0;
+}
+
 /* reference node global data */
 
 uint32_t *mbc_r_k_label;
@@ -121,22 +152,16 @@ mbc_py_nodal_initialize(const char *const path,
 		}
 	}
 
-	if (path && path[0]) {
-		if (mbc_unix_init((mbc_t *)&mbc, path)) {
-			return -1;
-		}
-
-	} else if (host && host[0]) {
-		if (mbc_inet_init((mbc_t *)&mbc, host, port)) {
-			return -1;
-		}
-
-	} else {
-		return -1;
+	int rc = mbc_py_connect((mbc_t *)&mbc, path, host, port);
+	if (rc) {
+		mbc_nodal_destroy(&mbc);
+		return rc;
 	}
 
+	/* parameters rejected: not worth retrying; close the socket */
 	if (mbc_nodal_init(&mbc, refnode, nodes, labels, rot, accels)) {
-		return -1;
+		mbc_nodal_destroy(&mbc);
+		return -2;
 	}
 
 	int id = ::n_mbc.size();
@@ -335,22 +360,16 @@ mbc_py_modal_initialize(const char *const path,
 		}
 	}
 
-	if (path && path[0]) {
-		if (mbc_unix_init((mbc_t *)&mbc, path)) {
-			return -1;
-		}
-
-	} else if (host && host[0]) {
-		if (mbc_inet_init((mbc_t *)&mbc, host, port)) {
-			return -1;
-		}
-
-	} else {
-		return -1;
+	int rc = mbc_py_connect((mbc_t *)&mbc, path, host, port);
+	if (rc) {
+		mbc_modal_destroy(&mbc);
+		return rc;
 	}
 
+	/* parameters rejected: not worth retrying; close the socket */
 	if (mbc_modal_init(&mbc, refnode, modes)) {
-		return -1;
+		mbc_modal_destroy(&mbc);
+		return -2;
 	}
 
 	int id = m_mbc.size();
@@ -0,0 +1,205 @@
+# $Header$
+# MBDyn (C) is a multibody analysis code. 
+# http://www.mbdyn.org
+# 
+# Copyright (C) 1996-2023
+# 
+# Pierangelo Masarati	<pierangelo.masarati@polimi.it>
+# Paolo Mantegazza	<paolo.mantegazza@polimi.it>
+# 
+# Dipartimento di Ingegneria Aerospaziale - Politecnico di Milano
+# via La Masa, 34 - 20156 Milano, Italy
+# http://www.aero.polimi.it
+# 
+# Changing this copyright notice is forbidden.
+# 
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation (version 2 of the License).
+# 
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+#
+# Benchmark of the Python coupling path (mbc_py_interface + libmbc).
+#
+# Each configuration runs an mbcNodal (or mbcModal) peer against an
+# mbcNodalMock (mbcModalMock) server in a separate process, and reports
+# steps/s, per-step latency percentiles (from mbcStats) and throughput.
+#
+# Example:
+#	python mbc_py_bench.py --nodes 1 100 10000 --rot theta mat \
+#		--transport unix inet --csv bench.csv
+#	python mbc_py_bench.py --baseline bench.csv --tolerance .2
+#
+# With --baseline, the exit status is non-zero if any configuration is
+# slower than the baseline by more than the tolerance.
+#
+
+from __future__ import print_function
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from mbc_py_interface import mbcNodal, mbcModal, mbc_nodal_sizes, mbc_modal_sizes, \
+	MBC_ROT_NONE, MBC_ROT_THETA, MBC_ROT_MAT, MBC_ROT_EULER_123
+from mbc_py_mock import mbcNodalMock, mbcModalMock
+
+ROT = {'none': MBC_ROT_NONE, 'theta': MBC_ROT_THETA, 'mat': MBC_ROT_MAT, 'euler_123': MBC_ROT_EULER_123}
+
+FIELDS = ('kind', 'transport', 'nodes', 'rot', 'accels', 'labels', 'steps',
+	'steps_per_second', 'latency_p50', 'latency_p99', 'recv_wait_p50', 'recv_wait_p99',
+	'send_p50', 'send_p99', 'mb_per_second')
+
+def _serve(cfg, path, steps, queue):
+	""" mock MBDyn side, run in a child process """
+	if cfg['kind'] == 'modal':
+		mock = mbcModalMock(path, 'localhost', 0, 0, cfg['nodes'])
+	else:
+		mock = mbcNodalMock(path, 'localhost', 0, 0, cfg['nodes'],
+			cfg['labels'], ROT[cfg['rot']], cfg['accels'])
+	try:
+		mock.listen()
+		queue.put(mock.port)
+		mock.accept(timeout = 60.)
+		mock.run(steps)
+	finally:
+		mock.close()
+
+def run_case(cfg, steps):
+	""" run one configuration; returns a dict with the FIELDS """
+	path = None
+	if cfg['transport'] == 'unix':
+		path = os.path.join(tempfile.mkdtemp(), 'mbc_py_bench.sock')
+
+	queue = multiprocessing.Queue()
+	server = multiprocessing.Process(target = _serve, args = (cfg, path, steps, queue))
+	server.start()
+	port = queue.get(timeout = 60.)
+
+	if cfg['kind'] == 'modal':
+		peer = mbcModal(path or '', 'localhost', port, 10, 0, 1, 0, cfg['nodes'], stats = True)
+	else:
+		peer = mbcNodal(path or '', 'localhost', port, 10, 0, 1, 0, cfg['nodes'],
+			cfg['labels'], ROT[cfg['rot']], cfg['accels'], stats = True)
+	with peer:
+		peer.negotiate()
+		t0 = time.time()
+		while peer.recv() == 0:
+			peer.send(True)
+		elapsed = time.time() - t0
+	server.join()
+
+	if path:
+		os.rmdir(os.path.dirname(path))
+
+	s = peer.stats.summary()
+	out = dict(cfg)
+	out['steps'] = s['steps']
+	out['steps_per_second'] = s['steps']/elapsed if elapsed > 0. else 0.
+	out['latency_p50'] = s.get('total_p50', 0.)
+	out['latency_p99'] = s.get('total_p99', 0.)
+	for name in ('recv_wait_p50', 'recv_wait_p99', 'send_p50', 'send_p99'):
+		out[name] = s.get(name, 0.)
+	nbytes = s.get('bytes_recv', 0) + s.get('bytes_sent', 0)
+	out['mb_per_second'] = nbytes/elapsed/1.e6 if elapsed > 0. else 0.
+	return out
+
+def configurations(args):
+	""" configurations swept by the benchmark """
+	if args.modal:
+		for transport, modes in itertools.product(args.transport, args.nodes):
+			yield dict(kind = 'modal', transport = transport, nodes = modes,
+				rot = 'mat', accels = 0, labels = 0)
+		return
+	for transport, nodes, rot, accels, labels in itertools.product(args.transport,
+			args.nodes, args.rot, args.accels, args.labels):
+		yield dict(kind = 'nodal', transport = transport, nodes = nodes,
+			rot = rot, accels = accels, labels = labels)
+
+def _key(row):
+	return tuple(str(row[f]) for f in FIELDS[:6])
+
+def compare(rows, baseline, tolerance):
+	""" configurations slower than baseline by more than tolerance """
+	ref = {}
+	with open(baseline) as f:
+		for row in csv.DictReader(f):
+			ref[_key(row)] = float(row['steps_per_second'])
+	slow = []
+	for row in rows:
+		r = ref.get(_key(row))
+		if r and row['steps_per_second'] < (1. - tolerance)*r:
+			slow.append((row, r))
+	return slow
+
+def main():
+	parser = argparse.ArgumentParser(
+		formatter_class = argparse.RawDescriptionHelpFormatter,
+		description = 'Benchmark the mbc_py coupling path against a mock MBDyn.')
+	parser.add_argument('--nodes', type = int, nargs = '+',
+		default = [1, 10, 100, 1000, 10000, 100000], help = 'node (or mode) counts')
+	parser.add_argument('--rot', nargs = '+', choices = sorted(ROT.keys()),
+		default = ['theta', 'mat', 'euler_123'], help = 'orientation parametrizations')
+	parser.add_argument('--accels', type = int, nargs = '+', choices = (0, 1), default = [0, 1])
+	parser.add_argument('--labels', type = int, nargs = '+', choices = (0, 1), default = [0, 1])
+	parser.add_argument('--transport', nargs = '+', choices = ('unix', 'inet'),
+		default = ['unix', 'inet'])
+	parser.add_argument('--modal', action = 'store_true', help = 'benchmark mbcModal instead')
+	parser.add_argument('--steps', type = int, default = 10000, help = 'maximum steps per case')
+	parser.add_argument('--max-mb', type = float, default = 1000.,
+		help = 'limit the kinematics traffic of each case (MB)')
+	parser.add_argument('--csv', help = 'write results to file')
+	parser.add_argument('--baseline', help = 'compare steps/s with a previous --csv output')
+	parser.add_argument('--tolerance', type = float, default = .2,
+		help = 'allowed relative slow-down with respect to --baseline')
+	args = parser.parse_args()
+
+	rows = []
+	print('%-5s %-5s %7s %-9s %2s %2s %8s %12s %12s %12s %10s' % ('kind', 'sock',
+		'nodes', 'rot', 'a', 'l', 'steps', 'steps/s', 'lat p50 [us]', 'lat p99 [us]', 'MB/s'))
+	for cfg in configurations(args):
+		if cfg['kind'] == 'modal':
+			k_size = mbc_modal_sizes(0, cfg['nodes'])[0]
+		else:
+			k_size = mbc_nodal_sizes(0, cfg['nodes'], cfg['labels'], ROT[cfg['rot']], cfg['accels'])[0]
+		steps = max(10, min(args.steps, int(args.max_mb*1.e6/k_size)))
+		row = run_case(cfg, steps)
+		rows.append(row)
+		print('%-5s %-5s %7d %-9s %2d %2d %8d %12.1f %12.1f %12.1f %10.1f' % (row['kind'],
+			row['transport'], row['nodes'], row['rot'], row['accels'], row['labels'],
+			row['steps'], row['steps_per_second'], 1.e6*row['latency_p50'],
+			1.e6*row['latency_p99'], row['mb_per_second']))
+		sys.stdout.flush()
+
+	if args.csv:
+		with open(args.csv, 'w') as f:
+			writer = csv.DictWriter(f, fieldnames = FIELDS)
+			writer.writeheader()
+			writer.writerows(rows)
+
+	if args.baseline:
+		slow = compare(rows, args.baseline, args.tolerance)
+		for row, ref in slow:
+			print('REGRESSION: %s: %.1f steps/s (baseline %.1f)'
+				% (' '.join(_key(row)), row['steps_per_second'], ref))
+		if slow:
+			return 1
+
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -30,26 +30,291 @@
 from __future__ import print_function
 import sys
 import os
+import time
 from numpy import *
 
+try:
+	from time import perf_counter as _clock
+except ImportError:
+	from time import time as _clock
+
 try:
         import mbc_py
 except ImportError:
         print("Import Error: mbc_py module")
 
-class mbcNodal:
-	def __init__(self, path, host, port, timeout, verbose, data_and_next, refnode, nodes, labels, rot, accels):
-		""" initialize the module """
-		self.id = mbc_py.mbc_py_nodal_initialize(path, host, port, timeout, verbose, data_and_next, refnode, nodes, labels, rot, accels);
-		if self.id < 0:
-			print("mbc_py_nodal_initialize: error");
-			raise Exception;
+# commands (see enum ESCmd in mbc.h)
+ES_UNKNOWN = -1;
+ES_REGULAR_DATA = 2;
+ES_GOTO_NEXT_STEP = 4;
+ES_ABORT = 5;
+ES_REGULAR_DATA_AND_GOTO_NEXT_STEP = 6;
+ES_NEGOTIATION = 7;
+ES_OK = 8;
+
+# communication type and fields (see enum MBCType in mbc.h)
+MBC_MODAL = 0x0001;
+MBC_NODAL = 0x0002;
+MBC_MODAL_NODAL_MASK = (MBC_MODAL | MBC_NODAL);
+MBC_REF_NODE = 0x0004;
+MBC_ACCELS = 0x0008;
+MBC_LABELS = 0x0010;
+
+# orientation parametrization flags (see enum MBCType in mbc.h)
+MBC_ROT_NONE = 0x0000;
+MBC_ROT_THETA = 0x0100;
+MBC_ROT_MAT = 0x0200;
+MBC_ROT_EULER_123 = 0x0400;
+MBC_ROT_MASK = (MBC_ROT_THETA | MBC_ROT_MAT | MBC_ROT_EULER_123);
+MBC_REF_NODE_ROT_MASK = (MBC_ROT_MASK << 4);
+
+def mbc_rot_size(rot):
+	""" number of doubles used by an orientation parametrization """
+	if rot == MBC_ROT_MAT:
+		return 9;
+	if rot in (MBC_ROT_THETA, MBC_ROT_EULER_123):
+		return 3;
+	return 0;
+
+def mbc_nodal_sizes(refnode, nodes, labels, rot, accels):
+	""" kinematics and dynamics payload size in bytes (mirrors mbc_nodal_init) """
+	k_size = 0;
+	d_size = 0;
+
+	if refnode:
+		ref_rot = (rot & MBC_REF_NODE_ROT_MASK) >> 4;
+		if ref_rot == MBC_ROT_NONE:
+			ref_rot = rot & MBC_ROT_MASK;
+		if labels:
+			# two uint32_t to preserve alignment of doubles
+			k_size += 8;
+			d_size += 8;
+		k_size += 8*(3 + mbc_rot_size(ref_rot) + 3 + 3);
+		if accels:
+			k_size += 8*(3 + 3);
+		d_size += 8*(3 + 3);
+
+	if nodes > 0:
+		node_rot = rot & MBC_ROT_MASK;
+		k = 3 + 3;
+		d = 3;
+		if node_rot != MBC_ROT_NONE:
+			k += mbc_rot_size(node_rot) + 3;
+			d += 3;
+		if accels:
+			k += 3;
+			if node_rot != MBC_ROT_NONE:
+				k += 3;
+		k_size += 8*k*nodes;
+		d_size += 8*d*nodes;
+		if labels:
+			k_size += 4*(nodes + nodes%2);
+			d_size += 4*(nodes + nodes%2);
+
+	return k_size, d_size;
+
+def mbc_modal_sizes(refnode, modes):
+	""" kinematics and dynamics payload size in bytes (mirrors mbc_modal_init) """
+	k_size = 0;
+	d_size = 0;
+
+	if refnode:
+		# reference node orientation is always a matrix, no labels, no accels
+		k_size += 8*(3 + 9 + 3 + 3);
+		d_size += 8*(3 + 3);
+
+	k_size += 8*2*modes;
+	d_size += 8*modes;
+
+	return k_size, d_size;
+
+class mbcStats:
+	""" per-step coupling timing record """
+
+	# one record per time step:
+	#   step		step counter (0-based)
+	#   t			wall clock at the beginning of the step [s]
+	#   recv_wait	time spent blocked in recv() [s]
+	#   send		time spent in send() [s]
+	#   compute		time spent by the peer between recv() and send() [s]
+	#   bytes_recv	bytes received from MBDyn (commands included)
+	#   bytes_sent	bytes sent to MBDyn (commands included)
+	#   iterations	number of recv()/send() exchanges (convergence iterations)
+	dtype = dtype([('step', uint32), ('t', float64),
+		('recv_wait', float64), ('send', float64), ('compute', float64),
+		('bytes_recv', uint64), ('bytes_sent', uint64),
+		('iterations', uint32)]);
+
+	def __init__(self, k_size, d_size, capacity = 1024):
+		""" k_size, d_size: kinematics and dynamics payload sizes in bytes """
+		self.k_size = k_size;
+		self.d_size = d_size;
+		self._rec = zeros(int(capacity) if capacity > 0 else 1, dtype = self.dtype);
+		self.reset();
+
+	def reset(self):
+		""" discard all records """
+		self._n = 0;
+		self._begin_step();
+
+	def _begin_step(self):
+		self._t = -1.;
+		self._recv_wait = 0.;
+		self._send = 0.;
+		self._compute = 0.;
+		self._bytes_recv = 0;
+		self._bytes_sent = 0;
+		self._iterations = 0;
+		self._t_recv_end = None;
+
+	def recv(self, t0, t1, rc):
+		""" account for a recv() that started at t0, ended at t1 and returned rc """
+		if self._t < 0.:
+			self._t = t0;
+		self._recv_wait += t1 - t0;
+		self._t_recv_end = t1;
+		if rc < 0:
+			# ABORT (or failure): only the command was received
+			self._bytes_recv += 1;
+		else:
+			self._bytes_recv += 1 + self.k_size;
+
+	def send(self, t0, t1, payload, last):
+		""" account for a send() that started at t0 and ended at t1 """
+		if self._t < 0.:
+			self._t = t0;
+		if self._t_recv_end is not None:
+			self._compute += t0 - self._t_recv_end;
+			self._t_recv_end = None;
+		self._send += t1 - t0;
+		self._bytes_sent += 1;
+		if payload:
+			self._bytes_sent += self.d_size;
+		self._iterations += 1;
+		if last:
+			self._end_step();
+
+	def _end_step(self):
+		if self._n == self._rec.shape[0]:
+			rec = zeros(2*self._rec.shape[0], dtype = self.dtype);
+			rec[:self._n] = self._rec;
+			self._rec = rec;
+		self._rec[self._n] = (self._n, self._t, self._recv_wait, self._send,
+			self._compute, self._bytes_recv, self._bytes_sent, self._iterations);
+		self._n += 1;
+		self._begin_step();
+
+	def __len__(self):
+		return self._n;
+
+	def array(self):
+		""" structured array with one record per completed step """
+		return self._rec[:self._n].copy();
+
+	def summary(self, q = (50, 99)):
+		""" percentiles q of per-step timings, plus totals """
+		rec = self._rec[:self._n];
+		out = {'steps': self._n};
+		if self._n == 0:
+			return out;
+		total = rec['recv_wait'] + rec['send'] + rec['compute'];
+		for name, data in (('recv_wait', rec['recv_wait']), ('send', rec['send']),
+				('compute', rec['compute']), ('total', total),
+				('iterations', rec['iterations'])):
+			for p in q:
+				out[name + '_p' + str(p)] = float(percentile(data, p));
+		out['bytes_recv'] = int(rec['bytes_recv'].sum());
+		out['bytes_sent'] = int(rec['bytes_sent'].sum());
+		elapsed = total.sum();
+		if elapsed > 0.:
+			out['steps_per_second'] = float(self._n/elapsed);
+		return out;
+
+class mbcError(Exception):
+	""" base class of mbc_py errors """
+	pass
+
+class mbcConnectionError(mbcError):
+	""" the connection to MBDyn could not be established """
+	pass
+
+class mbcNegotiationError(mbcError):
+	""" MBDyn rejected the negotiation, or replied unexpectedly """
+	pass
+
+def _mbc_connect(initialize, args, retries, backoff, backoff_max):
+	""" call initialize(*args), retrying with exponential backoff while the
+	connection fails (-1); parameters rejected by libmbc (-2) are not retried """
+	delay = backoff;
+	for attempt in range(retries + 1):
+		id = initialize(*args);
+		if id >= 0:
+			return id;
+		if id != -1:
+			raise mbcError("%s: parameters rejected" % initialize.__name__);
+		if attempt < retries:
+			time.sleep(delay);
+			delay = delay*2. if delay*2. < backoff_max else backoff_max;
+	raise mbcConnectionError("%s: connection failed after %d attempt(s)" % (initialize.__name__, retries + 1));
+
+class mbcPeer:
+	""" lifecycle shared by mbcNodal and mbcModal
+
+	used as a context manager, the connection is closed when the block
+	is left; on normal exit, if kinematics were received and no forces
+	were sent yet, send(last = True) is called first, so MBDyn is not left
+	waiting for the reply; on exceptions the socket is just closed, so
+	MBDyn fails immediately instead of waiting for its timeout
+	"""
+	_pending = False;
+	_finished = False;
+	_destroyed = False;
+
+	def __enter__(self):
+		return self;
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		try:
+			if exc_type is None and self._pending and not self._finished:
+				self.send(True);
+		finally:
+			self.destroy();
+		return False;
+
+	def _recv_done(self, rc):
+		self._pending = (rc == 0);
+		self._finished = (rc != 0);
+
+	def _send_done(self, rc):
+		self._pending = False;
+		if rc != 0:
+			self._finished = True;
+
+class mbcNodal(mbcPeer):
+	def __init__(self, path, host, port, timeout, verbose, data_and_next, refnode, nodes, labels, rot, accels, stats = False,
+			retries = 0, backoff = 1., backoff_max = 30.):
+		""" initialize the module; stats = True records per-step timings in self.stats;
+		on connection failure, retry up to retries times, waiting backoff seconds
+		first and doubling the wait up to backoff_max; raises mbcConnectionError,
+		or mbcError if the parameters are rejected """
+		self.id = _mbc_connect(mbc_py.mbc_py_nodal_initialize, (path, host, port, timeout, verbose,
+			data_and_next, refnode, nodes, labels, rot, accels), retries, backoff, backoff_max);
+
+		self.data_and_next = data_and_next;
+		self.refnode = refnode;
+		self.nodes = nodes;
+		self.labels = labels;
+		self.rot = rot;
+		self.accels = accels;
+		self.stats = None;
+		if stats:
+			k_size, d_size = mbc_nodal_sizes(refnode, nodes, labels, rot, accels);
+			self.stats = mbcStats(k_size, d_size);
 
 	def negotiate(self):
 		""" set pointers """
 		if (mbc_py.mbc_py_nodal_negotiate(self.id) < 0):
-			print("mbc_py_nodal_negotiate: error");
-			raise Exception;
+			raise mbcNegotiationError("mbc_py_nodal_negotiate: error");
 
 		self.r_k_label = mbc_py.cvar.mbc_r_k_label;
 		self.r_x = mbc_py.cvar.mbc_r_x;
@@ -105,29 +370,61 @@ class mbcNodal:
 
 	def send(self, last):
 		""" send forces to peer """
-		return mbc_py.mbc_py_nodal_send(self.id, last);
+		if self.stats is None:
+			rc = mbc_py.mbc_py_nodal_send(self.id, last);
+			self._send_done(rc);
+			return rc;
+
+		t0 = _clock();
+		rc = mbc_py.mbc_py_nodal_send(self.id, last);
+		# no payload when GOTO_NEXT_STEP is sent
+		self.stats.send(t0, _clock(), not last or self.data_and_next, last);
+		self._send_done(rc);
+		return rc;
 
 	def recv(self):
 		""" receive kinematics from peer """
-		return mbc_py.mbc_py_nodal_recv(self.id);
+		if self.stats is None:
+			rc = mbc_py.mbc_py_nodal_recv(self.id);
+			self._recv_done(rc);
+			return rc;
+
+		t0 = _clock();
+		rc = mbc_py.mbc_py_nodal_recv(self.id);
+		self.stats.recv(t0, _clock(), rc);
+		self._recv_done(rc);
+		return rc;
 
 	def destroy(self):
-		""" destroy handler """
+		""" destroy handler; further calls are no-ops """
+		if self._destroyed:
+			return 0;
+		self._destroyed = True;
 		return mbc_py.mbc_py_nodal_destroy(self.id);
 
-class mbcModal:
-	def __init__(self, path, host, port, timeout, verbose, data_and_next, refnode, modes):
-		""" initialize the module """
-		self.id = mbc_py.mbc_py_modal_initialize(path, host, port, timeout, verbose, data_and_next, refnode, modes);
-		if self.id < 0:
-			print("mbc_py_modal_initialize: error");
-			raise Exception;
+class mbcModal(mbcPeer):
+	def __init__(self, path, host, port, timeout, verbose, data_and_next, refnode, modes, stats = False,
+			retries = 0, backoff = 1., backoff_max = 30.):
+		""" initialize the module; stats = True records per-step timings in self.stats;
+		retries, backoff and backoff_max as in mbcNodal; raises mbcConnectionError,
+		or mbcError if the parameters are rejected """
+		self.id = _mbc_connect(mbc_py.mbc_py_modal_initialize, (path, host, port, timeout, verbose,
+			data_and_next, refnode, modes), retries, backoff, backoff_max);
+
+		self.data_and_next = data_and_next;
+		self.refnode = refnode;
+		self.modes = modes;
+		# the reference node orientation is always a matrix
+		self.rot = (MBC_ROT_MAT << 4);
+		self.stats = None;
+		if stats:
+			k_size, d_size = mbc_modal_sizes(refnode, modes);
+			self.stats = mbcStats(k_size, d_size);
 
 	def negotiate(self):
 		""" set pointers """
 		if (mbc_py.mbc_py_modal_negotiate(self.id) < 0):
-			print("mbc_py_modal_negotiate: error");
-			raise Exception;
+			raise mbcNegotiationError("mbc_py_modal_negotiate: error");
 
 		self.r_k_label = mbc_py.cvar.mbc_r_k_label;
 		self.r_x = mbc_py.cvar.mbc_r_x;
@@ -165,13 +462,35 @@ class mbcModal:
 
 	def send(self, last):
 		""" send forces to peer """
-		return mbc_py.mbc_py_modal_send(self.id, last);
+		if self.stats is None:
+			rc = mbc_py.mbc_py_modal_send(self.id, last);
+			self._send_done(rc);
+			return rc;
+
+		t0 = _clock();
+		rc = mbc_py.mbc_py_modal_send(self.id, last);
+		# no payload when GOTO_NEXT_STEP is sent
+		self.stats.send(t0, _clock(), not last or self.data_and_next, last);
+		self._send_done(rc);
+		return rc;
 
 	def recv(self):
 		""" receive kinematics from peer """
-		return mbc_py.mbc_py_modal_recv(self.id);
+		if self.stats is None:
+			rc = mbc_py.mbc_py_modal_recv(self.id);
+			self._recv_done(rc);
+			return rc;
+
+		t0 = _clock();
+		rc = mbc_py.mbc_py_modal_recv(self.id);
+		self.stats.recv(t0, _clock(), rc);
+		self._recv_done(rc);
+		return rc;
 
 	def destroy(self):
-		""" destroy handler """
+		""" destroy handler; further calls are no-ops """
+		if self._destroyed:
+			return 0;
+		self._destroyed = True;
 		return mbc_py.mbc_py_modal_destroy(self.id);
 
@@ -0,0 +1,434 @@
+# $Header$
+# MBDyn (C) is a multibody analysis code. 
+# http://www.mbdyn.org
+# 
+# Copyright (C) 1996-2023
+# 
+# Pierangelo Masarati	<pierangelo.masarati@polimi.it>
+# Paolo Mantegazza	<paolo.mantegazza@polimi.it>
+# 
+# Dipartimento di Ingegneria Aerospaziale - Politecnico di Milano
+# via La Masa, 34 - 20156 Milano, Italy
+# http://www.aero.polimi.it
+# 
+# Changing this copyright notice is forbidden.
+# 
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation (version 2 of the License).
+# 
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+#
+# Loopback stand-in for MBDyn's external structural/modal force elements.
+#
+# mbcNodalMock and mbcModalMock play the role of MBDyn in the libmbc
+# protocol (mbc.c, mbdyn/base/extsocket.cc, mbdyn/struct/strext.cc):
+# they listen on a UNIX or INET socket, answer the negotiation request of
+# an mbcNodal/mbcModal peer, then, for each time step, send prescribed
+# kinematics and receive forces until the peer sends its last data for
+# the step (send(last = True)); at the end they send ABORT, which makes
+# the peer's recv() fail as it would at the end of an MBDyn simulation.
+#
+# Usage:
+#	mock = mbcNodalMock(path = '/tmp/mbdyn.sock', nodes = 10, rot = MBC_ROT_MAT)
+#	mock.listen()
+#	... start the peer ...
+#	mock.accept()
+#	mock.run(1000, kinematics = lambda mock, step, it: mock.n_x.fill(step))
+#
+
+from __future__ import print_function
+import os
+import socket
+import numpy as np
+
+from mbc_py_interface import ES_REGULAR_DATA, ES_GOTO_NEXT_STEP, ES_ABORT, \
+	ES_REGULAR_DATA_AND_GOTO_NEXT_STEP, ES_NEGOTIATION, ES_OK, \
+	MBC_MODAL, MBC_NODAL, MBC_MODAL_NODAL_MASK, MBC_REF_NODE, MBC_ACCELS, MBC_LABELS, \
+	MBC_ROT_NONE, MBC_ROT_THETA, MBC_ROT_MAT, MBC_ROT_EULER_123, MBC_ROT_MASK, \
+	MBC_REF_NODE_ROT_MASK, mbcError
+
+_MSG_WAITALL = getattr(socket, 'MSG_WAITALL', 0)
+
+class mbcMockError(mbcError):
+	""" protocol violation or communication failure """
+	pass
+
+def _layout(fields):
+	""" offsets of (name, dtype, count, shape) fields in a packed buffer """
+	out = []
+	offset = 0
+	for name, dt, count, shape in fields:
+		out.append((name, dt, offset, count, shape))
+		offset += count*np.dtype(dt).itemsize
+	return out, offset
+
+def _rigid_fields(labels, rot, accels):
+	k = []
+	d = []
+	if labels:
+		# two uint32_t to preserve alignment of doubles
+		k.append(('r_k_label', np.uint32, 2, (2,)))
+	k.append(('r_x', np.float64, 3, (3,)))
+	if rot == MBC_ROT_THETA:
+		k.append(('r_theta', np.float64, 3, (3,)))
+	elif rot == MBC_ROT_MAT:
+		k.append(('r_r', np.float64, 9, (9,)))
+	elif rot == MBC_ROT_EULER_123:
+		k.append(('r_euler_123', np.float64, 3, (3,)))
+	else:
+		raise mbcMockError("rotation must be defined for reference node")
+	k.append(('r_xp', np.float64, 3, (3,)))
+	k.append(('r_omega', np.float64, 3, (3,)))
+	if accels:
+		k.append(('r_xpp', np.float64, 3, (3,)))
+		k.append(('r_omegap', np.float64, 3, (3,)))
+	if labels:
+		d.append(('r_d_label', np.uint32, 2, (2,)))
+	d.append(('r_f', np.float64, 3, (3,)))
+	d.append(('r_m', np.float64, 3, (3,)))
+	return k, d
+
+def _nodal_fields(nodes, labels, rot, accels):
+	k = []
+	d = []
+	nl = nodes + nodes%2
+	if labels:
+		k.append(('n_k_labels', np.uint32, nl, (nl,)))
+	k.append(('n_x', np.float64, 3*nodes, (nodes, 3)))
+	if rot == MBC_ROT_THETA:
+		k.append(('n_theta', np.float64, 3*nodes, (nodes, 3)))
+	elif rot == MBC_ROT_MAT:
+		k.append(('n_r', np.float64, 9*nodes, (nodes, 9)))
+	elif rot == MBC_ROT_EULER_123:
+		k.append(('n_euler_123', np.float64, 3*nodes, (nodes, 3)))
+	k.append(('n_xp', np.float64, 3*nodes, (nodes, 3)))
+	if rot != MBC_ROT_NONE:
+		k.append(('n_omega', np.float64, 3*nodes, (nodes, 3)))
+	if accels:
+		k.append(('n_xpp', np.float64, 3*nodes, (nodes, 3)))
+		if rot != MBC_ROT_NONE:
+			k.append(('n_omegap', np.float64, 3*nodes, (nodes, 3)))
+	if labels:
+		d.append(('n_d_labels', np.uint32, nl, (nl,)))
+	d.append(('n_f', np.float64, 3*nodes, (nodes, 3)))
+	if rot != MBC_ROT_NONE:
+		d.append(('n_m', np.float64, 3*nodes, (nodes, 3)))
+	return k, d
+
+class mbcMock(object):
+	""" server side of the libmbc protocol; use mbcNodalMock or mbcModalMock """
+
+	def __init__(self, path, host, port, flags, count, k_fields, d_fields, max_iterations):
+		self.path = path
+		self.host = host
+		self.port = port
+		self.flags = flags
+		self.count = count
+		self.max_iterations = max_iterations
+		self.sock = None
+		self.conn = None
+
+		k_layout, k_size = _layout(k_fields)
+		d_layout, d_size = _layout(d_fields)
+		self.k_size = k_size
+		self.d_size = d_size
+		self.k = np.zeros(k_size, dtype = np.uint8)
+		self.d = np.zeros(d_size, dtype = np.uint8)
+		self.k_fields = [f[0] for f in k_layout]
+		self.d_fields = [f[0] for f in d_layout]
+		self._d_layout = dict((f[0], f[1:]) for f in d_layout)
+		for buf, layout in ((self.k, k_layout), (self.d, d_layout)):
+			for name, dt, offset, count, shape in layout:
+				view = buf[offset:offset + count*np.dtype(dt).itemsize].view(dt).reshape(shape)
+				setattr(self, name, view)
+
+		self._cmd_view = memoryview(bytearray(1))
+		self.history = None
+		self.steps = 0
+		self.iterations = 0
+
+	def listen(self):
+		""" create the listening socket; with port = 0 an ephemeral port is used """
+		if self.path:
+			if os.path.exists(self.path):
+				os.unlink(self.path)
+			self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			self.sock.bind(self.path)
+		else:
+			self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+			self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+			self.sock.bind((self.host or 'localhost', self.port))
+			self.port = self.sock.getsockname()[1]
+		self.sock.listen(1)
+
+	def accept(self, timeout = None):
+		""" wait for the peer and negotiate """
+		if self.sock is None:
+			self.listen()
+		self.sock.settimeout(timeout)
+		self.conn, addr = self.sock.accept()
+		self.conn.settimeout(None)
+		if not self.path:
+			self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self.negotiate()
+
+	def _recv_into(self, buf):
+		view = memoryview(buf).cast('B')
+		n = len(view)
+		# MSG_WAITALL makes a single call enough, most of the times
+		got = self.conn.recv_into(view, n, _MSG_WAITALL)
+		while got < n:
+			rc = self.conn.recv_into(view[got:], n - got)
+			if rc == 0:
+				raise mbcMockError("peer closed the connection")
+			got += rc
+
+	def _recv_cmd(self):
+		self._recv_into(self._cmd_view)
+		return self._cmd_view[0]
+
+	def _send_cmd(self, cmd):
+		self.conn.sendall(bytes(bytearray((cmd,))))
+
+	def negotiate(self):
+		""" answer the peer's negotiation request (cf. mbc_nodal_negotiate_response) """
+		cmd = self._recv_cmd()
+		if cmd != ES_NEGOTIATION:
+			raise mbcMockError("unexpected cmd=%d from peer" % cmd)
+		buf = np.zeros(2, dtype = np.uint32)
+		self._recv_into(buf)
+		flags, count = int(buf[0]), int(buf[1])
+		mask = MBC_MODAL_NODAL_MASK | MBC_REF_NODE | MBC_LABELS | MBC_ACCELS | MBC_ROT_MASK
+		if (flags & mask) != (self.flags & mask) or count != self.count:
+			self._send_cmd(ES_ABORT)
+			raise mbcMockError("negotiation mismatch: peer flags=0x%x count=%d, "
+				"expected flags=0x%x count=%d" % (flags, count, self.flags, self.count))
+		self._send_cmd(ES_OK)
+
+	def record(self, steps):
+		""" keep the dynamics received at the end of each of the next steps """
+		self.history = np.zeros((steps, self.d_size), dtype = np.uint8)
+
+	def recorded(self, name):
+		""" recorded history of a dynamics field, e.g. recorded('n_f') """
+		dt, offset, count, shape = self._d_layout[name]
+		size = count*np.dtype(dt).itemsize
+		n = min(self.steps, self.history.shape[0])
+		return self.history[:n, offset:offset + size].copy().view(dt).reshape((n,) + shape)
+
+	def step(self, kinematics = None, forces = None):
+		""" exchange data for one time step; returns the number of iterations """
+		step = self.steps
+		conn = self.conn
+		head = bytes(bytearray((ES_REGULAR_DATA,)))
+		k = memoryview(self.k)
+		for it in range(self.max_iterations):
+			if kinematics is not None:
+				kinematics(self, step, it)
+			# command and kinematics in one system call, when possible
+			if hasattr(conn, 'sendmsg'):
+				sent = conn.sendmsg([head, k])
+				if sent < 1 + self.k_size:
+					conn.sendall(k[sent - 1:])
+			else:
+				conn.sendall(head)
+				conn.sendall(k)
+
+			cmd = self._recv_cmd()
+			if cmd == ES_ABORT:
+				raise mbcMockError("peer aborted at step %d" % step)
+			if cmd not in (ES_REGULAR_DATA, ES_GOTO_NEXT_STEP, ES_REGULAR_DATA_AND_GOTO_NEXT_STEP):
+				raise mbcMockError("unknown cmd=%d from peer" % cmd)
+			if cmd != ES_GOTO_NEXT_STEP and self.d_size:
+				self._recv_into(self.d)
+			if forces is not None:
+				forces(self, step, it)
+			if cmd != ES_REGULAR_DATA:
+				break
+		else:
+			raise mbcMockError("peer did not converge in %d iterations at step %d"
+				% (self.max_iterations, step))
+
+		if self.history is not None and step < self.history.shape[0]:
+			self.history[step] = self.d
+		self.steps += 1
+		self.iterations += it + 1
+		return it + 1
+
+	def run(self, steps, kinematics = None, forces = None):
+		""" run steps time steps, then terminate the peer
+
+		kinematics(mock, step, iteration) fills the kinematics buffers
+		(mock.n_x, mock.n_r, ...) before each send; it can also be a dict
+		mapping buffer names to arrays whose first dimension is the step.
+		forces(mock, step, iteration) is called after each receive.
+		"""
+		if isinstance(kinematics, dict):
+			kinematics = _prescribed(kinematics)
+		for step in range(steps):
+			self.step(kinematics, forces)
+		self.close()
+
+	def close(self):
+		""" send ABORT to the peer (as MBDyn does on exit) and close sockets """
+		if self.conn is not None:
+			try:
+				self._send_cmd(ES_ABORT)
+			except socket.error:
+				pass
+			self.conn.close()
+			self.conn = None
+		if self.sock is not None:
+			self.sock.close()
+			self.sock = None
+			if self.path and os.path.exists(self.path):
+				os.unlink(self.path)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+		return False
+
+def _prescribed(trajectories):
+	""" kinematics callback copying step-indexed arrays into the buffers """
+	items = list(trajectories.items())
+	def kinematics(mock, step, it):
+		for name, data in items:
+			buf = getattr(mock, name)
+			buf[...] = np.asarray(data[step % len(data)]).reshape(buf.shape)
+	return kinematics
+
+class mbcNodalMock(mbcMock):
+	""" stand-in for an external structural force element """
+
+	def __init__(self, path = None, host = None, port = 0, refnode = 0, nodes = 0,
+			labels = 0, rot = MBC_ROT_MAT, accels = 0, max_iterations = 1000):
+		""" arguments mirror those of mbcNodal """
+		if not refnode and nodes == 0:
+			raise mbcMockError("need at least 1 node or reference node data")
+
+		node_rot = rot & MBC_ROT_MASK
+		ref_rot = (rot & MBC_REF_NODE_ROT_MASK) >> 4
+		if ref_rot == MBC_ROT_NONE:
+			ref_rot = node_rot
+
+		flags = MBC_NODAL | node_rot
+		k_fields = []
+		d_fields = []
+		if refnode:
+			flags |= MBC_REF_NODE | (ref_rot << 4)
+			k, d = _rigid_fields(labels, ref_rot, accels)
+			k_fields += k
+			d_fields += d
+		if labels:
+			flags |= MBC_LABELS
+		if accels:
+			flags |= MBC_ACCELS
+		if nodes > 0:
+			k, d = _nodal_fields(nodes, labels, node_rot, accels)
+			k_fields += k
+			d_fields += d
+
+		mbcMock.__init__(self, path, host, port, flags, nodes, k_fields, d_fields, max_iterations)
+
+		self.refnode = refnode
+		self.nodes = nodes
+		self.labels = labels
+		self.rot = rot
+		self.accels = accels
+
+		if labels:
+			if refnode:
+				self.r_k_label[0] = 0
+			if nodes > 0:
+				self.n_k_labels[:nodes] = np.arange(1, nodes + 1)
+		# identity orientation
+		if nodes > 0 and node_rot == MBC_ROT_MAT:
+			self.n_r[:, [0, 4, 8]] = 1.
+		if refnode and ref_rot == MBC_ROT_MAT:
+			self.r_r[[0, 4, 8]] = 1.
+
+class mbcModalMock(mbcMock):
+	""" stand-in for an external modal force element """
+
+	def __init__(self, path = None, host = None, port = 0, refnode = 0, modes = 0,
+			max_iterations = 1000):
+		""" arguments mirror those of mbcModal """
+		if not refnode and modes == 0:
+			raise mbcMockError("need at least 1 mode or reference node data")
+
+		flags = MBC_MODAL
+		k_fields = []
+		d_fields = []
+		if refnode:
+			flags |= MBC_REF_NODE | (MBC_ROT_MAT << 4)
+			k, d = _rigid_fields(0, MBC_ROT_MAT, 0)
+			k_fields += k
+			d_fields += d
+		if modes > 0:
+			k_fields += [('m_q', np.float64, modes, (modes,)),
+				('m_qp', np.float64, modes, (modes,))]
+			d_fields += [('m_p', np.float64, modes, (modes,))]
+
+		mbcMock.__init__(self, path, host, port, flags, modes, k_fields, d_fields, max_iterations)
+
+		self.refnode = refnode
+		self.modes = modes
+		self.rot = (MBC_ROT_MAT << 4)
+
+		if refnode:
+			self.r_r[[0, 4, 8]] = 1.
+
+if __name__ == '__main__':
+	import argparse
+	import time
+
+	parser = argparse.ArgumentParser(
+		description = 'Serve prescribed kinematics to an mbc_py peer, in place of MBDyn.')
+	parser.add_argument('--path', help = 'UNIX socket path')
+	parser.add_argument('--host', default = 'localhost', help = 'INET socket host')
+	parser.add_argument('--port', type = int, default = 9011, help = 'INET socket port')
+	parser.add_argument('--modal', action = 'store_true', help = 'modal instead of nodal')
+	parser.add_argument('--refnode', type = int, default = 0)
+	parser.add_argument('--nodes', type = int, default = 1, help = 'nodes (or modes, with --modal)')
+	parser.add_argument('--labels', type = int, default = 0)
+	parser.add_argument('--rot', type = lambda s: int(s, 0), default = MBC_ROT_MAT,
+		help = 'orientation flags, e.g. 0x100 (theta), 0x200 (matrix), 0x400 (euler 123)')
+	parser.add_argument('--accels', type = int, default = 0)
+	parser.add_argument('--steps', type = int, default = 1000)
+	parser.add_argument('--dt', type = float, default = 1.e-3,
+		help = 'time step of the prescribed harmonic motion')
+	args = parser.parse_args()
+
+	if args.modal:
+		mock = mbcModalMock(args.path, args.host, args.port, args.refnode, args.nodes)
+		def kinematics(mock, step, it):
+			mock.m_q[:] = np.sin(2.*np.pi*step*args.dt)
+	else:
+		mock = mbcNodalMock(args.path, args.host, args.port, args.refnode,
+			args.nodes, args.labels, args.rot, args.accels)
+		def kinematics(mock, step, it):
+			mock.n_x[:, 2] = np.sin(2.*np.pi*step*args.dt)
+
+	with mock:
+		mock.listen()
+		mock.accept()
+		t0 = time.time()
+		mock.run(args.steps, kinematics)
+		elapsed = time.time() - t0
+
+	print("%d steps, %d iterations in %g s (%g steps/s)"
+		% (mock.steps, mock.iterations, elapsed, mock.steps/elapsed if elapsed > 0. else 0.))
@@ -0,0 +1,244 @@
+# $Header$
+# MBDyn (C) is a multibody analysis code. 
+# http://www.mbdyn.org
+# 
+# Copyright (C) 1996-2023
+# 
+# Pierangelo Masarati	<pierangelo.masarati@polimi.it>
+# Paolo Mantegazza	<paolo.mantegazza@polimi.it>
+# 
+# Dipartimento di Ingegneria Aerospaziale - Politecnico di Milano
+# via La Masa, 34 - 20156 Milano, Italy
+# http://www.aero.polimi.it
+# 
+# Changing this copyright notice is forbidden.
+# 
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation (version 2 of the License).
+# 
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+#
+# Batched orientation conversions for the kinematics exchanged by libmbc.
+#
+# Conventions follow those of MBDyn's external structural force
+# (mbdyn/struct/strext.cc):
+#  - orientation matrices are sent column-major (R11, R21, R31, R12, ...);
+#  - orientation vectors are those of RotManip::VecRot();
+#  - Euler angles (123 sequence) are those of MatR2EulerAngles123(),
+#    and are sent in degrees.
+#
+# All functions operate on arrays of shape (..., 3) or (..., 3, 3), so
+# a whole set of nodes is converted at once; flat libmbc buffers (e.g.
+# mbcNodal.n_theta, mbcNodal.n_r) are reshaped with vec3_from_buffer()
+# and r_from_buffer().
+#
+
+import numpy as np
+
+from mbc_py_interface import MBC_ROT_NONE, MBC_ROT_THETA, MBC_ROT_MAT, \
+	MBC_ROT_EULER_123, MBC_ROT_MASK, MBC_REF_NODE_ROT_MASK
+
+_RAD2DEG = 180./np.pi
+
+def vec3_from_buffer(buf):
+	""" view a flat (3*n) buffer as an (n, 3) array """
+	return np.asarray(buf).reshape(-1, 3)
+
+def r_from_buffer(buf):
+	""" view a flat, column-major (9*n) buffer as an (n, 3, 3) array """
+	return np.asarray(buf).reshape(-1, 3, 3).swapaxes(-1, -2)
+
+def r_to_buffer(R, out = None):
+	""" pack (n, 3, 3) orientation matrices column-major into a flat buffer """
+	buf = np.ascontiguousarray(np.asarray(R).swapaxes(-1, -2)).reshape(-1)
+	if out is None:
+		return buf
+	out[:] = buf
+	return out
+
+def skew(v):
+	""" cross product matrices of (..., 3) vectors """
+	v = np.asarray(v, dtype = np.float64)
+	S = np.zeros(v.shape + (3,), dtype = np.float64)
+	S[..., 0, 1] = -v[..., 2]
+	S[..., 0, 2] = v[..., 1]
+	S[..., 1, 0] = v[..., 2]
+	S[..., 1, 2] = -v[..., 0]
+	S[..., 2, 0] = -v[..., 1]
+	S[..., 2, 1] = v[..., 0]
+	return S
+
+def theta_to_r(theta):
+	""" orientation vectors to orientation matrices (RotManip::Rot) """
+	theta = np.asarray(theta, dtype = np.float64)
+	phi = np.sqrt(np.einsum('...i,...i->...', theta, theta))
+	# sin(phi)/phi and (1 - cos(phi))/phi^2, well-behaved for phi -> 0
+	c0 = np.sinc(phi/np.pi)
+	c1 = .5*np.sinc(phi/(2.*np.pi))**2
+	T = skew(theta)
+	R = c0[..., None, None]*T + c1[..., None, None]*np.matmul(T, T)
+	R[..., 0, 0] += 1.
+	R[..., 1, 1] += 1.
+	R[..., 2, 2] += 1.
+	return R
+
+def r_to_theta(R):
+	""" orientation matrices to orientation vectors (RotManip::VecRot) """
+	R = np.asarray(R, dtype = np.float64)
+	cosphi = (np.trace(R, axis1 = -2, axis2 = -1) - 1.)/2.
+	ax = .5*np.stack((R[..., 2, 1] - R[..., 1, 2],
+		R[..., 0, 2] - R[..., 2, 0],
+		R[..., 1, 0] - R[..., 0, 1]), axis = -1)
+	theta = np.empty(R.shape[:-1], dtype = np.float64)
+
+	# cos(phi) > 0: the axial vector is accurate
+	big = cosphi > 0.
+	sinphi = np.sqrt(np.einsum('...i,...i->...', ax[big], ax[big]))
+	phi = np.arctan2(sinphi, cosphi[big])
+	theta[big] = ax[big]/np.sinc(phi/np.pi)[..., None]
+
+	# -1 <= cos(phi) <= 0: use the symmetric part
+	small = ~big
+	if np.any(small):
+		c = cosphi[small]
+		eet = .5*(R[small] + R[small].swapaxes(-1, -2))
+		eet[..., 0, 0] -= c
+		eet[..., 1, 1] -= c
+		eet[..., 2, 2] -= c
+		diag = np.diagonal(eet, axis1 = -2, axis2 = -1)
+		maxcol = np.argmax(diag, axis = -1)
+		idx = np.arange(maxcol.shape[0])
+		unit = eet[idx, :, maxcol]/np.sqrt(diag[idx, maxcol]*(1. - c))[:, None]
+		s = np.einsum('...i,...i->...', unit, ax[small])
+		theta[small] = unit*np.arctan2(s, c)[:, None]
+
+	return theta
+
+def euler_123_to_r(e, deg = True):
+	""" Euler angles (123 sequence) to orientation matrices (EulerAngles123_2MatR) """
+	e = np.asarray(e, dtype = np.float64)
+	if deg:
+		e = e/_RAD2DEG
+	ca, cb, cc = np.cos(e[..., 0]), np.cos(e[..., 1]), np.cos(e[..., 2])
+	sa, sb, sc = np.sin(e[..., 0]), np.sin(e[..., 1]), np.sin(e[..., 2])
+	R = np.empty(e.shape + (3,), dtype = np.float64)
+	R[..., 0, 0] = cb*cc
+	R[..., 1, 0] = ca*sc + sa*sb*cc
+	R[..., 2, 0] = sa*sc - ca*sb*cc
+	R[..., 0, 1] = -cb*sc
+	R[..., 1, 1] = ca*cc - sa*sb*sc
+	R[..., 2, 1] = sa*cc + ca*sb*sc
+	R[..., 0, 2] = sb
+	R[..., 1, 2] = -sa*cb
+	R[..., 2, 2] = ca*cb
+	return R
+
+def r_to_euler_123(R, deg = True):
+	""" orientation matrices to Euler angles (123 sequence) (MatR2EulerAngles123) """
+	R = np.asarray(R, dtype = np.float64)
+	alpha = np.arctan2(-R[..., 1, 2], R[..., 2, 2])
+	ca = np.cos(alpha)
+	sa = np.sin(alpha)
+	e = np.stack((alpha,
+		np.arctan2(R[..., 0, 2], ca*R[..., 2, 2] - sa*R[..., 1, 2]),
+		np.arctan2(ca*R[..., 1, 0] + sa*R[..., 2, 0],
+			ca*R[..., 1, 1] + sa*R[..., 2, 1])), axis = -1)
+	if deg:
+		e *= _RAD2DEG
+	return e
+
+def theta_to_euler_123(theta, deg = True):
+	""" orientation vectors to Euler angles (123 sequence) """
+	return r_to_euler_123(theta_to_r(theta), deg)
+
+def euler_123_to_theta(e, deg = True):
+	""" Euler angles (123 sequence) to orientation vectors """
+	return r_to_theta(euler_123_to_r(e, deg))
+
+def relative_kinematics(x_ref, R_ref, xp_ref, omega_ref, x, R, xp, omega,
+		xpp_ref = None, omegap_ref = None, xpp = None, omegap = None):
+	""" kinematics of nodes relative to a reference node, as computed by
+	StructExtForce::SendToFileDes() when a reference node is used;
+	returns (x, R, xp, omega, xpp, omegap) in the reference frame """
+	R_ref = np.asarray(R_ref, dtype = np.float64)
+	omega_ref = np.asarray(omega_ref, dtype = np.float64)
+	RT = R_ref.swapaxes(-1, -2)
+
+	Dx = np.asarray(x) - x_ref
+	Dv = np.asarray(xp) - xp_ref - np.cross(omega_ref, Dx)
+	x_t = np.einsum('...ij,...j->...i', RT, Dx)
+	R_t = np.matmul(RT, R)
+	xp_t = np.einsum('...ij,...j->...i', RT, Dv)
+	omega_t = np.einsum('...ij,...j->...i', RT, np.asarray(omega) - omega_ref)
+
+	xpp_t = None
+	omegap_t = None
+	if xpp is not None:
+		xpp_t = np.einsum('...ij,...j->...i', RT, np.asarray(xpp) - xpp_ref
+			- np.cross(omegap_ref, Dx)
+			- np.cross(omega_ref, np.cross(omega_ref, Dx) + 2.*Dv))
+	if omegap is not None:
+		# NOTE: same expression as in strext.cc
+		omegap_t = np.einsum('...ij,...j->...i', RT, omegap) - omegap_ref \
+			- np.cross(omega_ref, omega)
+
+	return x_t, R_t, xp_t, omega_t, xpp_t, omegap_t
+
+def absolute_kinematics(x_ref, R_ref, xp_ref, omega_ref, x, R, xp, omega,
+		xpp_ref = None, omegap_ref = None, xpp = None, omegap = None):
+	""" inverse of relative_kinematics(): recover global kinematics from
+	those received relative to the reference node """
+	R_ref = np.asarray(R_ref, dtype = np.float64)
+	omega_ref = np.asarray(omega_ref, dtype = np.float64)
+
+	Dx = np.einsum('...ij,...j->...i', R_ref, x)
+	Dv = np.einsum('...ij,...j->...i', R_ref, xp)
+	x_a = Dx + x_ref
+	R_a = np.matmul(R_ref, R)
+	xp_a = Dv + xp_ref + np.cross(omega_ref, Dx)
+	omega_a = np.einsum('...ij,...j->...i', R_ref, omega) + omega_ref
+
+	xpp_a = None
+	omegap_a = None
+	if xpp is not None:
+		xpp_a = np.einsum('...ij,...j->...i', R_ref, xpp) + xpp_ref \
+			+ np.cross(omegap_ref, Dx) \
+			+ np.cross(omega_ref, np.cross(omega_ref, Dx) + 2.*Dv)
+	if omegap is not None:
+		omegap_a = np.einsum('...ij,...j->...i', R_ref,
+			np.asarray(omegap) + omegap_ref + np.cross(omega_ref, omega_a))
+
+	return x_a, R_a, xp_a, omega_a, xpp_a, omegap_a
+
+def nodal_r(mbc):
+	""" orientation matrices of the nodes of a negotiated mbcNodal,
+	whatever the orientation parametrization, as an (n, 3, 3) array """
+	return _to_r(mbc.rot & MBC_ROT_MASK, mbc.n_theta, mbc.n_r, mbc.n_euler_123)
+
+def ref_r(mbc):
+	""" orientation matrix of the reference node of a negotiated mbcNodal
+	or mbcModal """
+	rot = (mbc.rot & MBC_REF_NODE_ROT_MASK) >> 4
+	if rot == MBC_ROT_NONE:
+		rot = mbc.rot & MBC_ROT_MASK
+	return _to_r(rot, mbc.r_theta, mbc.r_r, mbc.r_euler_123)[0]
+
+def _to_r(rot, theta, r, euler_123):
+	if rot == MBC_ROT_THETA:
+		return theta_to_r(vec3_from_buffer(theta))
+	if rot == MBC_ROT_MAT:
+		return r_from_buffer(r)
+	if rot == MBC_ROT_EULER_123:
+		return euler_123_to_r(vec3_from_buffer(euler_123))
+	raise ValueError("no orientation negotiated")
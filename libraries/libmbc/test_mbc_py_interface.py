@@ -0,0 +1,35 @@
+import unittest
+from mbc_py_interface import _mbc_connect, mbcError, mbcConnectionError
+
+class _Initialize:
+	""" stand-in for mbc_py_*_initialize, returning rcs in turn """
+	def __init__(self, rcs):
+		self.rcs = list(rcs)
+		self.calls = 0
+		self.__name__ = 'initialize'
+
+	def __call__(self, *args):
+		self.calls += 1
+		return self.rcs.pop(0)
+
+class TestMbcConnect(unittest.TestCase):
+	def test_retries_connection_failures(self):
+		initialize = _Initialize([-1, -1, 3])
+		self.assertEqual(_mbc_connect(initialize, (), 2, 0., 0.), 3)
+		self.assertEqual(initialize.calls, 3)
+
+	def test_gives_up(self):
+		initialize = _Initialize([-1, -1, -1])
+		with self.assertRaises(mbcConnectionError):
+			_mbc_connect(initialize, (), 2, 0., 0.)
+		self.assertEqual(initialize.calls, 3)
+
+	def test_rejected_parameters_not_retried(self):
+		initialize = _Initialize([-1, -2, 0])
+		with self.assertRaises(mbcError) as cm:
+			_mbc_connect(initialize, (), 5, 0., 0.)
+		self.assertNotIsInstance(cm.exception, mbcConnectionError)
+		self.assertEqual(initialize.calls, 2)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,108 @@
+import os
+import socket
+import tempfile
+import threading
+import unittest
+import numpy as np
+from mbc_py_interface import mbc_nodal_sizes, mbc_modal_sizes
+from mbc_py_mock import *
+
+def _recvn(sock, n):
+	buf = b''
+	while len(buf) < n:
+		chunk = sock.recv(n - len(buf))
+		if not chunk:
+			raise EOFError
+		buf += chunk
+	return buf
+
+def _peer(path, flags, count, k_size, d_size, iterations, out):
+	""" minimal peer speaking the client side of the protocol, like mbc.c """
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	sock.connect(path)
+	sock.sendall(bytes(bytearray((ES_NEGOTIATION,))) + np.array([flags, count], dtype = np.uint32).tobytes())
+	out['negotiation'] = _recvn(sock, 1)[0]
+	step = 0
+	while True:
+		for it in range(iterations):
+			cmd = _recvn(sock, 1)[0]
+			if cmd == ES_ABORT:
+				out['steps'] = step
+				sock.close()
+				return
+			k = np.frombuffer(_recvn(sock, k_size), dtype = np.uint8)
+			out.setdefault('k', []).append(k)
+			last = (it == iterations - 1)
+			cmd = ES_REGULAR_DATA_AND_GOTO_NEXT_STEP if last else ES_REGULAR_DATA
+			d = np.full(d_size//8, step + .5*it)
+			sock.sendall(bytes(bytearray((cmd,))) + d.tobytes())
+		step += 1
+
+class TestMbcPyMock(unittest.TestCase):
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+		self.path = os.path.join(self.tmpdir, 'mbdyn.sock')
+
+	def tearDown(self):
+		if os.path.exists(self.path):
+			os.unlink(self.path)
+		os.rmdir(self.tmpdir)
+
+	def _run(self, mock, flags, count, k_size, d_size, steps, iterations, kinematics):
+		mock.listen()
+		out = {}
+		peer = threading.Thread(target = _peer,
+			args = (self.path, flags, count, k_size, d_size, iterations, out))
+		peer.start()
+		mock.accept(timeout = 10.)
+		mock.record(steps)
+		mock.run(steps, kinematics)
+		peer.join(10.)
+		return out
+
+	def test_nodal(self):
+		nodes = 3
+		rot = MBC_ROT_MAT
+		mock = mbcNodalMock(path = self.path, refnode = 1, nodes = nodes, rot = rot)
+		k_size, d_size = mbc_nodal_sizes(1, nodes, 0, rot, 0)
+		self.assertEqual((mock.k_size, mock.d_size), (k_size, d_size))
+		flags = MBC_NODAL | MBC_REF_NODE | rot | (rot << 4)
+		traj = np.arange(4*nodes*3, dtype = np.float64).reshape(4, nodes, 3)
+		out = self._run(mock, flags, nodes, k_size, d_size, 4, 2, {'n_x': traj})
+
+		self.assertEqual(out['negotiation'], ES_OK)
+		self.assertEqual(out['steps'], 4)
+		self.assertEqual(mock.iterations, 8)
+		# reference node data come first: x, R, xp, omega
+		k = out['k'][6].view(np.float64)
+		np.testing.assert_array_equal(k[3:12], [1., 0., 0., 0., 1., 0., 0., 0., 1.])
+		np.testing.assert_array_equal(k[18:18 + 3*nodes], traj[3].ravel())
+		# last data of each step are kept
+		np.testing.assert_array_equal(mock.recorded('n_f')[:, 0, 0], [.5, 1.5, 2.5, 3.5])
+		self.assertEqual(mock.recorded('r_m').shape, (4, 3))
+
+	def test_modal(self):
+		modes = 5
+		mock = mbcModalMock(path = self.path, modes = modes)
+		k_size, d_size = mbc_modal_sizes(0, modes)
+		def kinematics(mock, step, it):
+			mock.m_q[:] = step
+		out = self._run(mock, MBC_MODAL, modes, k_size, d_size, 3, 1, kinematics)
+		self.assertEqual(out['steps'], 3)
+		np.testing.assert_array_equal(out['k'][2].view(np.float64)[:modes], 2.)
+		np.testing.assert_array_equal(mock.recorded('m_p')[:, 0], [0., 1., 2.])
+
+	def test_negotiation_mismatch(self):
+		mock = mbcNodalMock(path = self.path, nodes = 2, rot = MBC_ROT_THETA)
+		mock.listen()
+		out = {}
+		peer = threading.Thread(target = _peer,
+			args = (self.path, MBC_NODAL | MBC_ROT_THETA, 3, 0, 0, 1, out))
+		peer.start()
+		self.assertRaises(mbcMockError, mock.accept, 10.)
+		mock.close()
+		peer.join(10.)
+		self.assertEqual(out['negotiation'], ES_ABORT)
+
+if __name__ == '__main__':
+	unittest.main()
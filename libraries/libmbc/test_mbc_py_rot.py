@@ -0,0 +1,85 @@
+import unittest
+import numpy as np
+from mbc_py_rot import *
+
+def _rx(a):
+	c, s = np.cos(a), np.sin(a)
+	return np.array([[1., 0., 0.], [0., c, -s], [0., s, c]])
+
+def _ry(a):
+	c, s = np.cos(a), np.sin(a)
+	return np.array([[c, 0., s], [0., 1., 0.], [-s, 0., c]])
+
+def _rz(a):
+	c, s = np.cos(a), np.sin(a)
+	return np.array([[c, -s, 0.], [s, c, 0.], [0., 0., 1.]])
+
+class TestMbcPyRot(unittest.TestCase):
+	def setUp(self):
+		rng = np.random.default_rng(1)
+		axis = rng.normal(size = (200, 3))
+		axis /= np.linalg.norm(axis, axis = 1)[:, None]
+		# cover small angles, cos(phi) <= 0 and angles close to pi
+		angle = np.concatenate((np.linspace(0., 1.e-6, 20),
+			np.linspace(.1, np.pi - 1.e-6, 180)))
+		self.theta = axis*angle[:, None]
+
+	def test_theta_roundtrip(self):
+		R = theta_to_r(self.theta)
+		np.testing.assert_allclose(np.matmul(R, R.swapaxes(1, 2)),
+			np.broadcast_to(np.eye(3), R.shape), atol = 1.e-12)
+		np.testing.assert_allclose(r_to_theta(R), self.theta, atol = 1.e-9)
+
+	def test_theta_rodrigues(self):
+		theta = self.theta[-1]
+		phi = np.linalg.norm(theta)
+		K = skew(theta/phi)
+		R = np.eye(3) + np.sin(phi)*K + (1. - np.cos(phi))*K.dot(K)
+		np.testing.assert_allclose(theta_to_r(theta), R, atol = 1.e-12)
+
+	def test_euler_123(self):
+		e = np.array([10., -20., 30.])
+		R = _rx(np.radians(e[0])).dot(_ry(np.radians(e[1]))).dot(_rz(np.radians(e[2])))
+		np.testing.assert_allclose(euler_123_to_r(e), R, atol = 1.e-12)
+		np.testing.assert_allclose(r_to_euler_123(R), e, atol = 1.e-10)
+		np.testing.assert_allclose(r_to_euler_123(R, deg = False), np.radians(e), atol = 1.e-12)
+		np.testing.assert_allclose(euler_123_to_theta(theta_to_euler_123(self.theta[20:])),
+			self.theta[20:], atol = 1.e-8)
+
+	def test_buffer_is_column_major(self):
+		R = theta_to_r(self.theta[:4])
+		buf = r_to_buffer(R)
+		self.assertEqual(buf.shape, (36,))
+		self.assertEqual(buf[1], R[0, 1, 0])
+		self.assertEqual(buf[3], R[0, 0, 1])
+		np.testing.assert_array_equal(r_from_buffer(buf), R)
+		out = np.zeros(36)
+		r_to_buffer(R, out)
+		np.testing.assert_array_equal(out, buf)
+
+	def test_relative_absolute_roundtrip(self):
+		rng = np.random.default_rng(2)
+		n = 5
+		ref = (rng.normal(size = 3), theta_to_r(rng.normal(size = 3)),
+			rng.normal(size = 3), rng.normal(size = 3))
+		node = (rng.normal(size = (n, 3)), theta_to_r(rng.normal(size = (n, 3))),
+			rng.normal(size = (n, 3)), rng.normal(size = (n, 3)))
+		acc_ref = dict(xpp_ref = rng.normal(size = 3), omegap_ref = rng.normal(size = 3))
+		acc = dict(xpp = rng.normal(size = (n, 3)), omegap = rng.normal(size = (n, 3)))
+
+		rel = relative_kinematics(*(ref + node), **dict(acc_ref, **acc))
+		rel_acc = dict(xpp = rel[4], omegap = rel[5])
+		back = absolute_kinematics(*(ref + rel[:4]), **dict(acc_ref, **rel_acc))
+		for a, b in zip(back, node + (acc['xpp'], acc['omegap'])):
+			np.testing.assert_allclose(a, b, atol = 1.e-12)
+
+		# a node rigidly attached to the reference node has no relative velocity
+		Dx = node[0] - ref[0]
+		xp = ref[2] + np.cross(ref[3], Dx)
+		rel = relative_kinematics(ref[0], ref[1], ref[2], ref[3],
+			node[0], node[1], xp, np.broadcast_to(ref[3], (n, 3)))
+		np.testing.assert_allclose(rel[2], 0., atol = 1.e-12)
+		np.testing.assert_allclose(rel[3], 0., atol = 1.e-12)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -3,6 +3,8 @@
 import numpy as np
 import matplotlib.pyplot as plt
 
+import hfresponse
+
 omega0=10.0*2*np.pi
 xi=0.1
 M=1.
@@ -13,32 +15,25 @@ omega = [2*2.0*np.pi]
 while 1.06*omega[-1]<(25*2.0*np.pi):
     omega.append(1.06*omega[-1])
 omega=np.array(omega)
-X = np.abs(1.0/(-M*omega**2+C*1j*omega+K))
-
-MAT1=np.genfromtxt("harmonicExcitationElem.usr")
-omegambdyn1 = MAT1[:,2]
-Xmbdyn1 = MAT1[:,4]
-
-MAT3=np.genfromtxt("harmonicExcitationElem3.usr")
-omegambdynMAT3 = MAT3[:,2]
-omegambdyn3=np.unique(omegambdynMAT3)
-Xmbdyn3 = 0*omegambdyn3
-for i in range(len(omegambdyn3)):
-    Xmbdyn3[i]=MAT3[np.argwhere(omegambdynMAT3==omegambdyn3[i])[-1],4]
-
-MAT4=np.genfromtxt("harmonicExcitationElem4.usr")
-omegambdynMAT4 = MAT4[:,2]
-omegambdyn4=np.unique(omegambdynMAT4)
-Xmbdyn4 = 0*omegambdyn4
-for i in range(len(omegambdyn4)):
-    Xmbdyn4[i]=1.0/MAT4[np.argwhere(omegambdynMAT4==omegambdyn4[i])[-1],-2]
-
-MAT5=np.genfromtxt("harmonicExcitationElem5.usr")
-omegambdynMAT5 = MAT5[:,2]
-omegambdyn5=np.unique(omegambdynMAT5)
-Xmbdyn5 = 0*omegambdyn5
-for i in range(len(omegambdyn5)):
-    Xmbdyn5[i]=MAT5[np.argwhere(omegambdynMAT5==omegambdyn5[i])[-1],4]
+X = np.abs(hfresponse.SDOF(M, K, C)(omega))
+
+# converged response at each frequency: the last line written for it
+R1=hfresponse.read("harmonicExcitationElem.usr", fmt='magnitude phase')
+omegambdyn1 = R1.omega
+Xmbdyn1 = np.abs(R1.X[:,0])
+
+R3=hfresponse.read("harmonicExcitationElem3.usr", fmt='magnitude phase')
+omegambdyn3 = R3.omega
+Xmbdyn3 = np.abs(R3.X[:,0])
+
+# RMS target: unit response amplitude, the forcing amplitude is output
+R4=hfresponse.read("harmonicExcitationElem4.usr", inputs=1, fmt='magnitude phase')
+omegambdyn4 = R4.omega
+Xmbdyn4 = 1.0/R4.extra[:,0]
+
+R5=hfresponse.read("harmonicExcitationElem5.usr", fmt='magnitude phase')
+omegambdyn5 = R5.omega
+Xmbdyn5 = np.abs(R5.X[:,0])
 
 fig=plt.figure()
 ax=fig.add_subplot(111)
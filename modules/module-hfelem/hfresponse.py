@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+"""Post-processing of the output of the harmonic excitation element.
+
+The element writes to the .usr file, at each output step, a line
+
+    label time omega periods X_1 Y_1 ... X_n Y_n [amplitude rms_1 ...]
+
+with (X, Y) the (sine, cosine) parts, or the magnitude and phase, of the
+n inputs that are output, and the forcing amplitude and the RMS of the
+target inputs when an RMS target is used. The last line written at a
+frequency holds the converged response.
+
+read() streams a .usr file in chunks, keeping only the last line of
+each frequency (found with a single np.unique() per chunk), so memory
+use depends on the number of frequencies, not on the length of the run:
+
+    import hfresponse
+    r = hfresponse.read('harmonicExcitationElem3.usr', fmt = 'magnitude phase')
+    H = r.X[:, 0]       # complex response of the first input vs. r.omega
+
+compare() computes error metrics against a reference response, and
+compare_many() reads and compares many runs in parallel:
+
+    ref = hfresponse.SDOF(M = 1., K = (20*np.pi)**2, C = 4*np.pi)
+    for path, m in hfresponse.compare_many(paths, ref, fmt = 'magnitude phase'):
+        print(path, m['max_rel_error'])
+"""
+
+import io
+import sys
+import argparse
+import multiprocessing
+from collections import namedtuple
+
+import numpy as np
+
+# default number of bytes read at once
+CHUNK = 1 << 24
+
+FORMATS = ('complex', 'magnitude phase')
+
+# omega, time, periods: per frequency; X: complex responses (frequencies,
+# inputs); extra: the remaining columns (amplitude, RMS of the targets)
+HarmonicResponse = namedtuple('HarmonicResponse', \
+        ['label', 'omega', 'time', 'periods', 'X', 'extra'])
+
+def last_per_frequency(omega):
+    """Sorted unique values of omega and the index of the last
+    occurrence of each."""
+    w, i = np.unique(omega[::-1], return_index = True)
+    return w, len(omega) - 1 - i
+
+def _chunks(f, chunk):
+    """Yield blocks of whole lines of the binary file f."""
+    pending = b''
+    while True:
+        buf = f.read(chunk)
+        if not buf:
+            break
+        buf = pending + buf
+        end = buf.rfind(b'\n') + 1
+        pending = buf[end:]
+        if end:
+            yield buf[:end]
+    if pending.strip():
+        yield pending
+
+def _rows(buf, label):
+    if label is not None:
+        lab = str(label).encode()
+        buf = b'\n'.join(l for l in buf.splitlines() \
+                if l.split(None, 1)[:1] == [lab])
+    if not buf.strip():
+        return None
+    return np.loadtxt(io.BytesIO(buf), ndmin = 2)
+
+def read_converged(f, label = None, chunk = CHUNK):
+    """Last line of each frequency of the .usr file f (name or binary
+    file object), sorted by frequency; label selects one element when
+    the file holds the output of several."""
+    if not hasattr(f, 'read'):
+        with open(f, 'rb') as fp:
+            return read_converged(fp, label, chunk)
+    out = None
+    for buf in _chunks(f, chunk):
+        rows = _rows(buf, label)
+        if rows is None:
+            continue
+        # lines of this chunk override those of previous ones
+        if out is not None:
+            rows = np.concatenate((out, rows))
+        w, i = last_per_frequency(rows[:, 2])
+        out = rows[i]
+    if out is None:
+        return np.zeros((0, 4))
+    return out
+
+def read(f, inputs = None, fmt = 'complex', label = None, chunk = CHUNK):
+    """Read the converged responses of the .usr file f into a
+    HarmonicResponse; inputs is the number of inputs that are output
+    (by default, all the columns after the fourth are taken as pairs),
+    fmt the output format of the element (one of FORMATS)."""
+    if fmt not in FORMATS:
+        raise ValueError('unknown format ' + repr(fmt))
+    data = read_converged(f, label, chunk)
+    if not len(data):
+        data = np.zeros((0, 4 + 2*(inputs or 0)))
+    if inputs is None:
+        inputs = (data.shape[1] - 4)//2
+    if data.shape[1] < 4 + 2*inputs:
+        raise ValueError('%d columns, %d inputs need at least %d' \
+                % (data.shape[1], inputs, 4 + 2*inputs))
+    x = data[:, 4:4 + 2*inputs:2]
+    y = data[:, 5:5 + 2*inputs:2]
+    if fmt == 'complex':
+        # |X| = sqrt(sin^2 + cos^2), arg(X) = atan2(cos, sin)
+        X = x + 1j*y
+    else:
+        X = x*np.exp(1j*y)
+    return HarmonicResponse(data[:, 0].astype(np.int64), data[:, 2], data[:, 1], \
+            data[:, 3].astype(np.int64), X, data[:, 4 + 2*inputs:])
+
+class SDOF(object):
+    """Reference response of a single degree of freedom system, as a
+    (picklable) function of omega: displacement per unit force."""
+
+    def __init__(self, M, K, C = 0.):
+        self.M, self.K, self.C = M, K, C
+
+    def __call__(self, omega):
+        return 1./(-self.M*omega**2 + 1j*self.C*omega + self.K)
+
+def _reference(ref, omega):
+    """ref at omega: ref is a function of omega, or a (omega, H) pair
+    interpolated in log-magnitude and unwrapped phase."""
+    if callable(ref):
+        return np.asarray(ref(omega), dtype = np.complex128)
+    w, H = ref
+    order = np.argsort(w)
+    w, H = np.asarray(w)[order], np.asarray(H)[order]
+    mag = np.exp(np.interp(omega, w, np.log(np.abs(H)), left = np.nan, right = np.nan))
+    phase = np.interp(omega, w, np.unwrap(np.angle(H)))
+    return mag*np.exp(1j*phase)
+
+def compare(omega, H, ref):
+    """Metrics of the response H(omega) with respect to ref (see
+    _reference()): relative magnitude errors, phase errors [rad] and the
+    peak frequencies and magnitudes of both."""
+    omega = np.asarray(omega)
+    H = np.asarray(H)
+    R = _reference(ref, omega)
+    ok = np.isfinite(R) & np.isfinite(H)
+    if not np.any(ok):
+        raise ValueError('no common frequencies')
+    omega, H, R = omega[ok], H[ok], R[ok]
+    rel = np.abs(np.abs(H) - np.abs(R))/np.abs(R)
+    dphase = np.abs(np.angle(H/R))
+    k, kr = np.argmax(np.abs(H)), np.argmax(np.abs(R))
+    return {
+        'frequencies': len(omega),
+        'max_rel_error': float(np.max(rel)),
+        'rms_rel_error': float(np.sqrt(np.mean(rel**2))),
+        'max_phase_error': float(np.max(dphase)),
+        'peak_omega': float(omega[k]),
+        'peak_omega_ref': float(omega[kr]),
+        'peak': float(np.abs(H[k])),
+        'peak_ref': float(np.abs(R[kr])),
+    }
+
+def transfer(r, index = 0, by_amplitude = False):
+    """Transfer function of the index-th input of the HarmonicResponse
+    r; with by_amplitude, the response is divided by the forcing
+    amplitude output with an RMS target."""
+    H = r.X[:, index]
+    if by_amplitude:
+        H = H/r.extra[:, 0]
+    return H
+
+def _compare(job):
+    path, ref, kwargs, index, by_amplitude = job
+    try:
+        r = read(path, **kwargs)
+        return path, compare(r.omega, transfer(r, index, by_amplitude), ref), None
+    except Exception as e:
+        return path, None, repr(e)
+
+def compare_many(paths, ref, jobs = None, index = 0, by_amplitude = False, **kwargs):
+    """Yield (path, metrics) for the .usr files paths, read and compared
+    with ref in a pool of jobs processes; index and by_amplitude are
+    passed to transfer(), kwargs to read(). ref must be picklable (e.g.
+    a (omega, H) pair, or an SDOF)."""
+    tasks = [(p, ref, kwargs, index, by_amplitude) for p in paths]
+    pool = None
+    if jobs == 1 or len(tasks) <= 1:
+        results = map(_compare, tasks)
+    else:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap(_compare, tasks)
+    try:
+        for path, metrics, error in results:
+            if error:
+                sys.stderr.write('Error: ' + path + ': ' + error + '\n')
+            else:
+                yield path, metrics
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(\
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description='Compare harmonic excitation element responses.',
+            epilog=__doc__)
+    parser.add_argument('usr', nargs='+', help='.usr files')
+    parser.add_argument('--format', dest='fmt', choices=FORMATS, \
+            default='magnitude phase', help='output format (default: %(default)s)')
+    parser.add_argument('--inputs', type=int, help='number of inputs that are output')
+    parser.add_argument('--input', type=int, default=0, help='0-based input compared')
+    parser.add_argument('--label', type=int, help='element label')
+    parser.add_argument('--by-amplitude', action='store_true', \
+            help='divide by the forcing amplitude (RMS target)')
+    parser.add_argument('--sdof', type=float, nargs=3, metavar=('M', 'K', 'C'), \
+            required=True, help='single degree of freedom reference')
+    parser.add_argument('--jobs', '-j', type=int, \
+            help='files read in parallel (default: number of cores)')
+    args = parser.parse_args(argv)
+
+    ref = SDOF(*args.sdof)
+    for path, m in compare_many(args.usr, ref, args.jobs, args.input, \
+            args.by_amplitude, inputs = args.inputs, fmt = args.fmt, label = args.label):
+        print('%s: %d frequencies, max rel. error %.3g, rms rel. error %.3g, ' \
+                'max phase error %.3g, peak %.6g at %.6g rad/s (ref. %.6g at %.6g)' \
+                % (path, m['frequencies'], m['max_rel_error'], m['rms_rel_error'], \
+                m['max_phase_error'], m['peak'], m['peak_omega'], \
+                m['peak_ref'], m['peak_omega_ref']))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,567 @@
+"""Derived quantities of MBDyn output, evaluated chunk-wise with NumPy.
+
+An expression combines output variables, named as in MBDyn's NetCDF
+output, with arithmetic, 0-based component indexing and the functions
+of FUNCTIONS:
+
+    rel(node.struct.2.X, node.struct.1.X)       position of node 2 relative
+                                                to node 1, global frame
+    rel(node.struct.2.X, node.struct.1.X, node.struct.1.R)
+                                                ... in the frame of node 1
+    euler123(relrot(node.struct.2.R, node.struct.1.R))
+                                                relative Euler angles [deg]
+    power(elem.joint.3.F, node.struct.2.XP)     power of a joint force
+    norm(elem.joint.3.F), elem.joint.3.F[2]
+
+Orientation matrices are always R[t, i, j] = R_ij: the transposed layout
+of MBDyn's NetCDF files (which mbncplot.py maps with its rows/cols
+tables) and the row-major .mov columns are undone when reading. Nodes
+output with Euler angles 123 or orientation vectors also have R.
+
+An expression is parsed once (no eval(): only the names, operators and
+functions above are accepted) and evaluated over windows of records,
+reading only the variables -- and, for text output, the labels -- it
+refers to, so memory use depends on the chunk size only:
+
+    import mbderived
+    d = mbderived.Derived('run.nc')     # or Derived('run'), for run.mov, ...
+    for steps, value in d.iter('norm(elem.joint.3.F)'):
+        ...
+    value = d.eval('rel(node.struct.2.X, node.struct.1.X)', start = 1000)
+    freq, amp = d.spectrum('elem.joint.3.F[2]')
+
+Results of eval() and spectrum() are cached in <file>.derived/, keyed
+by the expression, the window and the size and mtime of the output
+files, so they are recomputed only when the output changes.
+
+    python mbderived.py run.nc 'norm(elem.joint.3.F)' 'fft(elem.joint.3.F[2])' --csv out
+"""
+
+import os
+import re
+import ast
+import sys
+import json
+import hashlib
+import argparse
+
+import numpy as np
+import netCDF4 as nc
+
+import mbtxtread
+import mbtxt2nc
+
+# default number of records evaluated at once
+CHUNK = 1 << 16
+
+CACHE_SUFFIX = '.derived'
+VERSION = 1
+
+_RAD2DEG = 180./np.pi
+
+# dotted output variable names, e.g. node.struct.12.X
+_DOTTED = re.compile(r'\b[A-Za-z_]\w*(?:\.\w+)+')
+
+def _dot(a, b):
+    return np.einsum('...i,...i->...', a, b)
+
+def _rel(x, x_ref, R_ref = None):
+    """x - x_ref, in the frame of R_ref if given."""
+    d = x - x_ref
+    if R_ref is None:
+        return d
+    return np.einsum('...ji,...j->...i', R_ref, d)
+
+def _relrot(R, R_ref):
+    """R_ref^T R."""
+    return np.einsum('...ji,...jk->...ik', R_ref, R)
+
+def _euler123(R):
+    """MatR2EulerAngles123, in degrees."""
+    alpha = np.arctan2(-R[..., 1, 2], R[..., 2, 2])
+    ca, sa = np.cos(alpha), np.sin(alpha)
+    return _RAD2DEG*np.stack((alpha,
+        np.arctan2(R[..., 0, 2], ca*R[..., 2, 2] - sa*R[..., 1, 2]),
+        np.arctan2(ca*R[..., 1, 0] + sa*R[..., 2, 0],
+            ca*R[..., 1, 1] + sa*R[..., 2, 1])), axis = -1)
+
+def _euler313(R):
+    """MatR2EulerAngles313, in degrees."""
+    alpha = np.arctan2(R[..., 0, 2], -R[..., 1, 2])
+    ca, sa = np.cos(alpha), np.sin(alpha)
+    return _RAD2DEG*np.stack((alpha,
+        np.arctan2(sa*R[..., 0, 2] - ca*R[..., 1, 2], R[..., 2, 2]),
+        np.arctan2(-ca*R[..., 0, 1] - sa*R[..., 1, 1],
+            ca*R[..., 0, 0] + sa*R[..., 1, 0])), axis = -1)
+
+def _euler321(R):
+    """MatR2EulerAngles321, in degrees."""
+    alpha = np.arctan2(R[..., 1, 0], R[..., 0, 0])
+    ca, sa = np.cos(alpha), np.sin(alpha)
+    return _RAD2DEG*np.stack((alpha,
+        np.arctan2(-R[..., 2, 0], ca*R[..., 0, 0] + sa*R[..., 1, 0]),
+        np.arctan2(sa*R[..., 0, 2] - ca*R[..., 1, 2],
+            -sa*R[..., 0, 1] + ca*R[..., 1, 1])), axis = -1)
+
+def _mat123(E):
+    """EulerAngles123_2MatR, E in degrees."""
+    e = np.asarray(E)/_RAD2DEG
+    ca, cb, cc = np.cos(e[..., 0]), np.cos(e[..., 1]), np.cos(e[..., 2])
+    sa, sb, sc = np.sin(e[..., 0]), np.sin(e[..., 1]), np.sin(e[..., 2])
+    return np.stack((
+        np.stack((cb*cc, -cb*sc, sb), axis = -1),
+        np.stack((ca*sc + sa*sb*cc, ca*cc - sa*sb*sc, -sa*cb), axis = -1),
+        np.stack((sa*sc - ca*sb*cc, sa*cc + ca*sb*sc, ca*cb), axis = -1)), axis = -2)
+
+def _phi(R):
+    """Rotation vector of R (RotManip::VecRot), for rotations below pi."""
+    ax = .5*np.stack((R[..., 2, 1] - R[..., 1, 2],
+        R[..., 0, 2] - R[..., 2, 0],
+        R[..., 1, 0] - R[..., 0, 1]), axis = -1)
+    cosphi = .5*(np.trace(R, axis1 = -2, axis2 = -1) - 1.)
+    phi = np.arctan2(np.sqrt(_dot(ax, ax)), cosphi)
+    return ax/np.sinc(phi/np.pi)[..., None]
+
+def _matphi(Phi):
+    """RotManip::Rot, the orientation matrix of rotation vector Phi."""
+    Phi = np.asarray(Phi)
+    phi = np.sqrt(_dot(Phi, Phi))
+    a = np.sinc(phi/np.pi)[..., None, None]
+    b = (.5*np.sinc(phi/(2.*np.pi))**2)[..., None, None]
+    P = np.zeros(Phi.shape + (3,))
+    P[..., 0, 1], P[..., 0, 2] = -Phi[..., 2], Phi[..., 1]
+    P[..., 1, 0], P[..., 1, 2] = Phi[..., 2], -Phi[..., 0]
+    P[..., 2, 0], P[..., 2, 1] = -Phi[..., 1], Phi[..., 0]
+    return np.eye(3) + a*P + b*np.matmul(P, P)
+
+# functions of expressions: all act on whole chunks, the record axis first
+FUNCTIONS = {
+    'rel': _rel,
+    'relrot': _relrot,
+    'euler123': _euler123,
+    'euler313': _euler313,
+    'euler321': _euler321,
+    'mat123': _mat123,
+    'phi': _phi,
+    'matphi': _matphi,
+    'norm': lambda a: np.sqrt(_dot(a, a)),
+    'dot': _dot,
+    'power': _dot,
+    'cross': lambda a, b: np.cross(a, b),
+    'T': lambda R: np.swapaxes(R, -1, -2),
+    'mul': lambda A, b: np.einsum('...ij,...j->...i', A, b) \
+            if np.ndim(b) == np.ndim(A) - 1 else np.matmul(A, b),
+    'abs': np.abs,
+    'sqrt': np.sqrt,
+    'sin': np.sin,
+    'cos': np.cos,
+    'tan': np.tan,
+    'arctan2': np.arctan2,
+    'exp': np.exp,
+    'log': np.log,
+    'deg': np.degrees,
+    'rad': np.radians,
+    'min': lambda *a: np.min(np.stack(np.broadcast_arrays(*a)), axis = 0),
+    'max': lambda *a: np.max(np.stack(np.broadcast_arrays(*a)), axis = 0),
+}
+
+CONSTANTS = {'pi': np.pi}
+
+_BINOPS = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, \
+        ast.Div: np.divide, ast.Pow: np.power}
+
+_UNOPS = {ast.USub: np.negative, ast.UAdd: np.positive}
+
+class Expression(object):
+    """A parsed expression: variables lists the output variables it
+    reads, and calling it with {variable: chunk} evaluates it. fft is
+    True for fft(...), whose argument is the expression itself."""
+
+    def __init__(self, text):
+        self.text = text.strip()
+        names = {}
+
+        def sub(m):
+            key = '_v%d' % len(names)
+            names[key] = m.group(0)
+            return key
+
+        try:
+            tree = ast.parse(_DOTTED.sub(sub, self.text), mode = 'eval').body
+        except SyntaxError as e:
+            raise ValueError('invalid expression ' + repr(self.text) + ': ' + str(e))
+        self.fft = isinstance(tree, ast.Call) and isinstance(tree.func, ast.Name) \
+                and tree.func.id == 'fft'
+        if self.fft:
+            if len(tree.args) != 1 or tree.keywords:
+                raise ValueError('fft() takes one argument')
+            tree = tree.args[0]
+        self._names = names
+        self.variables = []
+        self._fn = self._compile(tree)
+        # canonical text, e.g. for cache keys
+        self.key = ('fft(%s)' if self.fft else '%s') % ast.dump(tree)
+        for k, v in names.items():
+            self.key = self.key.replace("'" + k + "'", repr(v))
+
+    def _var(self, name):
+        if name not in self.variables:
+            self.variables.append(name)
+        return lambda env: env[name]
+
+    def _compile(self, node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) \
+                and not isinstance(node.value, bool):
+            value = node.value
+            return lambda env: value
+        if isinstance(node, ast.Name):
+            if node.id in self._names:
+                return self._var(self._names[node.id])
+            if node.id in CONSTANTS:
+                value = CONSTANTS[node.id]
+                return lambda env: value
+            # undotted variables, e.g. time
+            return self._var(node.id)
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINOPS:
+            op = _BINOPS[type(node.op)]
+            l, r = self._compile(node.left), self._compile(node.right)
+            return lambda env: op(l(env), r(env))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _UNOPS:
+            op = _UNOPS[type(node.op)]
+            a = self._compile(node.operand)
+            return lambda env: op(a(env))
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) \
+                and not node.keywords:
+            if node.func.id not in FUNCTIONS:
+                raise ValueError('unknown function ' + node.func.id \
+                        + ('() (only at the top level)' if node.func.id == 'fft' else '()'))
+            f = FUNCTIONS[node.func.id]
+            args = [self._compile(a) for a in node.args]
+            return lambda env: f(*[a(env) for a in args])
+        if isinstance(node, ast.Subscript):
+            # components: the record axis is not indexed
+            index = (Ellipsis,) + self._index(node.slice)
+            a = self._compile(node.value)
+            return lambda env: a(env)[index]
+        raise ValueError('unsupported syntax in ' + repr(self.text) \
+                + ': ' + type(node).__name__)
+
+    def _index(self, node):
+        if isinstance(node, ast.Tuple):
+            return sum((self._index(e) for e in node.elts), ())
+        if isinstance(node, ast.Slice):
+            return (slice(*[None if p is None else self._int(p) \
+                    for p in (node.lower, node.upper, node.step)]),)
+        return (self._int(node),)
+
+    def _int(self, node):
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return -self._int(node.operand)
+        if isinstance(node, ast.Constant) and isinstance(node.value, int):
+            return node.value
+        raise ValueError('indexes must be integer constants in ' + repr(self.text))
+
+    def __call__(self, env):
+        return self._fn(env)
+
+class NetCDFSource(object):
+    """Variables of an MBDyn NetCDF output file."""
+
+    def __init__(self, ncfile):
+        self.path = ncfile
+        self.files = [ncfile]
+        self.nd = nc.Dataset(ncfile, 'r')
+        self.nd.set_auto_mask(False)
+
+    def records(self):
+        return len(self.nd.dimensions['time'])
+
+    def names(self):
+        return list(self.nd.variables)
+
+    def _var(self, name):
+        """(ncVar, conversion) of name; nodes without R get it from their
+        Euler angles 123 or orientation vector."""
+        vs = self.nd.variables
+        if name in vs:
+            return vs[name], None
+        if name.endswith('.R'):
+            E = vs.get(name[:-1] + 'E')
+            if E is not None and '(123)' in getattr(E, 'description', ''):
+                return E, _mat123
+            if name[:-1] + 'Phi' in vs:
+                return vs[name[:-1] + 'Phi'], _matphi
+        raise KeyError('variable ' + name + ' not found in ' + self.path)
+
+    def read(self, names, start, stop, stride):
+        out = {}
+        for name in names:
+            ncVar, conv = self._var(name)
+            data = np.asarray(ncVar[start:stop:stride], dtype = np.float64)
+            if conv is not None:
+                out[name] = conv(data)
+                continue
+            if data.shape[1:] == (3, 3):
+                # MBDyn stores R[j, i] at [i, j]
+                data = data.transpose(0, 2, 1)
+            out[name] = data
+        return out
+
+    def close(self):
+        self.nd.close()
+
+class TextSource(object):
+    """Variables of the text output of run base (<base>.mov, .jnt, .frc
+    and .out), named as mbtxt2nc.py names them."""
+
+    def __init__(self, base, orientation = 'euler123'):
+        self.path = base
+        self.files = []
+        self._vars = {}
+        self._offsets = {}
+        for ext, prefix, fields_of in (
+                ('.mov', 'node.struct', lambda n: mbtxt2nc._mov_fields(n, orientation)),
+                ('.jnt', 'elem.joint', mbtxt2nc._jnt_fields),
+                ('.frc', 'elem.force', lambda n: None)):
+            path = base + ext
+            if not os.path.exists(path):
+                continue
+            lay = mbtxtread.layout(path)
+            self.files.append(path)
+            self._offsets[path] = mbtxtread.step_index(path)
+            for label, ncols in zip(lay.labels, lay.ncols):
+                fields = fields_of(int(ncols)) or mbtxt2nc._txt_fields(int(ncols))
+                for sub, cols, shape, dim, desc in fields:
+                    name = prefix + '.' + str(label) + '.' + sub
+                    self._vars[name] = (path, int(label), cols, shape, None)
+                    conv = {'E': _mat123 if orientation == 'euler123' else None, \
+                            'Phi': _matphi}.get(sub)
+                    if conv is not None:
+                        self._vars[name[:-len(sub)] + 'R'] = (path, int(label), cols, \
+                                (3,), conv)
+        self._out = {}
+        if os.path.exists(base + '.out'):
+            self.files.append(base + '.out')
+            out = mbtxtread.read_out(base + '.out')
+            if out and 'output' in out:
+                keep = out['output'] != 0
+                out = dict((k, v[keep]) for k, v in out.items())
+            if out:
+                self._out = {'time': out['time'], 'run.step': out['step'], \
+                        'run.timestep': out['timestep']}
+        if not self.files:
+            raise IOError('no text output found for ' + base)
+
+    def records(self):
+        n = [len(o) - 1 for o in self._offsets.values()]
+        n += [len(v) for v in self._out.values()][:1]
+        return min(n) if n else 0
+
+    def names(self):
+        return sorted(self._vars) + sorted(self._out)
+
+    def read(self, names, start, stop, stride):
+        out = {}
+        labels = {}
+        for name in names:
+            if name in self._out:
+                out[name] = np.asarray(self._out[name][start:stop:stride], dtype = np.float64)
+            elif name in self._vars:
+                path, label = self._vars[name][:2]
+                labels.setdefault(path, [])
+                if label not in labels[path]:
+                    labels[path].append(label)
+            else:
+                raise KeyError('variable ' + name + ' not found in ' + self.path)
+        # one read per file, of just the labels needed
+        data = dict((path, mbtxtread.read(path, start, stop, stride, ls, \
+                offsets = self._offsets[path]).data) for path, ls in labels.items())
+        for name in names:
+            if name in out:
+                continue
+            path, label, cols, shape, conv = self._vars[name]
+            block = data[path][:, labels[path].index(label), cols]
+            block = block.reshape((len(block),) + shape)
+            out[name] = block if conv is None else conv(block)
+        return out
+
+    def close(self):
+        pass
+
+def open_source(path, orientation = 'euler123'):
+    """NetCDFSource for .nc files, TextSource for run base names (or any
+    of their text output files)."""
+    if path.endswith('.nc'):
+        return NetCDFSource(path)
+    root, ext = os.path.splitext(path)
+    return TextSource(root if ext in ('.out', '.mov', '.jnt', '.frc') else path, \
+            orientation)
+
+class Derived(object):
+    """Evaluate expressions over the output path (see open_source()),
+    caching results in <path>.derived/ unless cache is False."""
+
+    def __init__(self, path, orientation = 'euler123', cache = True, chunk = CHUNK):
+        self.source = open_source(path, orientation)
+        self.chunk = chunk
+        self.cache = cache
+        self._parsed = {}
+
+    def close(self):
+        self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def parse(self, expr):
+        if not isinstance(expr, Expression):
+            if expr not in self._parsed:
+                self._parsed[expr] = Expression(expr)
+            expr = self._parsed[expr]
+        return expr
+
+    def window(self, start = None, stop = None, stride = None):
+        s = slice(*slice(start, stop, stride).indices(self.source.records()))
+        if s.step < 0:
+            raise ValueError('negative stride not supported')
+        return s
+
+    def iter(self, expr, start = None, stop = None, stride = None):
+        """Yield (records, value) chunk by chunk, with records the 0-based
+        indexes of the records of each chunk."""
+        expr = self.parse(expr)
+        s = self.window(start, stop, stride)
+        step = self.chunk*s.step
+        for a in range(s.start, s.stop, step):
+            b = min(a + step, s.stop)
+            env = self.source.read(expr.variables, a, b, s.step)
+            value = np.asarray(expr(env), dtype = np.float64)
+            records = np.arange(a, b, s.step)
+            if value.ndim == 0:
+                # constant expressions
+                value = np.full(len(records), value)
+            yield records, value
+
+    def _cached(self, kind, expr, s, compute):
+        if not self.cache:
+            return compute()
+        stats = []
+        for f in self.source.files:
+            st = os.stat(f)
+            stats.append([os.path.basename(f), st.st_size, st.st_mtime])
+        key = hashlib.sha1(json.dumps([VERSION, kind, expr.key, \
+                [s.start, s.stop, s.step], stats]).encode()).hexdigest()
+        d = self.source.path + CACHE_SUFFIX
+        name = os.path.join(d, key + '.npz')
+        try:
+            with np.load(name) as z:
+                return tuple(z[k] for k in sorted(z.files))
+        except (IOError, OSError, ValueError):
+            pass
+        result = compute()
+        try:
+            if not os.path.isdir(d):
+                os.makedirs(d)
+            # entries older than the output were computed from a previous run
+            newest = max(st[2] for st in stats)
+            for old in os.listdir(d):
+                if os.path.getmtime(os.path.join(d, old)) < newest:
+                    os.remove(os.path.join(d, old))
+            with open(name + '.tmp', 'wb') as f:
+                np.savez(f, **dict(('a%d' % i, r) for i, r in enumerate(result)))
+            os.replace(name + '.tmp', name)
+        except (IOError, OSError):
+            # read-only location: just don't cache
+            pass
+        return result
+
+    def _eval(self, expr, s):
+        parts = [v for r, v in self.iter(expr, s.start, s.stop, s.step)]
+        if not parts:
+            return (np.zeros(0),)
+        return (np.concatenate(parts),)
+
+    def eval(self, expr, start = None, stop = None, stride = None):
+        """Value of expr over records start:stop:stride, as an array
+        shaped (records, ...)."""
+        expr = self.parse(expr)
+        if expr.fft:
+            raise ValueError('use spectrum() for fft()')
+        s = self.window(start, stop, stride)
+        return self._cached('eval', expr, s, lambda: self._eval(expr, s))[0]
+
+    def spectrum(self, expr, start = None, stop = None, stride = None):
+        """Single-sided amplitude spectrum of expr over records
+        start:stop:stride, which are assumed equally spaced in time:
+        returns (freq, X), X complex and shaped (freq, ...); the
+        amplitude of a harmonic of frequency freq[k] is abs(X[k])."""
+        expr = self.parse(expr)
+        s = self.window(start, stop, stride)
+        time = self.parse('time')
+
+        def compute():
+            x = self._eval(expr, s)[0]
+            t = self._eval(time, s)[0]
+            n = len(x)
+            if n < 2:
+                raise ValueError('at least two records needed for a spectrum')
+            X = np.fft.rfft(x, axis = 0)/n
+            X[1:(n + 1)//2] *= 2.
+            return np.fft.rfftfreq(n, (t[-1] - t[0])/(n - 1)), X
+
+        return self._cached('spectrum', expr, s, compute)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(\
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description='Evaluate derived quantities of MBDyn output.',
+            epilog=__doc__)
+    parser.add_argument('path', help='NetCDF file, or base name of text output')
+    parser.add_argument('expr', nargs='+', help='expressions')
+    parser.add_argument('--start', type=int, help='first record')
+    parser.add_argument('--stop', type=int, help='record after the last one')
+    parser.add_argument('--stride', type=int, help='record stride')
+    parser.add_argument('--orientation', choices=sorted(mbtxt2nc.ORIENTATIONS), \
+            default='euler123', help='orientation description in .mov (default: %(default)s)')
+    parser.add_argument('--chunk', type=int, default=CHUNK, \
+            help='records evaluated at once (default: %(default)s)')
+    parser.add_argument('--no-cache', dest='cache', action='store_false', \
+            help='neither read nor write cached results')
+    parser.add_argument('--csv', help='write <CSV>.<n>.csv for the n-th expression')
+    parser.add_argument('--list', action='store_true', help='list the variables')
+    args = parser.parse_args(argv)
+
+    with Derived(args.path, args.orientation, args.cache, args.chunk) as d:
+        if args.list:
+            for name in d.source.names():
+                print(name)
+        for n, text in enumerate(args.expr):
+            expr = d.parse(text)
+            if expr.fft:
+                x, y = d.spectrum(expr, args.start, args.stop, args.stride)
+                amp = np.abs(y).reshape(len(y), -1).max(axis = 1)
+                k = 1 + np.argmax(amp[1:]) if len(amp) > 1 else 0
+                print('%s: %d frequencies, peak %g at %g Hz' % (text, len(x), amp[k], x[k]))
+                y = np.abs(y)
+            else:
+                y = d.eval(expr, args.start, args.stop, args.stride)
+                s = d.window(args.start, args.stop, args.stride)
+                x = np.arange(s.start, s.stop, s.step)
+                if 'time' in d.source.names():
+                    x = d.eval('time', args.start, args.stop, args.stride)
+                if len(y):
+                    print('%s: %s records, min %g, max %g, last %s' % (text, len(y), \
+                            np.nanmin(y), np.nanmax(y), y[-1]))
+                else:
+                    print('%s: no records' % text)
+            if args.csv:
+                np.savetxt('%s.%d.csv' % (args.csv, n), \
+                        np.column_stack((x, y.reshape(len(y), -1))), \
+                        delimiter = ',', header = text)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
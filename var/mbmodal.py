@@ -0,0 +1,517 @@
+"""Read and write MBDyn modal element data (.fem) files.
+
+The files (see the "Modal Element Data" appendix of the input manual)
+are made of record groups, each starting with a "** RECORD GROUP n"
+line; lines starting with "**" are comments. A file is read into a
+ModalData object holding NumPy arrays:
+
+    nodes       FEM node labels (strings)                   RECORD GROUP 2
+    q0, qp0     initial modal displacements, velocities     3, 4
+    X           node coordinates (nodes, 3)                 5, 6, 7
+    shapes      mode shapes (modes, nodes, 6)               8
+    M, K        generalized mass, stiffness (modes, modes)  9, 10
+    lumped      diagonal of the lumped mass (nodes, 6)      11, or None
+    inertia     rigid-body Inertia(mass, xcm, J)            12, or None
+    damping     generalized damping (modes, modes)          13, or None
+    invariants  {n: modal invariant} (3, modes, ...)        14 to 18
+    extra       {n: (header, text)} of the other groups, kept verbatim
+
+Each record group is parsed with a single call to numpy's C tokenizer,
+and write() formats whole blocks of rows at once, so that files of
+hundreds of MB are handled at disk speed:
+
+    import mbmodal
+    d = mbmodal.read('wing.fem')
+    d.shapes[:, d.index(['1001', '1002'])]     # shapes at two nodes
+    mbmodal.write('copy.fem', d, precision = 12)
+
+Models are made cheaper for the modal element by keeping only the
+nodes that are connected to the multibody model, and the modes that
+matter (by frequency, or by effective mass in the rigid-body motions):
+
+    d = mbmodal.subset_nodes(d, ['1001', '1002'])     # whole-body inertia kept
+    f = mbmodal.frequencies(d)
+    d = mbmodal.select_modes(d, np.flatnonzero(f < 200.))
+
+    python mbmodal.py wing.fem [-o copy.fem]
+    python mbmodal.py wing.fem -o small.fem --nodes-file interface.txt \\
+            --max-frequency 200 --order participation --modes 20
+"""
+
+import os
+import re
+import sys
+import argparse
+from collections import namedtuple
+
+import numpy as np
+
+# significant digits written by default (as the Code_Aster macro)
+PRECISION = 8
+
+# number of values formatted at once
+CHUNK = 1 << 16
+
+# rigid-body inertia of RECORD GROUP 12: mass, center of mass (3,),
+# inertia matrix (3, 3) with respect to the center of mass
+Inertia = namedtuple('Inertia', ['mass', 'xcm', 'J'])
+
+# modal invariants of RECORD GROUPS 14 to 18: {n: (number, title)}
+INVARIANTS = {
+    14: (3, 'INVARIANT 3'),
+    15: (4, 'INVARIANT 4'),
+    16: (8, 'INVARIANT 8'),
+    17: (5, 'INVARIANT 5'),
+    18: (9, 'INVARIANT 9'),
+}
+
+def _invariant_shape(rid, nmodes):
+    """Shape of the invariant of RECORD GROUP rid, as laid out in the
+    file: 3 rows of (modes), (modes, 3), (modes, modes) or (modes, modes, 3)."""
+    return {14: (3, nmodes), 15: (3, nmodes), 16: (3, nmodes, 3), \
+            17: (3, nmodes, nmodes), 18: (3, nmodes, nmodes, 3)}[rid]
+
+def _invariant_modes(rid, a, modes):
+    """The invariant a of RECORD GROUP rid restricted to modes."""
+    a = a.take(modes, axis = 1)
+    return a.take(modes, axis = 2) if rid in (17, 18) else a
+
+_RECORD = re.compile(br'^\*\* *RECORD GROUP +(\d+)[^\n]*\n?', re.M)
+_COMMENT = re.compile(br'^\*\*[^\n]*', re.M)
+
+class ModalData(object):
+    """Modal element data; see the module documentation for the
+    attributes. counts holds the number of normal, attachment and
+    constraint modes of the header (by default, all modes are normal)."""
+
+    def __init__(self, nodes, X, shapes, M, K, q0 = None, qp0 = None, \
+            lumped = None, inertia = None, damping = None, counts = None, \
+            invariants = None, extra = None):
+        self.nodes = np.asarray([str(n) for n in nodes])
+        self.X = np.asarray(X, dtype = np.float64).reshape(-1, 3)
+        self.shapes = np.asarray(shapes, dtype = np.float64)
+        nmodes, nnodes = self.shapes.shape[0], len(self.nodes)
+        self.shapes = self.shapes.reshape(nmodes, nnodes, 6)
+        self.M = np.asarray(M, dtype = np.float64).reshape(nmodes, nmodes)
+        self.K = np.asarray(K, dtype = np.float64).reshape(nmodes, nmodes)
+        self.q0 = np.zeros(nmodes) if q0 is None else np.asarray(q0, dtype = np.float64)
+        self.qp0 = np.zeros(nmodes) if qp0 is None else np.asarray(qp0, dtype = np.float64)
+        self.lumped = None if lumped is None \
+                else np.asarray(lumped, dtype = np.float64).reshape(nnodes, 6)
+        self.inertia = None if inertia is None else Inertia(float(inertia[0]), \
+                np.asarray(inertia[1], dtype = np.float64).reshape(3), \
+                np.asarray(inertia[2], dtype = np.float64).reshape(3, 3))
+        self.damping = None if damping is None \
+                else np.asarray(damping, dtype = np.float64).reshape(nmodes, nmodes)
+        self.counts = (nmodes, 0, 0) if counts is None else tuple(counts)
+        self.invariants = dict((rid, np.asarray(a, dtype = np.float64) \
+                .reshape(_invariant_shape(rid, nmodes))) \
+                for rid, a in (invariants or {}).items())
+        self.extra = dict(extra or {})
+        if len(self.X) != nnodes:
+            raise ValueError('%d coordinates for %d nodes' % (len(self.X), nnodes))
+        if sum(self.counts) != nmodes:
+            raise ValueError('mode counts %r do not add up to %d modes' % (self.counts, nmodes))
+
+    @property
+    def nnodes(self):
+        return len(self.nodes)
+
+    @property
+    def nmodes(self):
+        return self.shapes.shape[0]
+
+    def index(self, nodes):
+        """0-based indexes of the node labels nodes; raises KeyError
+        for unknown labels."""
+        where = dict((n, i) for i, n in enumerate(self.nodes))
+        return np.array([where[str(n)] for n in nodes], dtype = np.int64)
+
+def _values(body, n, rid):
+    """The n numbers of a record group body, comments excluded."""
+    text = _COMMENT.sub(b'', body)
+    try:
+        v = np.fromstring(text.decode('ascii'), sep = ' ')
+    except ValueError:
+        raise ValueError('RECORD GROUP %d: invalid number' % rid)
+    if n is not None and len(v) != n:
+        raise ValueError('RECORD GROUP %d: %d values, %d expected' % (rid, len(v), n))
+    return v
+
+def _groups(buf):
+    """{n: (header line, body)} of the record groups of buf."""
+    out = {}
+    matches = list(_RECORD.finditer(buf))
+    for k, m in enumerate(matches):
+        end = matches[k + 1].start() if k + 1 < len(matches) else len(buf)
+        rid = int(m.group(1))
+        if rid in out:
+            raise ValueError('RECORD GROUP %d repeated' % rid)
+        out[rid] = (m.group(0).rstrip(b'\r\n'), buf[m.end():end])
+    return out
+
+def read(f):
+    """Read the modal data file f (name or binary file object) into a
+    ModalData; raises ValueError for malformed files."""
+    if not hasattr(f, 'read'):
+        with open(f, 'rb') as fp:
+            return read(fp)
+
+    groups = _groups(f.read())
+    for rid in (1, 2, 5, 6, 7, 8, 9, 10):
+        if rid not in groups:
+            raise ValueError('RECORD GROUP %d missing' % rid)
+
+    header = _COMMENT.sub(b'', groups[1][1]).split()
+    if len(header) != 6:
+        raise ValueError('RECORD GROUP 1: 6 fields expected')
+    nnodes, nnormal, nattach, nconstr, nrej = [int(h) for h in header[1:]]
+    nmodes = nnormal + nattach + nconstr - nrej
+    # rejected modes come first: take them from the first counts
+    counts = []
+    left = nrej
+    for c in (nnormal, nattach, nconstr):
+        drop = min(c, left)
+        counts.append(c - drop)
+        left -= drop
+
+    nodes = [n.decode() for n in _COMMENT.sub(b'', groups[2][1]).split()]
+    if len(nodes) != nnodes:
+        raise ValueError('RECORD GROUP 2: %d nodes, %d expected' % (len(nodes), nnodes))
+
+    def vector(rid, n):
+        return _values(groups[rid][1], n, rid) if rid in groups else None
+
+    X = np.column_stack([vector(rid, nnodes) for rid in (5, 6, 7)])
+    shapes = vector(8, None)
+    if len(shapes) != (nmodes + nrej)*nnodes*6:
+        raise ValueError('RECORD GROUP 8: %d values, %d expected' \
+                % (len(shapes), (nmodes + nrej)*nnodes*6))
+    shapes = shapes.reshape(nmodes + nrej, nnodes, 6)[nrej:]
+    inertia = vector(12, 13)
+    if inertia is not None:
+        inertia = Inertia(inertia[0], inertia[1:4], inertia[4:].reshape(3, 3))
+    invariants = {}
+    for rid in INVARIANTS:
+        if rid in groups:
+            shape = _invariant_shape(rid, nmodes + nrej)
+            a = vector(rid, int(np.prod(shape))).reshape(shape)
+            invariants[rid] = _invariant_modes(rid, a, np.arange(nrej, nmodes + nrej))
+
+    return ModalData(nodes, X, shapes, \
+            vector(9, nmodes*nmodes), vector(10, nmodes*nmodes), \
+            q0 = vector(3, nmodes), qp0 = vector(4, nmodes), \
+            lumped = vector(11, nnodes*6), inertia = inertia, \
+            damping = vector(13, nmodes*nmodes), counts = counts, \
+            invariants = invariants, \
+            extra = dict((rid, g) for rid, g in groups.items() if rid > 18))
+
+def write_array(f, a, fmt, chunk = CHUNK):
+    """Write the rows of the 2D array a to the text file f, one per
+    line, formatting chunk values at a time."""
+    a = np.asarray(a, dtype = np.float64)
+    if a.ndim == 1:
+        a = a.reshape(-1, 1)
+    nrows, ncols = a.shape
+    if not nrows or not ncols:
+        return
+    line = fmt*ncols + '\n'
+    step = chunk//ncols + 1
+    for r in range(0, nrows, step):
+        block = a[r:r + step]
+        f.write((line*len(block)) % tuple(block.ravel().tolist()))
+
+def write_values(f, v, fmt, per_line = 6):
+    """Write the values of v, per_line values per line."""
+    v = np.asarray(v, dtype = np.float64).ravel()
+    n = len(v) - len(v) % per_line
+    write_array(f, v[:n].reshape(-1, per_line), fmt)
+    if n < len(v):
+        write_array(f, v[n:].reshape(1, -1), fmt)
+
+def write_matrix(f, a, fmt):
+    """Write the square matrix a; diagonal matrices (without -0.) only
+    format their diagonal."""
+    a = np.asarray(a, dtype = np.float64)
+    d = a.diagonal()
+    if np.count_nonzero(a) != np.count_nonzero(d) or np.signbit(a[a == 0.]).any():
+        write_array(f, a, fmt)
+        return
+    n = len(d)
+    zero = fmt % 0.
+    for r in range(n):
+        f.write(zero*r + fmt % d[r] + zero*(n - r - 1) + '\n')
+
+def write(path, data, precision = PRECISION, title = None):
+    """Write the ModalData data to path (through a temporary file),
+    record group by record group, with precision significant digits."""
+    IFMT = '%' + str(precision) + 'd'
+    RFMT = '%' + str(precision + 8) + '.' + str(precision) + 'e'
+    tmp = path + '.part'
+    with open(tmp, 'w') as f:
+        f.write('** MBDyn MODAL DATA FILE' + (' - ' + title if title else '') + '\n')
+
+        f.write('** RECORD GROUP 1, HEADER\n')
+        f.write('**   REVISION,  NODE,  NORMAL, ATTACHMENT, CONSTRAINT, REJECTED MODES.\n')
+        f.write((' REV0       ' + '  '.join([IFMT]*5) + '\n') \
+                % ((data.nnodes,) + tuple(data.counts) + (0,)))
+        f.write('**\n')
+
+        f.write('** RECORD GROUP 2, FINITE ELEMENT NODE LIST\n')
+        for l in range(0, data.nnodes, 6):
+            f.write(''.join(' ' + n for n in data.nodes[l:l + 6]) + '\n')
+        f.write('**\n')
+
+        f.write('** RECORD GROUP 3, INITIAL MODAL DISPLACEMENTS\n')
+        write_values(f, data.q0, RFMT)
+        f.write('**\n')
+        f.write('** RECORD GROUP 4, INITIAL MODAL VELOCITIES\n')
+        write_values(f, data.qp0, RFMT)
+        f.write('**\n')
+
+        for k, c in enumerate('XYZ'):
+            f.write('** RECORD GROUP %d, NODAL %s COORDINATES\n' % (5 + k, c))
+            write_array(f, data.X[:, k], RFMT)
+            f.write('**\n')
+
+        f.write('** RECORD GROUP 8, MODE SHAPES\n')
+        for m in range(data.nmodes):
+            f.write('**    NORMAL MODE SHAPE #  %d\n' % (m + 1))
+            write_array(f, data.shapes[m], RFMT)
+        f.write('**\n')
+
+        f.write('** RECORD GROUP 9, MODAL MASS MATRIX\n')
+        write_matrix(f, data.M, RFMT)
+        f.write('**\n')
+        f.write('** RECORD GROUP 10, MODAL STIFFNESS MATRIX\n')
+        write_matrix(f, data.K, RFMT)
+        f.write('**\n')
+
+        if data.lumped is not None:
+            f.write('** RECORD GROUP 11, DIAGONAL OF LUMPED MASS MATRIX\n')
+            write_array(f, data.lumped, RFMT)
+            f.write('**\n')
+
+        if data.inertia is not None:
+            f.write('** RECORD GROUP 12, RIGID BODY INERTIA MATRIX\n')
+            write_array(f, [data.inertia.mass], RFMT)
+            write_array(f, data.inertia.xcm.reshape(1, 3), RFMT)
+            write_array(f, data.inertia.J, RFMT)
+            f.write('**\n')
+
+        if data.damping is not None:
+            f.write('** RECORD GROUP 13, MODAL DAMPING MATRIX\n')
+            write_matrix(f, data.damping, RFMT)
+            f.write('**\n')
+
+        for rid in sorted(data.invariants):
+            f.write('** RECORD GROUP %d, %s. COLUMN-MAJOR FORM\n' % (rid, INVARIANTS[rid][1]))
+            write_array(f, data.invariants[rid].reshape(3, -1), RFMT)
+            f.write('**\n')
+
+        for rid in sorted(data.extra):
+            header, body = data.extra[rid]
+            f.write(header.decode() + '\n' + body.decode())
+    os.replace(tmp, path)
+
+def lumped_inertia(data):
+    """Rigid-body Inertia of the lumped mass (RECORD GROUP 11), as MBDyn
+    computes it when RECORD GROUP 12 is missing."""
+    m = data.lumped[:, 0]
+    mass = m.sum()
+    xcm = np.dot(m, data.X)/mass if mass > 0 else np.zeros(3)
+    # about the origin, then moved to the center of mass
+    J = np.diag(data.lumped[:, 3:6].sum(axis = 0)) \
+            + np.eye(3)*np.dot(m, (data.X**2).sum(axis = 1)) - np.dot(data.X.T*m, data.X)
+    J -= mass*(np.eye(3)*np.dot(xcm, xcm) - np.outer(xcm, xcm))
+    return Inertia(mass, xcm, J)
+
+def lumped_invariants(data):
+    """Modal invariants 3, 4, 8, 5 and 9 of the lumped mass (RECORD
+    GROUP 11), as MBDyn computes them, by RECORD GROUP (see INVARIANTS)."""
+    m, u, J = data.lumped[:, 0], data.X, data.lumped[:, 3:6]
+    PHIt, PHIr = data.shapes[:, :, 0:3], data.shapes[:, :, 3:6]
+    # Inv3 = sum mi PHIti; Inv4 = sum mi ui x PHIti + Ji PHIri
+    inv3 = np.einsum('i,jia->aj', m, PHIt)
+    inv4 = np.einsum('i,jia->aj', m, np.cross(u, PHIt)) + np.einsum('ia,jia->aj', J, PHIr)
+    # Inv8j = -sum [ui x][mi PHItij x] = -sum mi (PHItij ui^T - (ui . PHItij) I)
+    A = np.einsum('i,jia,ib->jab', m, PHIt, u)
+    inv8 = np.trace(A, axis1 = 1, axis2 = 2)[:, None, None]*np.eye(3) - A
+    # G[a, b, j, k] = sum mi PHItij_a PHItik_b
+    G = np.einsum('i,jia,kib->abjk', m, PHIt, PHIt)
+    # Inv5jk = sum mi PHItij x PHItik
+    inv5 = np.array([G[1, 2] - G[2, 1], G[2, 0] - G[0, 2], G[0, 1] - G[1, 0]])
+    # Inv9jk = sum [mi PHItij x][PHItik x] = sum mi (PHItik PHItij^T - (PHItij . PHItik) I)
+    inv9 = G.transpose(1, 2, 3, 0) \
+            - np.einsum('ccjk,ab->ajkb', G, np.eye(3))
+    return {14: inv3, 15: inv4, 16: inv8.transpose(1, 0, 2), 17: inv5, 18: inv9}
+
+def subset_nodes(data, nodes):
+    """ModalData data restricted to the node labels nodes, in that order.
+    MBDyn computes the rigid-body inertia (when RECORD GROUP 12 is
+    missing) and the modal invariants from the lumped mass of the nodes
+    in the file (RECORD GROUP 11): they are computed on the whole body
+    and kept as RECORD GROUPS 12 and 14 to 17 (18 if present), in place
+    of the lumped mass. Invariants 10 and 11 (rotary inertia of the
+    nodes) have no record group and are lost."""
+    idx = data.index(nodes)
+    inertia, invariants = data.inertia, data.invariants
+    if data.lumped is not None:
+        if inertia is None:
+            inertia = lumped_inertia(data)
+        # MBDyn adds those of the lumped mass to the ones in the file
+        invariants = lumped_invariants(data)
+        for rid, a in data.invariants.items():
+            invariants[rid] = invariants[rid] + a
+        # invariant 9 of the lumped mass is only used on request
+        # ("use invariant 9"), while RECORD GROUP 18 always is
+        if 18 not in data.invariants:
+            del invariants[18]
+        if np.any(data.lumped[:, 3:6]) and np.any(data.shapes[:, :, 3:6]):
+            sys.stderr.write('Warning: rotary inertia of the nodes dropped with the lumped mass' \
+                    ' (modal invariants 10 and 11)\n')
+    return ModalData(data.nodes[idx], data.X[idx], data.shapes[:, idx], \
+            data.M, data.K, data.q0, data.qp0, \
+            inertia = inertia, damping = data.damping, \
+            counts = data.counts, invariants = invariants, extra = data.extra)
+
+def mode_order(data, modes):
+    """The 0-based modes grouped by kind (normal, attachment, constraint)
+    as the file header requires, each kind in the order given."""
+    modes = np.asarray(modes, dtype = np.int64)
+    kinds = np.repeat(np.arange(3), data.counts)[modes]
+    return modes[np.argsort(kinds, kind = 'stable')]
+
+def select_modes(data, modes):
+    """ModalData data restricted to the 0-based modes, grouped by kind
+    (see mode_order), each kind in the order given. Record groups past
+    18 (stress stiffening) depend on the modes and are dropped."""
+    modes = mode_order(data, modes)
+    kinds = np.repeat(np.arange(3), data.counts)[modes]
+    if data.extra:
+        sys.stderr.write('Warning: record groups ' \
+                + ' '.join(str(r) for r in sorted(data.extra)) \
+                + ' dropped with the modes\n')
+    return ModalData(data.nodes, data.X, data.shapes[modes], \
+            data.M[np.ix_(modes, modes)], data.K[np.ix_(modes, modes)], \
+            data.q0[modes], data.qp0[modes], lumped = data.lumped, \
+            inertia = data.inertia, \
+            damping = None if data.damping is None \
+                    else data.damping[np.ix_(modes, modes)], \
+            counts = np.bincount(kinds, minlength = 3), \
+            invariants = dict((rid, _invariant_modes(rid, a, modes)) \
+                    for rid, a in data.invariants.items()))
+
+def frequencies(data):
+    """Frequency [Hz] of each mode, from the diagonals of the generalized
+    matrices: exact for normal modes, the Rayleigh quotient of the shape
+    for attachment and constraint modes."""
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return np.sqrt(np.abs(np.diag(data.K)/np.diag(data.M)))/(2*np.pi)
+
+def rigid_modes(X, center = (0., 0., 0.)):
+    """Displacements (nodes, 6, 6) of the nodes at X for the unit
+    rigid-body translations and rotations about center."""
+    x, y, z = (np.asarray(X) - center).T
+    R = np.zeros((len(x), 6, 6))
+    R[:, 0:3, 0:3] = np.eye(3)
+    R[:, 3:6, 3:6] = np.eye(3)
+    # u = theta x r
+    R[:, 0, 4], R[:, 0, 5] = z, -y
+    R[:, 1, 3], R[:, 1, 5] = -z, x
+    R[:, 2, 3], R[:, 2, 4] = y, -x
+    return R
+
+def participation(data):
+    """Effective mass (modes, 6) of each mode in the rigid-body
+    translations and rotations about the center of mass, as a fraction
+    of the total, computed from the lumped mass (RECORD GROUP 11)."""
+    if data.lumped is None:
+        raise ValueError('participation needs the lumped mass (RECORD GROUP 11)')
+    m = data.lumped
+    total = m[:, 0].sum()
+    center = np.dot(m[:, 0], data.X)/total if total > 0 else np.zeros(3)
+    R = rigid_modes(data.X, center)
+    MR = m[:, :, None]*R
+    L = np.tensordot(data.shapes, MR, axes = ([1, 2], [0, 1]))
+    ref = np.einsum('ncj,ncj->j', R, MR)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return np.nan_to_num(L**2/np.diag(data.M)[:, None]/ref)
+
+def summary(data):
+    """One line per record group found in data."""
+    out = ['%d nodes, %d modes (normal %d, attachment %d, constraint %d)' \
+            % ((data.nnodes, data.nmodes) + tuple(data.counts))]
+    if data.lumped is not None:
+        out.append('lumped mass: total %g' % data.lumped[:, 0].sum())
+    if data.inertia is not None:
+        out.append('rigid-body mass %g, center of mass %s' \
+                % (data.inertia.mass, data.inertia.xcm))
+    if data.damping is not None:
+        out.append('generalized damping')
+    if data.invariants:
+        out.append('modal invariants: ' + ' '.join(str(INVARIANTS[r][0]) \
+                for r in sorted(data.invariants)))
+    if data.extra:
+        out.append('other record groups: ' + ' '.join(str(r) for r in sorted(data.extra)))
+    return out
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(\
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description='Read and rewrite MBDyn modal element data files.',
+            epilog=__doc__)
+    parser.add_argument('fem', help='modal data file')
+    parser.add_argument('--output', '-o', help='rewrite the data to OUTPUT')
+    parser.add_argument('--precision', type=int, default=PRECISION, \
+            help='significant digits written (default: %(default)s)')
+    parser.add_argument('--nodes', nargs='+', default=[], help='node labels kept')
+    parser.add_argument('--nodes-file', help='file of the node labels kept')
+    parser.add_argument('--max-frequency', type=float, help='highest mode frequency kept [Hz]')
+    parser.add_argument('--min-participation', type=float, \
+            help='smallest effective mass fraction kept (in any rigid-body motion)')
+    parser.add_argument('--order', choices=('file', 'frequency', 'participation'), \
+            default='file', help='order of the modes kept (default: %(default)s)')
+    parser.add_argument('--modes', type=int, help='number of modes kept, in ORDER')
+    args = parser.parse_args(argv)
+
+    data = read(args.fem)
+    for line in summary(data):
+        print(args.fem + ': ' + line)
+
+    # modes are chosen on the whole model, before the nodes are subset
+    keep = np.arange(data.nmodes)
+    freq = frequencies(data)
+    score = None
+    if args.min_participation is not None or args.order == 'participation':
+        score = participation(data).max(axis = 1)
+    if args.max_frequency is not None:
+        keep = keep[freq[keep] <= args.max_frequency]
+    if args.min_participation is not None:
+        keep = keep[score[keep] >= args.min_participation]
+    if args.order == 'frequency':
+        keep = keep[np.argsort(freq[keep], kind = 'stable')]
+    elif args.order == 'participation':
+        keep = keep[np.argsort(-score[keep], kind = 'stable')]
+    if args.modes is not None:
+        keep = keep[:args.modes]
+    keep = mode_order(data, keep)
+    if len(keep) != data.nmodes or np.any(keep != np.arange(data.nmodes)):
+        data = select_modes(data, keep)
+        print('%s: kept modes %s' % (args.fem, ' '.join(str(m + 1) for m in keep)))
+
+    nodes = list(args.nodes)
+    if args.nodes_file:
+        with open(args.nodes_file) as f:
+            nodes += f.read().split()
+    if nodes:
+        data = subset_nodes(data, nodes)
+
+    if args.output:
+        write(args.output, data, args.precision)
+        for line in summary(data):
+            print(args.output + ': ' + line)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
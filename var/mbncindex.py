@@ -0,0 +1,263 @@
+"""Sidecar index of MBDyn NetCDF output files.
+
+For each output file a small JSON sidecar (<ncfile>.index.json) records
+the variable names, dimensions, shapes, units, the time range and the
+min/max of each variable (overall and per component), together with the
+size and modification time of the NetCDF file it was built from.
+Queries over a run directory only read the sidecars; stale or missing
+sidecars are rebuilt, in parallel, on demand.
+
+    python mbncindex.py build runs/
+    python mbncindex.py list runs/ --var 'elem.joint.*.f'
+    python mbncindex.py query runs/ --var 'node.struct.*.X' --comp 2 --gt 1.5
+
+or, from Python:
+
+    import mbncindex
+    idx = mbncindex.scan('runs/')
+    for run, var, value in mbncindex.exceeds(idx, 'node.struct.*.X', 1.5, comp = 2):
+        print(run, var, value)
+"""
+
+import os
+import sys
+import glob
+import json
+import fnmatch
+import warnings
+import argparse
+import multiprocessing
+
+import numpy as np
+import netCDF4 as nc
+
+SUFFIX = '.index.json'
+VERSION = 1
+
+# default number of records read from a variable at once
+CHUNK = 1 << 20
+
+def sidecar(ncfile):
+    """Name of the index file of ncfile."""
+    return ncfile + SUFFIX
+
+def _stat(ncfile):
+    st = os.stat(ncfile)
+    return {'size': st.st_size, 'mtime': st.st_mtime}
+
+def _minmax(ncVar, n, chunk):
+    """Per-component min/max of ncVar over its first dimension, skipping
+    fill values (records not written by an interrupted run) and NaNs."""
+    fill = getattr(ncVar, '_FillValue', \
+            nc.default_fillvals.get(ncVar.dtype.str[1:]))
+    ncomp = int(np.prod(ncVar.shape[1:]))
+    lo = np.full(ncomp, np.inf)
+    hi = np.full(ncomp, -np.inf)
+    for a in range(0, n, chunk):
+        data = np.asarray(ncVar[a:a + chunk], dtype = np.float64)
+        data = data.reshape(len(data), ncomp)
+        if fill is not None:
+            data[data == fill] = np.nan
+        with warnings.catch_warnings():
+            # all-NaN columns
+            warnings.simplefilter('ignore', RuntimeWarning)
+            lo = np.fmin(lo, np.nanmin(data, axis = 0))
+            hi = np.fmax(hi, np.nanmax(data, axis = 0))
+    lo[np.isinf(lo)] = np.nan
+    hi[np.isinf(hi)] = np.nan
+    return lo, hi
+
+def _number(x):
+    # JSON has no NaN
+    return None if np.isnan(x) else float(x)
+
+def build(ncfile, chunk = CHUNK, write = True):
+    """Build the index of ncfile, write it to its sidecar (if write) and
+    return it."""
+    index = {'version': VERSION, 'source': _stat(ncfile), 'variables': {}}
+    nd = nc.Dataset(ncfile, 'r')
+    try:
+        nd.set_auto_mask(False)
+        for name, ncVar in nd.variables.items():
+            entry = {'dims': list(ncVar.dimensions), \
+                    'shape': list(ncVar.shape), \
+                    'dtype': ncVar.dtype.str}
+            if 'units' in ncVar.ncattrs():
+                entry['units'] = ncVar.units
+            if len(ncVar.shape) and ncVar.shape[0] and \
+                    np.issubdtype(ncVar.dtype, np.number):
+                lo, hi = _minmax(ncVar, ncVar.shape[0], chunk)
+                entry['min'] = _number(np.nanmin(lo)) if np.any(~np.isnan(lo)) else None
+                entry['max'] = _number(np.nanmax(hi)) if np.any(~np.isnan(hi)) else None
+                if len(ncVar.shape) > 1:
+                    entry['cmin'] = [_number(x) for x in lo]
+                    entry['cmax'] = [_number(x) for x in hi]
+            index['variables'][name] = entry
+    finally:
+        nd.close()
+
+    t = index['variables'].get('time')
+    if t and t.get('min') is not None:
+        # [first, last, records]; unwritten records are not counted in the range
+        index['time'] = [t['min'], t['max'], t['shape'][0]]
+
+    if write:
+        tmp = sidecar(ncfile) + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(index, f, separators = (',', ':'))
+        os.replace(tmp, sidecar(ncfile))
+    return index
+
+def fresh(ncfile, index):
+    """True if index was built from the current version of ncfile."""
+    return index.get('version') == VERSION and index.get('source') == _stat(ncfile)
+
+def load(ncfile, rebuild = True, chunk = CHUNK):
+    """Return the index of ncfile from its sidecar; if the sidecar is
+    missing or stale, rebuild it (or return None if not rebuild)."""
+    try:
+        with open(sidecar(ncfile)) as f:
+            index = json.load(f)
+        if fresh(ncfile, index):
+            return index
+    except (IOError, OSError, ValueError):
+        pass
+    return build(ncfile, chunk) if rebuild else None
+
+def _load(args):
+    ncfile, rebuild, chunk = args
+    try:
+        return ncfile, load(ncfile, rebuild, chunk), None
+    except Exception as e:
+        return ncfile, None, repr(e)
+
+def find_files(paths, pattern = '*.nc'):
+    """NetCDF files among paths: files are taken as they are, shell-style
+    patterns are expanded and directories are searched recursively for
+    pattern."""
+    out = []
+    for p in paths:
+        if os.path.isdir(p):
+            for root, dirs, files in os.walk(p):
+                out.extend(os.path.join(root, f) \
+                        for f in fnmatch.filter(files, pattern))
+        elif glob.has_magic(p):
+            out.extend(glob.glob(p))
+        else:
+            out.append(p)
+    return sorted(out)
+
+def scan(paths, pattern = '*.nc', rebuild = True, jobs = None, chunk = CHUNK):
+    """Return {ncfile: index} for the NetCDF files found in paths (a
+    directory, a file, a pattern or a list of them). Missing or stale
+    sidecars are rebuilt in a pool of jobs processes; files whose index
+    cannot be built are reported on stderr and skipped."""
+    if isinstance(paths, str):
+        paths = [paths]
+    files = find_files(paths, pattern)
+    out = {}
+    todo = []
+    for f in files:
+        index = load(f, rebuild = False)
+        if index is not None:
+            out[f] = index
+        elif rebuild:
+            todo.append(f)
+    if not todo:
+        return out
+    tasks = [(f, True, chunk) for f in todo]
+    pool = None
+    if jobs == 1 or len(todo) == 1:
+        results = map(_load, tasks)
+    else:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap_unordered(_load, tasks)
+    try:
+        for f, index, error in results:
+            if error:
+                sys.stderr.write('Error: ' + f + ': ' + error + '\n')
+            else:
+                out[f] = index
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return out
+
+def variables(indexes, var = '*'):
+    """Yield (ncfile, name, entry) for the variables matching the
+    shell-style pattern var."""
+    for f in sorted(indexes):
+        vs = indexes[f]['variables']
+        for name in sorted(fnmatch.filter(vs.keys(), var)):
+            yield f, name, vs[name]
+
+def _extreme(entry, comp, key):
+    if comp is None:
+        return entry.get(key)
+    values = entry.get('c' + key)
+    if values is None or comp >= len(values):
+        return None
+    return values[comp]
+
+def exceeds(indexes, var, threshold, comp = None, below = False):
+    """List (ncfile, variable, value) for the variables matching var
+    whose maximum (or minimum, if below) is greater (less) than
+    threshold; comp selects a flattened, row-major component."""
+    out = []
+    for f, name, entry in variables(indexes, var):
+        value = _extreme(entry, comp, 'min' if below else 'max')
+        if value is None:
+            continue
+        if (value < threshold) if below else (value > threshold):
+            out.append((f, name, value))
+    return out
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(\
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description='Build and query sidecar indexes of MBDyn NetCDF output files.',
+            epilog=__doc__)
+    parser.add_argument('command', choices=['build', 'list', 'query'])
+    parser.add_argument('paths', nargs='+', \
+            help='NetCDF files, patterns or directories (searched recursively)')
+    parser.add_argument('--pattern', default='*.nc', \
+            help='file pattern used in directories (default: %(default)s)')
+    parser.add_argument('--var', '-v', default='*', \
+            help='variable name pattern (default: all)')
+    parser.add_argument('--comp', '-c', type=int, \
+            help='0-based component (row-major for matrices)')
+    parser.add_argument('--gt', type=float, help='report maxima above this value')
+    parser.add_argument('--lt', type=float, help='report minima below this value')
+    parser.add_argument('--force', action='store_true', \
+            help='build: rebuild fresh sidecars too')
+    parser.add_argument('--jobs', '-j', type=int, \
+            help='processes used to build indexes (default: number of cores)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build' and args.force:
+        for f in find_files(args.paths, args.pattern):
+            if os.path.exists(sidecar(f)):
+                os.remove(sidecar(f))
+
+    indexes = scan(args.paths, args.pattern, jobs = args.jobs)
+
+    if args.command == 'build':
+        print(str(len(indexes)) + ' file(s) indexed')
+    elif args.command == 'list':
+        for f, name, entry in variables(indexes, args.var):
+            print('%s %s %s %s %s %s' % (f, name, 'x'.join(map(str, entry['shape'])), \
+                    entry.get('units', '-'), entry.get('min'), entry.get('max')))
+    else:
+        if args.gt is None and args.lt is None:
+            parser.error('query needs --gt and/or --lt')
+        if args.gt is not None:
+            for f, name, value in exceeds(indexes, args.var, args.gt, args.comp):
+                print('%s %s max=%g' % (f, name, value))
+        if args.lt is not None:
+            for f, name, value in exceeds(indexes, args.var, args.lt, args.comp, True):
+                print('%s %s min=%g' % (f, name, value))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,87 +1,359 @@
+import os
 import sys
+import glob
+import fnmatch
 import argparse
+import multiprocessing
 
 # DEBUG
 # import pdb
 
+import numpy as np
 import netCDF4 as nc
 import matplotlib.pyplot as plt
 
-parser = argparse.ArgumentParser(\
-        formatter_class=argparse.RawDescriptionHelpFormatter,
-        description='Plot variables in MBDyn output using Matplotlib.',\
-        epilog='Multiple --var arguments can be provided.\n' + \
-                'Components should be indicated by a single integer and are 0-based.\n' + \
-                'For matrices, indexes 0-8 can be used, indicating the components in.\n' + \
-                'row-major ordering\n' + \
-                'Please note that it is not mandatory to place the --comps option directly \n' + \
-                'after the related variables, but variables and components will be regarded \n' + \
-                'as ordered lists. In other works, these two inputs are equivalent: \n\n' + \
-                'python mbncplot.py --var node.struct.1.X --comps 1 --var node.struct.2.X --comps 2\n' + \
-                'python mbncplot.py --var node.struct.1.X --var node.struct.2.X --comps 1 --comps 2\n'\
-                )
-
-parser.add_argument('ncfile', metavar='ncfile', help='MBDyn NetCDF output file')
-parser.add_argument('--time', '-t', action='store_true',\
-        help='use simulation time on X axis')
-parser.add_argument('--var', '-v', nargs=1, \
-        help='variable[s] to be plotted', action='append', required=True)
-parser.add_argument('--comps', '-c', type=int, \
-        help='component[s] of the variable to be plotted', \
-        nargs=1, action='append')
-
-args = parser.parse_args()
-
 # row-major indexes
 rows = {0: 0, 1: 0, 2: 0, 3: 1, 4: 1, 5: 1, 6: 2, 7: 2, 8: 2}
 cols = {0: 0, 1: 1, 2: 2, 3: 0, 4: 1, 5: 2, 6: 0, 7: 1, 8: 2}
 
-try:
-    nd = nc.Dataset(args.ncfile, 'r')
-except FileNotFoundError:
-    print('Error: NetCDF file not found.')
-    sys.exit(1)
-
-# fig = plt.figure()
-if args.time:
-    X = nd.variables['time']
-    plt.xlabel('Time [s]')
-else:
-    X = nd.variables['run.step']
-    plt.xlabel('Step')
-
-try:
-    for idx in range(len(args.var)):
-        ncVar = nd.variables[args.var[idx][0]]
-        if len(ncVar.shape) == 1:
-            plt.plot(X, ncVar, label = args.var[idx][0])
-        elif len(ncVar.shape) == 2:
-            if args.comps[idx]:
-                plt.plot(X, ncVar[:, args.comps[idx][0]], \
-                        label = args.var[idx][0] + '[:,' + str(args.comps[idx][0]) + ']'\
-                        + '  [' + ncVar.units +']')
+# default number of samples read from a variable at once
+CHUNK = 1 << 20
+
+def window(ncVar, start = None, stop = None, stride = None):
+    """Normalize a (start, stop, stride) selection along the time axis
+    of ncVar, returning a slice with non-negative, explicit bounds."""
+    return slice(*slice(start, stop, stride).indices(ncVar.shape[0]))
+
+def read_chunks(ncVar, comp = (), start = None, stop = None, stride = None, \
+        chunk = CHUNK):
+    """Yield the samples ncVar[start:stop:stride, comp] in pieces of at
+    most chunk samples. The slicing is done by netCDF4, so only the
+    selected records (and components) are read from disk."""
+    s = window(ncVar, start, stop, stride)
+    if s.step < 0:
+        raise ValueError('negative stride not supported')
+    step = chunk*s.step
+    for a in range(s.start, s.stop, step):
+        yield ncVar[(slice(a, min(a + step, s.stop), s.step),) + tuple(comp)]
+
+def read(ncVar, comp = (), start = None, stop = None, stride = None, \
+        chunk = CHUNK):
+    """Read ncVar[start:stop:stride, comp] chunk by chunk into a single
+    array; only the requested window is materialized."""
+    s = window(ncVar, start, stop, stride)
+    n = len(range(s.start, s.stop, s.step))
+    out = np.empty((n,) + _comp_shape(ncVar, comp), dtype = ncVar.dtype)
+    i = 0
+    for data in read_chunks(ncVar, comp, s.start, s.stop, s.step, chunk):
+        out[i:i + len(data)] = data
+        i += len(data)
+    return out
+
+def envelope(ncVar, comp = (), start = None, stop = None, stride = None, \
+        buckets = 2000, chunk = CHUNK):
+    """Min/max envelope of ncVar[start:stop:stride, comp] over buckets
+    consecutive, equally populated groups of records, computed in one
+    streaming pass over the chunks. Returns (lo, hi), each shaped
+    (buckets, ...) and of type float64."""
+    s = window(ncVar, start, stop, stride)
+    n = len(range(s.start, s.stop, s.step))
+    buckets = min(buckets, n)
+    shape = (buckets,) + _comp_shape(ncVar, comp)
+    lo = np.full(shape, np.inf)
+    hi = np.full(shape, -np.inf)
+    i = 0
+    for data in read_chunks(ncVar, comp, s.start, s.stop, s.step, chunk):
+        b = (np.arange(i, i + len(data), dtype = np.int64)*buckets)//n
+        starts = np.flatnonzero(np.diff(b, prepend = -1))
+        ub = b[starts]
+        # the first bucket of a chunk may continue from the previous one
+        lo[ub] = np.minimum(lo[ub], np.minimum.reduceat(data, starts, axis = 0))
+        hi[ub] = np.maximum(hi[ub], np.maximum.reduceat(data, starts, axis = 0))
+        i += len(data)
+    return lo, hi
+
+def _comp_shape(ncVar, comp):
+    return np.empty(ncVar.shape[1:], dtype = np.int8)[tuple(comp)].shape
+
+def series(name, ncVar, comp = None):
+    """List the (label, component index) pairs plotted for variable
+    ncVar; comp is the optional 0-based component (0-8, row-major, for
+    matrices); raises ValueError if ncVar has no such component."""
+    units = '  [' + ncVar.units + ']' if 'units' in ncVar.ncattrs() else ''
+    ncomps = {1: 0, 2: ncVar.shape[1] if len(ncVar.shape) == 2 else 0, 3: 9}
+    if comp is not None and not 0 <= comp < ncomps.get(len(ncVar.shape), 0):
+        raise ValueError('variable ' + name + ' has no component ' + str(comp))
+    if len(ncVar.shape) == 1:
+        return [(name, ())]
+    elif len(ncVar.shape) == 2:
+        comps = [comp] if comp is not None else range(ncVar.shape[1])
+        return [(name + '[:, ' + str(jdx) + ']' + units, (jdx,)) \
+                for jdx in comps]
+    elif len(ncVar.shape) == 3:
+        comps = [comp] if comp is not None else range(9)
+        return [(name + '[:, ' + str(rows[jdx]) + ', ' + str(cols[jdx]) + ']' \
+                + units, (rows[jdx], cols[jdx])) for jdx in comps]
+    raise ValueError('variable ' + name + ' has unsupported shape ' \
+            + str(ncVar.shape))
+
+def open_dataset(ncfile):
+    nd = nc.Dataset(ncfile, 'r')
+    # plain ndarrays: MBDyn output has no fill values to mask
+    nd.set_auto_mask(False)
+    return nd
+
+def plot(nd, specs, time = False, start = None, stop = None, stride = None, \
+        chunk = CHUNK, ax = None, buckets = None):
+    """Plot the (variable, component) pairs in specs from dataset nd.
+    If buckets is given and the window holds more than 2*buckets records,
+    the min/max envelope over buckets groups of records is drawn instead
+    of every sample, which preserves the peaks."""
+    if ax is None:
+        ax = plt.gca()
+    if time:
+        ncX = nd.variables['time']
+        ax.set_xlabel('Time [s]')
+    else:
+        ncX = nd.variables['run.step']
+        ax.set_xlabel('Step')
+
+    s = window(ncX, start, stop, stride)
+    if buckets and len(range(s.start, s.stop, s.step)) > 2*buckets:
+        # X is monotonic: the bucket minimum is its first abscissa
+        X = np.repeat(envelope(ncX, (), start, stop, stride, buckets, chunk)[0], 2)
+        for name, comp in specs:
+            ncVar = nd.variables[name]
+            sel = series(name, ncVar, comp)
+            if len(sel) == 1:
+                lo, hi = envelope(ncVar, sel[0][1], start, stop, stride, buckets, chunk)
+                sel = [(sel[0][0], ())]
             else:
-                for jdx in range(ncVar.shape[1]):
-                    plt.plot(X, ncVar[:, jdx], \
-                            label = args.var[idx][0] + '[:, ' + str(jdx) + ']'\
-                            + '  [' + ncVar.units +']')
-        elif len(ncVar.shape) == 3:
-            if args.comps[idx][0]:
-                plt.plot(X, ncVar[:, rows[args.comps[idx][0]], cols[args.comps[idx][0]]],\
-                        label = args.var[idx][0] + '[:, ' + \
-                        str[rows[args.comps[idx][0]]] + ' , ' + 
-                        str[cols[args.comps[idx][0]]] + ']'\
-                        + '  [' + ncVar.units +']')
+                lo, hi = envelope(ncVar, (), start, stop, stride, buckets, chunk)
+            for label, idx in sel:
+                Y = np.stack((lo[(slice(None),) + idx], hi[(slice(None),) + idx]), \
+                        axis = 1).ravel()
+                ax.plot(X, Y, label = label)
+    else:
+        X = read(ncX, (), start, stop, stride, chunk)
+        for name, comp in specs:
+            ncVar = nd.variables[name]
+            for label, idx in series(name, ncVar, comp):
+                ax.plot(X, read(ncVar, idx, start, stop, stride, chunk), \
+                        label = label)
+    ax.legend()
+    return ax
+
+def expand(nd, specs):
+    """Expand shell-style wildcards in the variable names of specs
+    (e.g. node.struct.*.X) against the variables of dataset nd."""
+    out = []
+    for name, comp in specs:
+        if glob.has_magic(name):
+            names = sorted(fnmatch.filter(nd.variables.keys(), name))
+        else:
+            names = [name]
+        for n in names:
+            if n not in nd.variables:
+                raise KeyError(n)
+            out.append((n, comp))
+    return out
+
+def write_csv(f, nd, name, comp, time = False, start = None, stop = None, \
+        stride = None, chunk = CHUNK):
+    """Write the abscissa and the selected components of variable name
+    as comma-separated columns, chunk by chunk."""
+    ncX = nd.variables['time' if time else 'run.step']
+    ncVar = nd.variables[name]
+    sel = series(name, ncVar, comp)
+    header = ','.join([ncX.name] + [label for label, idx in sel])
+    f.write((header + '\n').encode())
+    for x, data in zip(read_chunks(ncX, (), start, stop, stride, chunk), \
+            read_chunks(ncVar, (), start, stop, stride, chunk)):
+        columns = [x] + [data[(slice(None),) + idx] for label, idx in sel]
+        np.savetxt(f, np.column_stack(columns), delimiter = ',')
+
+def export(ncfile, specs, outdir, formats = ('png',), time = False, \
+        start = None, stop = None, stride = None, chunk = CHUNK, \
+        buckets = 2000):
+    """Write one file per variable of specs and per format (png, pdf,
+    csv, or anything Figure.savefig accepts) into outdir, named
+    <ncfile stem>.<variable>[.<comp>].<format>. The dataset is opened
+    once. Variables that cannot be exported (e.g. a component they do
+    not have) are skipped. Returns the list of written files and the
+    list of (variable, error) pairs of the skipped variables."""
+    # pyplot is not used here, so this runs in headless workers
+    from matplotlib.figure import Figure
+
+    stem = os.path.splitext(os.path.basename(ncfile))[0]
+    written = []
+    skipped = []
+    nd = open_dataset(ncfile)
+    try:
+        for name, comp in expand(nd, specs):
+            try:
+                series(name, nd.variables[name], comp)
+            except ValueError as e:
+                skipped.append((name, str(e)))
+                continue
+            base = os.path.join(outdir, stem + '.' + name \
+                    + ('.' + str(comp) if comp is not None else ''))
+            for fmt in formats:
+                path = base + '.' + fmt
+                if fmt == 'csv':
+                    with open(path, 'wb') as f:
+                        write_csv(f, nd, name, comp, time, start, stop, \
+                                stride, chunk)
+                else:
+                    fig = Figure()
+                    ax = fig.add_subplot(1, 1, 1)
+                    plot(nd, [(name, comp)], time, start, stop, stride, \
+                            chunk, ax, buckets)
+                    ax.set_title(stem)
+                    fig.savefig(path)
+                written.append(path)
+    finally:
+        nd.close()
+    return written, skipped
+
+def _export(job):
+    ncfile, kwargs = job
+    try:
+        return (ncfile,) + export(ncfile, **kwargs) + (None,)
+    except Exception as e:
+        return ncfile, [], [], repr(e)
+
+def batch(ncfiles, specs, outdir, jobs = None, **kwargs):
+    """Run export() on each of ncfiles in a pool of jobs processes
+    (default: one per core). Returns a list of (ncfile, error) pairs
+    for the files that failed."""
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    kwargs.update(specs = specs, outdir = outdir)
+    tasks = [(f, kwargs) for f in ncfiles]
+    failed = []
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for ncfile, written, skipped, error in pool.imap_unordered(_export, tasks):
+            for name, reason in skipped:
+                print('Warning: ' + ncfile + ': ' + reason + ', skipped')
+            if error:
+                print('Error: ' + ncfile + ': ' + error)
+                failed.append((ncfile, error))
             else:
-                for jdx in range(9):
-                    plt.plot(X, ncVar[:, rows[jdx], cols[jdx]],\
-                        label = args.var[idx][0] + '[:, ' + \
-                        str[rows[jdx]] + ' , ' + 
-                        str[cols[jdx]] + ']'\
-                        + '  [' + ncVar.units +']')
-except KeyError:
-    print('Error: variable ' + args.var[idx][0] + ' not found')
-    sys.exit(2)
-
-plt.legend()
-plt.show()
+                print(ncfile + ': ' + str(len(written)) + ' file(s) written')
+    finally:
+        pool.close()
+        pool.join()
+    return failed
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(\
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description='Plot variables in MBDyn output using Matplotlib.',\
+            epilog='Multiple --var arguments can be provided.\n' + \
+                    'Components should be indicated by a single integer and are 0-based.\n' + \
+                    'For matrices, indexes 0-8 can be used, indicating the components in.\n' + \
+                    'row-major ordering\n' + \
+                    'Please note that it is not mandatory to place the --comps option directly \n' + \
+                    'after the related variables, but variables and components will be regarded \n' + \
+                    'as ordered lists. In other works, these two inputs are equivalent: \n\n' + \
+                    'python mbncplot.py --var node.struct.1.X --comps 1 --var node.struct.2.X --comps 2\n' + \
+                    'python mbncplot.py --var node.struct.1.X --var node.struct.2.X --comps 1 --comps 2\n' + \
+                    '\n--start, --stop and --stride select output records (0-based, Python slice\n' + \
+                    'semantics); only the selected records are read from the file.\n' + \
+                    'Long windows are drawn as min/max envelopes, one bucket per horizontal\n' + \
+                    'pixel unless --buckets is given; --full plots every record.\n' + \
+                    '\nWith --outdir, nothing is shown: each ncfile (shell-style patterns\n' + \
+                    'are expanded) is processed in a pool of --jobs processes, writing one\n' + \
+                    'file per variable and --format. Variable names may contain wildcards,\n' + \
+                    'and --varfile reads "variable [component]" lines, e.g.\n\n' + \
+                    'python mbncplot.py --outdir plots --format png csv --var "node.struct.*.X" "runs/*.nc"\n'\
+                    )
+
+    parser.add_argument('ncfile', metavar='ncfile', nargs='+', \
+            help='MBDyn NetCDF output file (several, or patterns, with --outdir)')
+    parser.add_argument('--time', '-t', action='store_true',\
+            help='use simulation time on X axis')
+    parser.add_argument('--var', '-v', nargs=1, \
+            help='variable[s] to be plotted', action='append', default=[])
+    parser.add_argument('--comps', '-c', type=int, \
+            help='component[s] of the variable to be plotted', \
+            nargs=1, action='append')
+    parser.add_argument('--start', type=int, help='first output record')
+    parser.add_argument('--stop', type=int, help='last output record (excluded)')
+    parser.add_argument('--stride', type=int, help='read one record every STRIDE')
+    parser.add_argument('--chunk', type=int, default=CHUNK, \
+            help='records read at once (default: %(default)s)')
+    parser.add_argument('--buckets', type=int, \
+            help='number of min/max envelope buckets (default: axes width in pixels)')
+    parser.add_argument('--full', action='store_true', \
+            help='plot every record, without envelope decimation')
+    parser.add_argument('--varfile', \
+            help='file with one "variable [component]" per line')
+    parser.add_argument('--outdir', '-o', \
+            help='batch mode: write outputs to this directory instead of showing')
+    parser.add_argument('--format', '-f', nargs='+', default=['png'], \
+            help='batch output formats, e.g. png pdf csv (default: png)')
+    parser.add_argument('--jobs', '-j', type=int, \
+            help='batch worker processes (default: number of cores)')
+
+    args = parser.parse_args(argv)
+
+    comps = [c[0] for c in args.comps] if args.comps else []
+    specs = [(v[0], comps[idx] if idx < len(comps) else None) \
+            for idx, v in enumerate(args.var)]
+    if args.varfile:
+        with open(args.varfile) as f:
+            for line in f:
+                fields = line.split('#')[0].split()
+                if fields:
+                    specs.append((fields[0], \
+                            int(fields[1]) if len(fields) > 1 else None))
+    if not specs:
+        parser.error('at least one --var or a --varfile is required')
+
+    if args.outdir:
+        ncfiles = []
+        for pattern in args.ncfile:
+            ncfiles.extend(sorted(glob.glob(pattern)) \
+                    if glob.has_magic(pattern) else [pattern])
+        failed = batch(ncfiles, specs, args.outdir, args.jobs, \
+                formats = args.format, time = args.time, start = args.start, \
+                stop = args.stop, stride = args.stride, chunk = args.chunk, \
+                buckets = None if args.full else (args.buckets or 2000))
+        return 3 if failed else 0
+
+    if len(args.ncfile) > 1:
+        parser.error('only one ncfile can be shown; use --outdir for batches')
+
+    try:
+        nd = open_dataset(args.ncfile[0])
+    except FileNotFoundError:
+        print('Error: NetCDF file not found.')
+        return 1
+
+    try:
+        specs = expand(nd, specs)
+    except KeyError as e:
+        print('Error: variable ' + e.args[0] + ' not found')
+        return 2
+    shown = []
+    for name, comp in specs:
+        try:
+            series(name, nd.variables[name], comp)
+            shown.append((name, comp))
+        except ValueError as e:
+            print('Warning: ' + str(e) + ', skipped')
+
+    ax = plt.gca()
+    buckets = None
+    if not args.full:
+        buckets = args.buckets or \
+                int(ax.get_window_extent().width) or 2000
+    plot(nd, shown, args.time, args.start, args.stop, args.stride, args.chunk, \
+            ax, buckets)
+    plt.show()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,250 @@
+"""Follow the output of running MBDyn simulations.
+
+Each follower keeps the offset it has read up to, so a poll costs a
+stat() when the file did not change, and reads just the appended bytes
+otherwise; no process is spawned and nothing is read twice:
+
+    OutTail(path)           "Step" lines of the .out file, as dicts of
+                            arrays (see mbtxtread.parse_out())
+    TextTail(path)          new complete steps of a .mov/.jnt/... file,
+                            as (steps, data[steps, labels, columns])
+    NetCDFTail(path, vars)  new records of NetCDF variables
+
+follow() polls any number of followers from a single thread, e.g. to
+feed a dashboard of many concurrent runs:
+
+    tails = [mbtail.OutTail(r + '.out') for r in runs]
+    for tail, new in mbtail.follow(tails, interval = 0.5):
+        print(tail.path, new['time'][-1])
+
+    python mbtail.py run.out run.mov
+"""
+
+import os
+import io
+import sys
+import time
+import argparse
+
+import numpy as np
+
+import mbtxtread
+
+class Tail(object):
+    """Base follower: tracks the size and mtime of path."""
+
+    def __init__(self, path):
+        self.path = path
+        self._stat = None
+
+    def changed(self):
+        """True if path changed since the last call."""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+        key = (st.st_size, st.st_mtime)
+        if key == self._stat:
+            return False
+        self._stat = key
+        return True
+
+    def poll(self):
+        """New data, or None."""
+        if not self.changed():
+            return None
+        return self.read()
+
+    def read(self):
+        raise NotImplementedError
+
+    def finish(self):
+        """Data left pending once the file is complete, or None."""
+        return None
+
+class _BytesTail(Tail):
+    """Follower of a growing file, handing out whole lines."""
+
+    def __init__(self, path, offset = 0):
+        Tail.__init__(self, path)
+        self.offset = offset
+        self.pending = b''
+
+    def lines(self):
+        """New complete lines (as bytes), or b''."""
+        try:
+            with open(self.path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size < self.offset:
+                    # truncated: the run was restarted
+                    self.offset = 0
+                    self.pending = b''
+                    self.restart()
+                f.seek(self.offset)
+                buf = f.read()
+        except (IOError, OSError):
+            return b''
+        self.offset += len(buf)
+        buf = self.pending + buf
+        end = buf.rfind(b'\n') + 1
+        self.pending = buf[end:]
+        return buf[:end]
+
+    def restart(self):
+        pass
+
+class OutTail(_BytesTail):
+    """Follow the "Step" lines of an .out file."""
+
+    def __init__(self, path, offset = 0):
+        _BytesTail.__init__(self, path, offset)
+        self.time = None
+        self.step = None
+
+    def read(self):
+        out = mbtxtread.parse_out(self.lines())
+        if not out:
+            return None
+        self.time = out['time'][-1]
+        self.step = out['step'][-1]
+        return out
+
+class TextTail(_BytesTail):
+    """Follow a label-per-line text output (.mov, .jnt, ...): yields
+    each step once it is complete, i.e. when the step after it starts
+    (or, for the last one, at finish())."""
+
+    def __init__(self, path, labels = None, offset = 0):
+        _BytesTail.__init__(self, path, offset)
+        self.labels = labels
+        self.restart()
+
+    def restart(self):
+        self.layout = None
+        self.steps = 0
+        self.lines_buf = b''
+
+    def read(self, final = False):
+        # lines() may restart() a truncated file: call it first
+        new = self.lines()
+        buf = self.lines_buf + new
+        if self.layout is None:
+            # the first step is complete when its first label repeats
+            lay = mbtxtread.layout(io.BytesIO(buf))
+            if not len(lay.labels):
+                self.lines_buf = buf
+                return None
+            if buf.count(b'\n') <= len(lay.labels) and not final:
+                self.lines_buf = buf
+                return None
+            self.layout = lay
+        nl = len(self.layout.labels)
+        ends = np.flatnonzero(np.frombuffer(buf, dtype = np.uint8) == 10)
+        nsteps = len(ends)//nl
+        if not final and nsteps*nl == len(ends):
+            # a step is known to be complete once the next one starts
+            nsteps -= 1
+        if nsteps <= 0:
+            self.lines_buf = buf
+            return None
+        end = ends[nsteps*nl - 1]
+        self.lines_buf = buf[end + 1:]
+        out = mbtxtread.read(io.BytesIO(buf[:end + 1]), labels = self.labels)
+        steps = out.steps + self.steps
+        self.steps += nsteps
+        return steps, out.data
+
+    def finish(self):
+        return self.read(final = True)
+
+class NetCDFTail(Tail):
+    """Follow the records of variables of a NetCDF file being written.
+    The dataset is reopened only when the file changed; errors while
+    the writer holds it in an inconsistent state are retried at the
+    next poll."""
+
+    def __init__(self, path, variables = ('time',), record = 0):
+        Tail.__init__(self, path)
+        self.variables = list(variables)
+        self.record = record
+
+    def read(self):
+        import netCDF4 as nc
+        try:
+            nd = nc.Dataset(self.path, 'r')
+        except (IOError, OSError, RuntimeError):
+            self._stat = None
+            return None
+        try:
+            nd.set_auto_mask(False)
+            n = len(nd.dimensions['time'])
+            if n <= self.record:
+                return None
+            out = dict((v, np.asarray(nd.variables[v][self.record:n])) \
+                    for v in self.variables)
+            self.record = n
+            return out
+        except (IOError, OSError, RuntimeError, IndexError):
+            self._stat = None
+            return None
+        finally:
+            nd.close()
+
+def follow(tails, interval = 0.1, timeout = None, idle = None):
+    """Poll tails every interval seconds, yielding (tail, data) for new
+    data. Stops after timeout seconds, or when no tail changed for idle
+    seconds (then yielding what finish() returns)."""
+    t0 = last = time.time()
+    while True:
+        for tail in tails:
+            data = tail.poll()
+            if data is not None:
+                last = time.time()
+                yield tail, data
+        now = time.time()
+        if timeout is not None and now - t0 > timeout:
+            return
+        if idle is not None and now - last > idle:
+            for tail in tails:
+                data = tail.finish()
+                if data is not None:
+                    yield tail, data
+            return
+        time.sleep(interval)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(\
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description='Follow MBDyn output files of running simulations.',
+            epilog=__doc__)
+    parser.add_argument('files', nargs='+', help='.out, .nc or text output files')
+    parser.add_argument('--interval', type=float, default=0.1, help='poll interval [s]')
+    parser.add_argument('--idle', type=float, help='stop when nothing changes for IDLE s')
+    parser.add_argument('--var', '-v', action='append', default=[], \
+            help='NetCDF variables to follow (default: time)')
+    args = parser.parse_args(argv)
+
+    tails = []
+    for f in args.files:
+        if f.endswith('.out'):
+            tails.append(OutTail(f))
+        elif f.endswith('.nc'):
+            tails.append(NetCDFTail(f, args.var or ['time']))
+        else:
+            tails.append(TextTail(f))
+
+    try:
+        for tail, data in follow(tails, args.interval, idle = args.idle):
+            if isinstance(tail, OutTail):
+                print('%s: step %d time %g' % (tail.path, tail.step, tail.time))
+            elif isinstance(tail, TextTail):
+                print('%s: steps %d-%d' % (tail.path, data[0][0], data[0][-1]))
+            else:
+                print('%s: %d records' % (tail.path, tail.record))
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,272 @@
+"""Convert MBDyn text output (.out, .mov, .jnt, .frc) to NetCDF.
+
+The variables are named as in MBDyn's own NetCDF output, so the result
+can be used with mbncplot.py and mbncindex.py:
+
+    time, run.step, run.timestep            from the .out file
+    node.struct.<label>.X, .E/.Phi/.R, .XP, .Omega[, .XPP, .OmegaP]
+                                            from the .mov file
+    elem.joint.<label>.f, .m, .F, .M        from the .jnt file
+
+Rotation matrices are stored as MBDyn does, i.e. variable[t, i, j] holds
+R[j, i]. Columns without a NetCDF counterpart (joint extra output, and
+the .frc file, whose layout depends on the element) are stored as
+<name>.txt variables holding the text columns, label excluded.
+
+The text files do not tell which orientation description was used in
+the .mov file; it is euler123 unless --orientation says otherwise, and
+nodes with six more columns are taken to output accelerations.
+
+The files are streamed in chunks of steps (see mbtxtread.py), so memory
+use does not depend on the length of the run; several runs are
+converted in parallel:
+
+    python mbtxt2nc.py run1 run2 'sweep/*.mov' --jobs 8 --zlib
+"""
+
+import os
+import sys
+import glob
+import argparse
+import multiprocessing
+
+import numpy as np
+import netCDF4 as nc
+
+import mbtxtread
+
+# name, size, units, description of the orientation variable of .mov files
+ORIENTATIONS = {
+    'euler123': ('E', 3, 'deg', 'orientation Euler angles (123) (E_X, E_Y, E_Z)'),
+    'euler313': ('E', 3, 'deg', 'orientation Euler angles (313) (E_X, E_Y, E_Z)'),
+    'euler321': ('E', 3, 'deg', 'orientation Euler angles (321) (E_X, E_Y, E_Z)'),
+    'phi': ('Phi', 3, 'radian', 'orientation vector (Phi_X, Phi_Y, Phi_Z)'),
+    'mat': ('R', 9, '-', 'orientation matrix (R11, R21, R31, R12, R22, R32, R13, R23, R33)'),
+}
+
+# units attributes, as set by MBDyn's "units" statement
+UNITS = {
+    'unspecified': {'Dimensionless': 'Dimensionless', 'Time': 'Time', \
+            'Length': 'Length', 'Velocity': 'Velocity', \
+            'Acceleration': 'Acceleration', 'AngularVelocity': 'Angular velocity', \
+            'AngularAcceleration': 'Angular acceleration', \
+            'Force': 'Force', 'Moment': 'Moment'},
+    'mks': {'Dimensionless': '-', 'Time': 's', 'Length': 'm', \
+            'Velocity': 'm s^-1', 'Acceleration': 'm s^-2', \
+            'AngularVelocity': 'rad s^-1', 'AngularAcceleration': 'rad s^-2', \
+            'Force': 'N', 'Moment': 'N m'},
+}
+
+# records per NetCDF chunk along time
+TIME_CHUNK = 1024
+
+class Writer:
+    """Thin wrapper of a NetCDF dataset laid out like MBDyn's output."""
+
+    def __init__(self, path, units = 'unspecified', zlib = False):
+        self.nd = nc.Dataset(path, 'w', format = 'NETCDF4')
+        self.units = UNITS[units]
+        self.zlib = zlib
+        self.nd.createDimension('time', None)
+        self.nd.createDimension('Vec1', 1)
+        self.nd.createDimension('Vec3', 3)
+
+    def dim(self, n):
+        name = 'Vec' + str(n)
+        if name not in self.nd.dimensions:
+            self.nd.createDimension(name, n)
+        return name
+
+    def var(self, name, shape, dim, description, vtype = None, dtype = 'f8'):
+        """Create variable name with trailing shape; dim is a key of
+        UNITS, or a literal units string."""
+        dims = ('time',) + tuple(self.dim(n) for n in shape)
+        v = self.nd.createVariable(name, dtype, dims, zlib = self.zlib, \
+                chunksizes = (TIME_CHUNK,) + tuple(shape))
+        v.units = self.units.get(dim, dim)
+        if vtype:
+            v.type = vtype
+        v.description = description
+        return v
+
+    def close(self):
+        self.nd.close()
+
+def _mov_fields(ncols, orientation):
+    """(name, columns, shape, units, description) of a node whose .mov
+    line has ncols values."""
+    rname, rsize, runits, rdesc = ORIENTATIONS[orientation]
+    base = 3 + rsize + 6
+    if ncols not in (base, base + 6):
+        return None
+    fields = [
+        ('X', slice(0, 3), (3,), 'Length', 'global position vector (X, Y, Z)'),
+        (rname, slice(3, 3 + rsize), (3, 3) if rsize == 9 else (3,), runits, 'global ' + rdesc),
+        ('XP', slice(3 + rsize, 6 + rsize), (3,), 'Velocity', 'global velocity vector (v_X, v_Y, v_Z)'),
+        ('Omega', slice(6 + rsize, 9 + rsize), (3,), 'AngularVelocity', \
+                'global angular velocity vector (omega_X, omega_Y, omega_Z)'),
+    ]
+    if ncols == base + 6:
+        fields += [
+            ('XPP', slice(9 + rsize, 12 + rsize), (3,), 'Acceleration', \
+                    'global acceleration vector (a_X, a_Y, a_Z)'),
+            ('OmegaP', slice(12 + rsize, 15 + rsize), (3,), 'AngularAcceleration', \
+                    'global angular acceleration vector (omegaP_X, omegaP_Y, omegaP_Z)'),
+        ]
+    return fields
+
+def _jnt_fields(ncols):
+    fields = [
+        ('f', slice(0, 3), (3,), 'Force', 'local reaction force (fx, fy, fz)'),
+        ('m', slice(3, 6), (3,), 'Moment', 'local reaction moment (mx, my, mz)'),
+        ('F', slice(6, 9), (3,), 'Force', 'global reaction force (FX, FY, FZ)'),
+        ('M', slice(9, 12), (3,), 'Moment', 'global reaction moment (MX, MY, MZ)'),
+    ]
+    if ncols < 12:
+        return None
+    if ncols > 12:
+        fields.append(('txt', slice(12, ncols), (ncols - 12,), 'Dimensionless', \
+                'extra text output columns'))
+    return fields
+
+def _txt_fields(ncols):
+    return [('txt', slice(0, ncols), (ncols,), 'Dimensionless', \
+            'text output columns, label excluded')]
+
+def _plan(w, prefix, lay, fields_of):
+    """Create the variables of each label; returns [(index, [(var,
+    columns, shape)])]."""
+    plan = []
+    for i, (label, ncols) in enumerate(zip(lay.labels, lay.ncols)):
+        fields = fields_of(int(ncols)) or _txt_fields(int(ncols))
+        name = prefix + '.' + str(label)
+        out = []
+        for sub, cols, shape, dim, desc in fields:
+            vtype = 'Mat3x3' if shape == (3, 3) else 'Vec3' if shape == (3,) else None
+            out.append((w.var(name + '.' + sub, shape, dim, desc, vtype), cols, shape))
+        plan.append((i, out))
+    return plan
+
+def _stream(w, path, prefix, fields_of, chunk, stop = None):
+    """Copy the text output path into the variables of w; returns the
+    number of steps written."""
+    with open(path, 'rb') as f:
+        lay = mbtxtread.layout(f)
+        if not len(lay.labels):
+            return 0
+        plan = _plan(w, prefix, lay, fields_of)
+        n = 0
+        for steps, data in mbtxtread.iter_steps(f, 0, stop, 1, None, chunk, lay):
+            a, b = steps[0], steps[-1] + 1
+            for i, out in plan:
+                for var, cols, shape in out:
+                    block = data[:, i, cols]
+                    if shape == (3, 3):
+                        # row-major text to MBDyn's column-major layout
+                        block = block.reshape(-1, 3, 3).transpose(0, 2, 1)
+                    var[a:b] = block
+            n = b
+    return n
+
+def convert(base, ncfile = None, orientation = 'euler123', units = 'unspecified', \
+        zlib = False, chunk = mbtxtread.CHUNK):
+    """Convert the text output files <base>.{out,mov,jnt,frc} that exist
+    into ncfile (default: <base>.nc); returns ncfile."""
+    if ncfile is None:
+        ncfile = base + '.nc'
+    w = Writer(ncfile + '.part', units, zlib)
+    try:
+        nsteps = []
+        for ext, prefix, fields_of in (
+                ('.mov', 'node.struct', lambda n: _mov_fields(n, orientation)),
+                ('.jnt', 'elem.joint', _jnt_fields),
+                ('.frc', 'elem.force', lambda n: None)):
+            if os.path.exists(base + ext):
+                nsteps.append(_stream(w, base + ext, prefix, fields_of, chunk))
+        if not nsteps:
+            raise IOError('no text output found for ' + base)
+        n = min(nsteps)
+
+        out = mbtxtread.read_out(base + '.out') if os.path.exists(base + '.out') else {}
+        if out and 'output' in out:
+            keep = out['output'] != 0
+            out = dict((k, v[keep]) for k, v in out.items())
+        if out and len(out['step']) >= n:
+            w.var('run.step', (), 'Dimensionless', 'time step index', dtype = 'i4')[:] = out['step'][:n]
+            w.var('time', (), 'Time', 'simulation time')[:] = out['time'][:n]
+            w.var('run.timestep', (), 'Time', 'integration time step')[:] = out['timestep'][:n]
+        else:
+            # no usable .out: index the records
+            if out:
+                sys.stderr.write('Warning: ' + base + '.out has ' + str(len(out['step'])) \
+                        + ' output steps, ' + str(n) + ' expected; time not converted\n')
+            w.var('run.step', (), 'Dimensionless', 'output record index', dtype = 'i4')[:] = np.arange(n)
+    finally:
+        w.close()
+    os.replace(ncfile + '.part', ncfile)
+    return ncfile
+
+def _convert(job):
+    base, kwargs = job
+    try:
+        return base, convert(base, **kwargs), None
+    except Exception as e:
+        return base, None, repr(e)
+
+def bases(paths):
+    """Run base names from paths: base names, or files/patterns whose
+    extension is stripped."""
+    out = []
+    for p in paths:
+        for q in (sorted(glob.glob(p)) if glob.has_magic(p) else [p]):
+            root, ext = os.path.splitext(q)
+            out.append(root if ext in ('.out', '.mov', '.jnt', '.frc') else q)
+    return sorted(set(out))
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(\
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description='Convert MBDyn text output to NetCDF.', epilog=__doc__)
+    parser.add_argument('runs', nargs='+', \
+            help='run base names, or output files/patterns of the runs')
+    parser.add_argument('--orientation', choices=sorted(ORIENTATIONS), \
+            default='euler123', help='orientation description in .mov (default: %(default)s)')
+    parser.add_argument('--units', choices=sorted(UNITS), default='unspecified')
+    parser.add_argument('--zlib', action='store_true', help='compress variables')
+    parser.add_argument('--outdir', '-o', help='write <run>.nc here instead of next to the run')
+    parser.add_argument('--jobs', '-j', type=int, \
+            help='runs converted in parallel (default: number of cores)')
+    args = parser.parse_args(argv)
+
+    tasks = []
+    for base in bases(args.runs):
+        ncfile = None
+        if args.outdir:
+            ncfile = os.path.join(args.outdir, os.path.basename(base) + '.nc')
+        tasks.append((base, {'ncfile': ncfile, 'orientation': args.orientation, \
+                'units': args.units, 'zlib': args.zlib}))
+    if args.outdir and not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+
+    if args.jobs == 1 or len(tasks) == 1:
+        results = map(_convert, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(args.jobs)
+        results = pool.imap_unordered(_convert, tasks)
+    failed = 0
+    try:
+        for base, ncfile, error in results:
+            if error:
+                print('Error: ' + base + ': ' + error)
+                failed += 1
+            else:
+                print(base + ' -> ' + ncfile)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
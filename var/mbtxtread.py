@@ -0,0 +1,415 @@
+"""Readers for MBDyn text output files (.mov, .ine, .jnt, .frc, .act, ...).
+
+These files contain one line per output entity and per time step:
+
+    label value value ...
+
+with all the entities written in the same order at each step, so a step
+ends where the first label appears again. The number of values can
+differ between entities (e.g. joints with extra output, nodes with a
+different orientation description), but not between steps.
+
+The data is returned as float arrays shaped (steps, labels, columns),
+where the label column is dropped and shorter rows are padded with NaN.
+Files are parsed in chunks of whole lines with a vectorized tokenizer
+(numpy's C parsers, optionally on several chunks in parallel), so
+memory use is bounded by the chunk size and by the requested window:
+
+    import mbtxtread
+    out = mbtxtread.read('run.mov', start = 100, stop = 200, labels = [1000, 2000])
+    out.data[:, 0, 0:3]     # position of node 1000, steps 100-199
+
+    for steps, data in mbtxtread.iter_steps('run.jnt'):
+        ...
+
+step_index() builds, in one pass, the byte offset of each step and caches
+it in a sidecar, so that any step can be reached with a seek:
+
+    out = mbtxtread.read('run.mov', start = k, stop = k + 1, offsets = True)
+"""
+
+import io
+import os
+import sys
+import zlib
+import argparse
+import warnings
+import multiprocessing
+from collections import deque
+from collections import namedtuple
+
+import numpy as np
+
+# default number of bytes read at once
+CHUNK = 1 << 26
+
+# sidecar with the byte offsets of the steps
+STEPS_SUFFIX = '.steps.npz'
+
+# bytes at the head of a file checked before extending its sidecar
+HEAD = 1 << 16
+
+# labels, ncols: entities of a step and number of values (label excluded) of each
+Layout = namedtuple('Layout', ['labels', 'ncols'])
+
+# steps: 0-based step indexes; data: (steps, labels, columns)
+TextOutput = namedtuple('TextOutput', ['labels', 'steps', 'data'])
+
+def layout(f):
+    """Return the Layout of the file (name or binary file object) f,
+    reading only its first step. The file position is restored."""
+    if not hasattr(f, 'read'):
+        with open(f, 'rb') as fp:
+            return layout(fp)
+
+    pos = f.tell()
+    labels = []
+    ncols = []
+    seen = set()
+    try:
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            label = int(fields[0])
+            if label in seen:
+                break
+            seen.add(label)
+            labels.append(label)
+            ncols.append(len(fields) - 1)
+    finally:
+        f.seek(pos)
+    return Layout(np.array(labels, dtype = np.int64), \
+            np.array(ncols, dtype = np.int64))
+
+def _tokens(buf, width = None):
+    """Parse whitespace-separated numbers in buf into a 1-D float array;
+    width, when all lines have width + 1 fields, enables the faster
+    numpy.loadtxt C parser."""
+    if width is not None:
+        return np.loadtxt(io.BytesIO(buf), dtype = np.float64, \
+                ndmin = 2).ravel()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        return np.fromstring(buf, dtype = np.float64, sep = ' ')
+
+def _parse(job):
+    return _tokens(*job)
+
+def skip_lines(f, n, chunk = CHUNK):
+    """Advance the binary file f past n lines; returns the number of
+    lines actually skipped (less than n at end of file)."""
+    skipped = 0
+    while skipped < n:
+        pos = f.tell()
+        buf = f.read(chunk)
+        if not buf:
+            break
+        count = buf.count(b'\n')
+        if skipped + count < n:
+            skipped += count
+            continue
+        # find the end of the n-th line in this buffer
+        end = -1
+        for i in range(n - skipped):
+            end = buf.index(b'\n', end + 1)
+        f.seek(pos + end + 1)
+        skipped = n
+    return skipped
+
+def _blocks(f, nl, chunk):
+    """Yield buffers of about chunk bytes holding whole steps of f."""
+    tail = b''
+    while True:
+        buf = f.read(chunk)
+        eof = not buf
+        if eof:
+            # tail is shorter than a step: it is either empty, an
+            # incomplete step, or ends with a line without newline
+            if not tail.strip() or tail.endswith(b'\n'):
+                break
+            buf = b'\n'
+        buf = tail + buf
+        end = _step_end(buf, nl)
+        if end > 0:
+            tail = buf[end:]
+            yield buf[:end]
+        else:
+            tail = buf
+        if eof:
+            break
+
+def index_steps(f, nl, chunk = CHUNK):
+    """Byte offsets of the step boundaries of the binary file f, with nl
+    lines per step, from the current position (which must be the start
+    of a step) on: the first element is the current position, the others
+    the ends of each complete step."""
+    pos = f.tell()
+    out = [np.array([pos], dtype = np.int64)]
+    line = 0
+    while True:
+        buf = f.read(chunk)
+        if not buf:
+            break
+        # absolute offsets of the beginning of the line after each newline
+        ends = np.flatnonzero(np.frombuffer(buf, dtype = np.uint8) == 10) + (pos + 1)
+        first = (-line - 1) % nl
+        out.append(ends[first::nl])
+        line += len(ends)
+        pos += len(buf)
+    return np.concatenate(out)
+
+def _head_crc(f, n):
+    """CRC-32 of the first n bytes of the binary file f."""
+    f.seek(0)
+    return zlib.crc32(f.read(n)) & 0xffffffff
+
+def step_index(path, chunk = CHUNK, write = True):
+    """Step offsets of the text output path (see index_steps()), cached
+    in the sidecar <path>.steps.npz. A stale sidecar is extended when the
+    file grew (a running simulation) with the same head, and a step
+    boundary where the last indexed step ends; it is rebuilt otherwise
+    (e.g. the file was replaced by a rerun)."""
+    st = os.stat(path)
+    cache = path + STEPS_SUFFIX
+    with open(path, 'rb') as f:
+        lay = layout(f)
+        nl = len(lay.labels)
+        offsets = None
+        try:
+            z = np.load(cache)
+            if int(z['nl']) == nl and int(z['size']) <= st.st_size:
+                offsets = z['offsets']
+                if int(z['size']) == st.st_size and float(z['mtime']) == st.st_mtime:
+                    return offsets
+                # same file, grown since: same head, and a newline
+                # before the first step not indexed yet
+                end = int(offsets[-1])
+                if _head_crc(f, int(z['head_len'])) != int(z['head_crc']):
+                    offsets = None
+                elif end > 0:
+                    f.seek(end - 1)
+                    if f.read(1) != b'\n':
+                        offsets = None
+        except (IOError, OSError, ValueError, KeyError):
+            offsets = None
+        if not nl:
+            return np.zeros(1, dtype = np.int64)
+        head_len = min(HEAD, st.st_size)
+        head_crc = _head_crc(f, head_len)
+        if offsets is None:
+            f.seek(0)
+            offsets = index_steps(f, nl, chunk)
+        else:
+            # resume after the last indexed step
+            f.seek(offsets[-1])
+            offsets = np.concatenate((offsets[:-1], index_steps(f, nl, chunk)))
+    if write:
+        try:
+            with open(cache + '.tmp', 'wb') as f:
+                np.savez(f, offsets = offsets, nl = nl, size = st.st_size, \
+                        mtime = st.st_mtime, head_len = head_len, head_crc = head_crc)
+            os.replace(cache + '.tmp', cache)
+        except (IOError, OSError):
+            # read-only location: just don't cache
+            pass
+    return offsets
+
+def iter_steps(f, start = 0, stop = None, stride = 1, labels = None, \
+        chunk = CHUNK, lay = None, jobs = 1, offsets = None):
+    """Yield (steps, data) blocks of whole time steps of the text output
+    f (file name or binary file object), with steps the 0-based indexes
+    of the steps in the block and data shaped (len(steps), labels,
+    columns). start, stop and stride select steps; labels selects
+    entities, in the given order. Lines before start are skipped by
+    counting newlines, without parsing them. An incomplete trailing step
+    (e.g. of a running simulation) is ignored. With jobs > 1, chunks are
+    parsed by a pool of processes. offsets, the step offsets of f from
+    step_index() (or True, to use its sidecar), allows seeking to start
+    directly, and reading just the bytes up to stop."""
+    if not hasattr(f, 'read'):
+        if offsets is True:
+            offsets = step_index(f)
+        with open(f, 'rb') as fp:
+            for block in iter_steps(fp, start, stop, stride, labels, \
+                    chunk, lay, jobs, offsets):
+                yield block
+        return
+
+    if lay is None:
+        lay = layout(f)
+    nl = len(lay.labels)
+    if nl == 0:
+        return
+    ncmax = int(lay.ncols.max())
+    width = ncmax if np.all(lay.ncols == ncmax) else None
+    # offsets of the label of each entity within the tokens of a step
+    offs = np.concatenate(([0], np.cumsum(lay.ncols + 1)[:-1]))
+    per_step = int(np.sum(lay.ncols + 1))
+
+    if labels is not None:
+        where = dict((l, i) for i, l in enumerate(lay.labels))
+        try:
+            sel = np.array([where[int(l)] for l in labels], dtype = np.int64)
+        except KeyError as e:
+            raise KeyError('label ' + str(e.args[0]) + ' not found')
+    else:
+        sel = None
+
+    start = start or 0
+    stride = stride or 1
+    step = start
+    if offsets is not None and len(offsets) > 1:
+        known = len(offsets) - 1
+        f.seek(offsets[min(step, known)])
+        if stop is not None and stop <= known:
+            chunk = max(1, min(chunk, int(offsets[stop] - offsets[min(step, stop)])))
+        step -= min(step, known)
+    if step:
+        if skip_lines(f, step*nl, chunk) < step*nl:
+            return
+    step = start
+
+    pool = None
+    if jobs is None or jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        # bounded read-ahead
+        pending = deque()
+        depth = 2*(jobs or multiprocessing.cpu_count())
+    try:
+        blocks = _blocks(f, nl, chunk)
+        while stop is None or step < stop:
+            if pool is None:
+                buf = next(blocks, None)
+                if buf is None:
+                    break
+                tok = _tokens(buf, width)
+            else:
+                for buf in blocks:
+                    pending.append(pool.apply_async(_parse, ((buf, width),)))
+                    if len(pending) >= depth:
+                        break
+                if not pending:
+                    break
+                tok = pending.popleft().get()
+
+            if len(tok) % per_step:
+                raise ValueError('layout changes after step ' + str(step))
+            k = len(tok)//per_step
+            tok = tok.reshape(k, per_step)
+            if np.any(tok[:, offs] != lay.labels):
+                raise ValueError('unexpected labels after step ' + str(step))
+
+            if width is not None:
+                data = tok.reshape(k, nl, width + 1)[:, :, 1:]
+            else:
+                data = np.full((k, nl, ncmax), np.nan)
+                for i in range(nl):
+                    data[:, i, :lay.ncols[i]] = \
+                            tok[:, offs[i] + 1:offs[i] + 1 + lay.ncols[i]]
+
+            steps = np.arange(step, step + k)
+            keep = ((steps - start) % stride == 0)
+            if stop is not None:
+                keep &= steps < stop
+            if sel is not None:
+                data = data[:, sel]
+            if not keep.all():
+                steps = steps[keep]
+                data = data[keep]
+            step += k
+            if len(steps):
+                yield steps, data
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+def _step_end(buf, nl):
+    """Byte offset just past the last complete step in buf (whose first
+    line is the first of a step), or 0."""
+    lines = buf.count(b'\n')
+    nsteps = lines//nl
+    if nsteps == 0:
+        return 0
+    if nsteps*nl == lines:
+        return buf.rindex(b'\n') + 1
+    # drop the lines of the incomplete step
+    end = len(buf)
+    for i in range(lines - nsteps*nl + 1):
+        end = buf.rindex(b'\n', 0, end)
+    return end + 1
+
+def read(f, start = 0, stop = None, stride = 1, labels = None, \
+        chunk = CHUNK, jobs = 1, offsets = None):
+    """Read the text output f into a TextOutput(labels, steps, data);
+    arguments as in iter_steps()."""
+    if not hasattr(f, 'read'):
+        if offsets is True:
+            offsets = step_index(f)
+        with open(f, 'rb') as fp:
+            return read(fp, start, stop, stride, labels, chunk, jobs, offsets)
+
+    lay = layout(f)
+    blocks = list(iter_steps(f, start, stop, stride, labels, chunk, lay, \
+            jobs, offsets))
+    sel = lay.labels if labels is None else np.array(labels, dtype = np.int64)
+    if not blocks:
+        ncols = int(lay.ncols.max()) if len(lay.ncols) else 0
+        return TextOutput(sel, np.zeros(0, dtype = np.int64), \
+                np.zeros((0, len(sel), ncols)))
+    return TextOutput(sel, np.concatenate([b[0] for b in blocks]), \
+            np.concatenate([b[1] for b in blocks]))
+
+# columns of the "Step" lines of the .out file
+OUT_COLUMNS = ('step', 'time', 'timestep', 'iterations', 'residual', \
+        'solution', 'converged', 'output')
+
+def parse_out(buf):
+    """Parse the "Step" lines in buf (contents of an .out file) into a
+    dict {column: array}; see OUT_COLUMNS. Older versions of MBDyn do not
+    write all the columns."""
+    rows = [l[5:] for l in buf.splitlines() if l.startswith(b'Step ')]
+    if not rows:
+        return {}
+    ncols = min(len(r.split()) for r in rows)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        data = np.fromstring(b' '.join(b' '.join(r.split()[:ncols]) \
+                for r in rows), dtype = np.float64, sep = ' ')
+    data = data.reshape(len(rows), ncols)
+    out = dict((name, data[:, i]) for i, name in enumerate(OUT_COLUMNS[:ncols]))
+    out['step'] = out['step'].astype(np.int64)
+    return out
+
+def read_out(f):
+    """Read the "Step" lines of the .out file f; see parse_out()."""
+    if not hasattr(f, 'read'):
+        with open(f, 'rb') as fp:
+            return read_out(fp)
+    return parse_out(f.read())
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(\
+            description='Parse an MBDyn text output file and print a summary.')
+    parser.add_argument('file', help='.mov, .ine, .jnt, .frc, .act, ... file')
+    parser.add_argument('--start', type=int, default=0, help='first step')
+    parser.add_argument('--stop', type=int, help='last step (excluded)')
+    parser.add_argument('--stride', type=int, default=1)
+    parser.add_argument('--labels', type=int, nargs='+', help='labels to read')
+    parser.add_argument('--jobs', '-j', type=int, default=1, \
+            help='parser processes (0: one per core)')
+    parser.add_argument('--index', action='store_true', \
+            help='use (and build) the step offset sidecar')
+    parser.add_argument('--save', help='save labels, steps and data to a .npz file')
+    args = parser.parse_args(argv)
+
+    out = read(args.file, args.start, args.stop, args.stride, args.labels, \
+            jobs = args.jobs or None, offsets = args.index or None)
+    print('%d steps, %d labels, %d columns' % out.data.shape)
+    if args.save:
+        np.savez(args.save, labels = out.labels, steps = out.steps, data = out.data)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import mbmodal
+
+def _skew(v):
+    return np.array([[0., -v[2], v[1]], [v[2], 0., -v[0]], [-v[1], v[0], 0.]])
+
+def _invariants(data):
+    """Rigid-body mass, static moment, inertia about the origin and
+    invariants 3, 4, 8, 5, 9 of data, node by node as in modal.cc."""
+    N = data.nmodes
+    mass, S, J = 0., np.zeros(3), np.zeros((3, 3))
+    inv3, inv4 = np.zeros((3, N)), np.zeros((3, N))
+    inv8, inv5, inv9 = np.zeros((N, 3, 3)), np.zeros((N, N, 3)), np.zeros((N, N, 3, 3))
+    for i in range(data.nnodes):
+        mi, ui, Ji = data.lumped[i, 0], data.X[i], np.diag(data.lumped[i, 3:6])
+        mass += mi
+        S += mi*ui
+        J += Ji - mi*_skew(ui).dot(_skew(ui))
+        for j in range(N):
+            PHItij, PHIrij = data.shapes[j, i, 0:3], data.shapes[j, i, 3:6]
+            inv3[:, j] += mi*PHItij
+            inv4[:, j] += mi*_skew(ui).dot(PHItij) + Ji.dot(PHIrij)
+            inv8[j] += -_skew(ui).dot(_skew(mi*PHItij))
+            for k in range(N):
+                inv5[j, k] += _skew(mi*PHItij).dot(data.shapes[k, i, 0:3])
+                inv9[j, k] += _skew(mi*PHItij).dot(_skew(data.shapes[k, i, 0:3]))
+    return mass, S, J, inv3, inv4, inv8, inv5, inv9
+
+class TestMbModal(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        nnodes, nmodes = 12, 4
+        lumped = np.repeat(rng.uniform(.1, 1., (nnodes, 1)), 6, axis = 1)
+        lumped[:, 3:6] = rng.uniform(.01, .1, (nnodes, 3))
+        self.data = mbmodal.ModalData([str(1001 + n) for n in range(nnodes)],
+            rng.normal(size = (nnodes, 3)), rng.normal(size = (nmodes, nnodes, 6)),
+            np.eye(nmodes), np.diag(rng.uniform(1., 100., nmodes)),
+            lumped = lumped, counts = (2, 1, 1))
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_subset_nodes_keeps_inertia(self):
+        d = self.data
+        mass, S, J, inv3, inv4, inv8, inv5, inv9 = _invariants(d)
+        s = mbmodal.subset_nodes(d, ['1001', '1003'])
+        self.assertIsNone(s.lumped)
+        self.assertAlmostEqual(s.inertia.mass, mass)
+        xcm = S/mass
+        np.testing.assert_allclose(s.inertia.xcm, xcm)
+        # RECORD GROUP 12 holds the inertia about the center of mass
+        np.testing.assert_allclose(s.inertia.J - mass*_skew(xcm).dot(_skew(xcm)), J)
+        np.testing.assert_allclose(s.invariants[14], inv3, atol = 1.e-12)
+        np.testing.assert_allclose(s.invariants[15], inv4, atol = 1.e-12)
+        np.testing.assert_allclose(s.invariants[16], inv8.transpose(1, 0, 2), atol = 1.e-12)
+        np.testing.assert_allclose(s.invariants[17], inv5.transpose(2, 0, 1), atol = 1.e-12)
+        np.testing.assert_allclose(mbmodal.lumped_invariants(d)[18], inv9.transpose(2, 0, 1, 3),
+            atol = 1.e-12)
+        self.assertNotIn(18, s.invariants)
+
+        # and they survive the file
+        path = os.path.join(self.tmp, 'subset.fem')
+        mbmodal.write(path, s, precision = 16)
+        r = mbmodal.read(path)
+        self.assertEqual(list(r.nodes), ['1001', '1003'])
+        self.assertIsNone(r.lumped)
+        self.assertAlmostEqual(r.inertia.mass, mass)
+        np.testing.assert_allclose(r.inertia.J, s.inertia.J)
+        self.assertEqual(sorted(r.invariants), [14, 15, 16, 17])
+        for rid in r.invariants:
+            np.testing.assert_allclose(r.invariants[rid], s.invariants[rid], atol = 1.e-14)
+
+    def test_subset_nodes_keeps_group_12(self):
+        d = self.data
+        d.inertia = mbmodal.Inertia(5., np.ones(3), np.eye(3))
+        s = mbmodal.subset_nodes(d, ['1002'])
+        self.assertEqual(s.inertia.mass, 5.)
+        np.testing.assert_allclose(s.invariants[14], _invariants(d)[3], atol = 1.e-12)
+
+    def test_subset_nodes_adds_to_invariants(self):
+        d = self.data
+        d.invariants = {18: np.ones((3, 4, 4, 3))}
+        s = mbmodal.subset_nodes(d, ['1002'])
+        np.testing.assert_allclose(s.invariants[18], mbmodal.lumped_invariants(d)[18] + 1.)
+
+    def test_select_modes_invariants(self):
+        self.data.invariants = {18: np.zeros((3, 4, 4, 3))}
+        s = mbmodal.subset_nodes(self.data, ['1001', '1003'])
+        r = mbmodal.select_modes(s, [0, 2])
+        np.testing.assert_allclose(r.invariants[17], s.invariants[17][:, [0, 2]][:, :, [0, 2]])
+        np.testing.assert_allclose(r.invariants[18], s.invariants[18][:, [0, 2]][:, :, [0, 2]])
+
+    def test_select_modes_groups_kinds(self):
+        # modes 0, 1 normal, 2 attachment, 3 constraint
+        r = mbmodal.select_modes(self.data, [3, 2, 1])
+        self.assertEqual(r.counts, (1, 1, 1))
+        np.testing.assert_array_equal(r.shapes, self.data.shapes[[1, 2, 3]])
+        np.testing.assert_array_equal(r.K, self.data.K[np.ix_([1, 2, 3], [1, 2, 3])])
+        np.testing.assert_array_equal(mbmodal.mode_order(self.data, [3, 1, 0, 2]), [1, 0, 2, 3])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import mbtxtread
+
+def _mov(values):
+    """Text output of 2 nodes, one step per value."""
+    return ''.join('1 %s 0 0\n2 %s 0 0\n' % (v, v) for v in values).encode()
+
+class TestMbTxtRead(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'run.mov')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, values, mode = 'wb'):
+        with open(self.path, mode) as f:
+            f.write(_mov(values))
+
+    def fresh(self):
+        with open(self.path, 'rb') as f:
+            return mbtxtread.index_steps(f, 2)
+
+    def test_step_index_extends_grown_file(self):
+        self.write(['1.', '2.'])
+        mbtxtread.step_index(self.path)
+        self.write(['3.', '4.'], 'ab')
+        offsets = mbtxtread.step_index(self.path)
+        self.assertEqual(len(offsets), 5)
+        np.testing.assert_array_equal(offsets, self.fresh())
+
+    def test_step_index_rebuilds_replaced_file(self):
+        self.write(['1.', '2.'])
+        mbtxtread.step_index(self.path)
+        # a rerun: longer file, steps of other lengths
+        self.write(['10.5', '20.25', '30.125'])
+        np.testing.assert_array_equal(mbtxtread.step_index(self.path), self.fresh())
+
+    def test_step_index_checks_resume_point(self):
+        # same head, but the old last offset is not a step boundary
+        head, mbtxtread.HEAD = mbtxtread.HEAD, 8
+        try:
+            self.write(['1.', '2.'])
+            mbtxtread.step_index(self.path)
+            self.write(['1.', '2.5', '3.'])
+            np.testing.assert_array_equal(mbtxtread.step_index(self.path), self.fresh())
+        finally:
+            mbtxtread.HEAD = head
+
+if __name__ == '__main__':
+    unittest.main()